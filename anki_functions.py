@@ -1,45 +1,244 @@
 # anki_functions.py
 import os
+import logging
 import requests
 import json
-import google.generativeai as genai
+import base64
 from dotenv import load_dotenv
 import re
+from recorder import cronometrar
+from task_manager import comprobar_cancelacion
+from llm_backends import crear_backend
+from card_schema import describir_campos, recortar, en_tarjeta, en_vista_previa, campos_nucleo, campos_extra, campos_pendientes, campo_por_nombre
+
+logger = logging.getLogger(__name__)
 
 # --- Configuración de la API y AnkiConnect ---
 load_dotenv()
-api_key = os.getenv("GOOGLE_API_KEY")
 
-if not api_key:
-    raise ValueError("Error: La clave de API no está configurada. Asegúrate de crear un archivo .env con GOOGLE_API_KEY.")
+ANKICONNECT_URL = os.getenv("ANKICONNECT_URL", "http://localhost:8765")
 
-genai.configure(api_key=api_key)
-model = genai.GenerativeModel('gemini-2.5-flash')
 
-def obtener_info_completa_ia(palabra_en_ingles):
+class ErrorAnkiConnect(Exception):
+    """AnkiConnect no respondió o devolvió un error (solo con lanzar=True)"""
+
+# Backend de IA (LLM_BACKEND: gemini, openai o falso); ver llm_backends.py
+backend_ia = crear_backend()
+
+# Métricas de las actualizaciones incrementales de notas
+METRICAS_EDICION = {
+    "escrituras": 0,          # llamadas updateNoteFields enviadas
+    "omitidas": 0,            # ediciones sin cambios que no llamaron a AnkiConnect
+    "campos_enviados": 0,
+    "campos_omitidos": 0,
+    "bytes_enviados": 0,      # tamaño de los payloads enviados
+    "bytes_completos": 0      # tamaño que habrían tenido reescribiendo Front y Back
+}
+
+# Métricas de la generación en dos fases
+METRICAS_FASES = {
+    "nucleo": 0,              # palabras generadas solo con los campos del núcleo
+    "extras": 0               # palabras a las que después se les generaron los extras
+}
+
+def enviar_a_ankiconnect(payload, timeout=None):
     """
-    Obtiene la información completa sobre una palabra usando la IA de Gemini.
+    Envía una acción a AnkiConnect y devuelve la respuesta HTTP.
+    Todas las llamadas a AnkiConnect pasan por aquí para poder medirlas
+    (y para no enviarlas si la tarea del usuario ya se canceló).
     """
-    prompt = f""". Estoy aprendiendo ingles. Proporciona información completa y detallada sobre la palabra en inglés "{palabra_en_ingles}". Responde únicamente con el objeto JSON y no incluyas texto adicional.
+    comprobar_cancelacion()
+    with cronometrar("anki", payload.get("action")):
+        return requests.post(ANKICONNECT_URL, json=payload, timeout=timeout)
+
+def construir_prompt_palabra(palabra_en_ingles, campos=None):
+    """Prompt para una palabra con los campos y longitudes del esquema de tarjeta (o solo `campos`)"""
+    return f""". Estoy aprendiendo ingles. Proporciona información concisa sobre la palabra en inglés "{palabra_en_ingles}". Responde únicamente con el objeto JSON.
+
+    JSON {{
+{describir_campos(campos=campos)}
+    }}"""
+
+def construir_prompt_extras(palabra_en_ingles, datos_nucleo):
+    """Prompt de la segunda fase: los extras, coherentes con los significados ya generados"""
+    significado = datos_nucleo.get('Significado', '')
+    if isinstance(significado, list):
+        significado = ", ".join(str(s) for s in significado)
+    return f""". Estoy aprendiendo ingles. Completa la información sobre la palabra en inglés "{palabra_en_ingles}" (significado: {significado}). Responde únicamente con el objeto JSON.
 
     JSON {{
-        "Palabra": "{palabra_en_ingles}",
-        "Significado": "[Lista con los significados en español]. Solo palabra clave o frase corta sin oraciones completas",
-        "Pronunciacion": "La pronunciación fonética simplificada en español. No la pronunciación oficial, sino en español, por ejemplo Hello = /jelou/ o Help=/jelp/",
-        "Gramatica": "Incluye el infinitivo, los tiempos verbales y las conjugaciones más comunes (si aplica)",
-        "Etimologia": "Explica el origen y la historia de la palabra, algo para ayudar a memorizarla",
-        "Oracion_Comun": "Una oracion en ingles, de ejemplo en contexto general",
-        "Oracion_medica": "Una oracion en ingles, de ejemplo en contexto médico",
+{describir_campos(campos=campos_extra())}
     }}"""
 
+def construir_prompt_lote(palabras):
+    """Prompt para varias palabras (una lista JSON con un objeto por palabra)"""
+    lista = ", ".join(f'"{palabra}"' for palabra in palabras)
+    return f""". Estoy aprendiendo ingles. Proporciona información concisa sobre cada una de estas palabras en inglés: {lista}. Responde únicamente con una lista JSON con un objeto por palabra, en el mismo orden.
+
+    [{{
+{describir_campos()}
+    }}]"""
+
+def construir_prompt_campo(nombre_campo, datos_json):
+    """
+    Prompt corto para regenerar un solo campo, con el resto del borrador como contexto.
+    La respuesta es texto plano (una línea por elemento en los campos de lista) para poder mostrarla en streaming.
+    """
+    campo = campo_por_nombre(nombre_campo)
+    if campo is None:
+        raise ValueError(f"Campo desconocido: {nombre_campo}")
+    if campo.es_lista:
+        formato = f"Como máximo {campo.max_elementos} elementos de {campo.max_caracteres} caracteres, uno por línea"
+    else:
+        formato = f"Máximo {campo.max_caracteres} caracteres, en una sola línea"
+    contexto = []
+    for nombre in ('Significado', 'Pronunciacion', 'Oracion_Comun', 'Oracion_medica'):
+        valor = datos_json.get(nombre)
+        if nombre != nombre_campo and valor:
+            contexto.append(f"{nombre}: {', '.join(valor) if isinstance(valor, list) else valor}")
+    actual = datos_json.get(nombre_campo)
+    if isinstance(actual, list):
+        actual = ", ".join(actual)
+    return f""". Estoy aprendiendo ingles. Escribe de nuevo un campo de la tarjeta de la palabra en inglés "{datos_json.get('Palabra', '')}".
+Campo: {nombre_campo}
+Instrucción: {campo.instruccion}. {formato}.
+Resto de la tarjeta: {'; '.join(contexto) or '-'}
+Valor actual (propón uno mejor y distinto): {actual or '-'}
+Responde solo con el nuevo texto, sin comillas, sin JSON y sin explicaciones."""
+
+def regenerar_campo_stream(nombre_campo, datos_json):
+    """Genera un nuevo valor para un campo y lo devuelve por trozos a medida que llega"""
+    return backend_ia.generar_stream(construir_prompt_campo(nombre_campo, datos_json))
+
+def interpretar_campo(nombre_campo, texto):
+    """Convierte el texto regenerado en el valor del campo (lista para Significado), recortado al esquema"""
+    campo = campo_por_nombre(nombre_campo)
+    texto = texto.strip().replace("```", "")
+    if campo is not None and campo.es_lista:
+        valor = [re.sub(r'^(?:[-•*]|\d+[.)])\s*', '', linea.strip()).strip('"') for linea in texto.split('\n')]
+        valor = [elemento for elemento in valor if elemento]
+    else:
+        valor = " ".join(texto.split()).strip('"')
+    return recortar({nombre_campo: valor})[nombre_campo]
+
+def generar_json(prompt):
+    """Llama al backend y devuelve el JSON de la respuesta (recortado al esquema) o None"""
     try:
-        response = model.generate_content(prompt)
-        json_limpio = response.text.strip().replace("```json", "").replace("```", "")
+        json_limpio = backend_ia.generar(prompt).strip().replace("```json", "").replace("```", "")
         datos_json = json.loads(json_limpio)
-        return datos_json
+        return recortar(datos_json) if isinstance(datos_json, dict) else None
     except Exception as e:
-        print(f"Error al obtener información de IA: {e}")
+        logger.error("Error al obtener información de IA: %s", e)
+        return None
+
+def obtener_info_completa_ia(palabra_en_ingles):
+    """
+    Obtiene la información completa sobre una palabra usando el backend de IA configurado.
+    """
+    return generar_json(construir_prompt_palabra(palabra_en_ingles))
+
+def obtener_info_nucleo_ia(palabra_en_ingles):
+    """
+    Primera fase: solo los campos del núcleo (significado y pronunciación),
+    suficientes para decidir si crear la tarjeta.
+    """
+    datos_json = generar_json(construir_prompt_palabra(palabra_en_ingles, campos_nucleo()))
+    if datos_json is not None:
+        # Solo se guarda lo pedido aunque la IA devuelva más campos
+        nombres = {campo.nombre for campo in campos_nucleo()}
+        datos_json = {nombre: valor for nombre, valor in datos_json.items() if nombre in nombres}
+        METRICAS_FASES["nucleo"] += 1
+    return datos_json
+
+def obtener_info_extras_ia(palabra_en_ingles, datos_nucleo):
+    """
+    Segunda fase: genera los campos extra y devuelve los datos del núcleo completados con ellos.
+    Lo que ya existe en datos_nucleo no se sobrescribe.
+    """
+    extras = generar_json(construir_prompt_extras(palabra_en_ingles, datos_nucleo))
+    if extras is None:
         return None
+    METRICAS_FASES["extras"] += 1
+    completos = dict(datos_nucleo)
+    for campo in campos_extra():
+        completos.setdefault(campo.nombre, extras.get(campo.nombre, ""))
+    return completos
+
+def obtener_info_lote_ia(palabras):
+    """
+    Obtiene la información de varias palabras con una sola llamada a la IA.
+    Devuelve un dict {palabra: datos_json} con las palabras que se pudieron generar.
+    """
+    if not palabras:
+        return {}
+    prompt = construir_prompt_lote(palabras)
+
+    try:
+        json_limpio = backend_ia.generar(prompt).strip().replace("```json", "").replace("```", "")
+        lista_datos = json.loads(json_limpio)
+    except Exception as e:
+        logger.error("Error al obtener información de IA en lote: %s", e)
+        return {}
+
+    pedidas = {palabra.lower(): palabra for palabra in palabras}
+    resultado = {}
+    for datos_json in lista_datos if isinstance(lista_datos, list) else []:
+        if not isinstance(datos_json, dict):
+            continue
+        palabra = pedidas.get(str(datos_json.get('Palabra', '')).strip().lower())
+        if palabra is not None:
+            resultado[palabra] = recortar(datos_json)
+    return resultado
+
+def construir_campos_nota(datos_json):
+    """
+    Construye los campos Front y Back de una nota a partir de los datos.
+    - Front: Palabra (Pronunciacion) [sound:audio]
+    - Back: Significados + Oraciones
+    """
+    # CREAR CONTENIDO FRONT (SIMPLIFICADO)
+    contenido_front = f"{datos_json.get('Palabra', '')}"
+    if datos_json.get('Pronunciacion') and en_tarjeta('Pronunciacion'):
+        contenido_front += f" ({datos_json.get('Pronunciacion')})"
+    # Audio de pronunciación ya subido a la colección (ver pronunciation_audio.py)
+    if datos_json.get('Audio'):
+        contenido_front += f" [sound:{datos_json.get('Audio')}]"
+    
+    # CREAR CONTENIDO BACK (SIGNIFICADOS + ORACIONES)
+    contenido_back = ""
+    if en_tarjeta('Significado'):
+        if isinstance(datos_json.get('Significado'), list):
+            for significado in datos_json.get('Significado'):
+                contenido_back += f"• {significado}<br>"
+        else:
+            contenido_back = f"{datos_json.get('Significado', '')}<br>"
+    
+    # Agregar oraciones al BACK
+    if datos_json.get('Oracion_Comun') and en_tarjeta('Oracion_Comun'):
+        contenido_back += f"<br>💬 <i>{datos_json.get('Oracion_Comun')}</i>"
+    
+    if datos_json.get('Oracion_medica') and en_tarjeta('Oracion_medica'):
+        contenido_back += f"<br>🏥 <i>{datos_json.get('Oracion_medica')}</i>"
+    
+    return {"Front": contenido_front, "Back": contenido_back}
+
+# Campos de datos_anki de los que depende cada campo de la nota
+DEPENDENCIAS_CAMPOS = {
+    "Front": ("Palabra", "Pronunciacion", "Audio"),
+    "Back": ("Significado", "Oracion_Comun", "Oracion_medica")
+}
+
+def calcular_campos_modificados(campos_nuevos, campos_originales):
+    """
+    Devuelve solo los campos cuyo contenido cambió respecto a la nota original.
+    Sin campos originales se consideran todos modificados.
+    """
+    if not campos_originales:
+        return dict(campos_nuevos)
+    return {
+        nombre: valor for nombre, valor in campos_nuevos.items()
+        if campos_originales.get(nombre) != valor
+    }
 
 def crear_tarjeta_anki(datos_json, modelName, deck_name):
     """
@@ -48,41 +247,19 @@ def crear_tarjeta_anki(datos_json, modelName, deck_name):
     - Front: Palabra (Pronunciacion)
     - Back: Significados + Oraciones
     """
-    print(f"=== DEBUG crear_tarjeta_anki ===")
-    print(f"modelName recibido: {modelName}")
-    print(f"deck_name recibido: {deck_name}")
+    logger.debug("crear_tarjeta_anki: modelName=%s deck_name=%s", modelName, deck_name)
     
     # Verificar conexión con AnkiConnect primero
     try:
-        test_response = requests.post("http://localhost:8765", 
-                                    json={"action": "version", "version": 6}, 
-                                    timeout=5)
+        test_response = enviar_a_ankiconnect({"action": "version", "version": 6}, timeout=5)
         if test_response.status_code != 200:
             return {"error": "No se puede conectar con Anki. ¿Está Anki ejecutándose?"}
     except Exception as e:
         return {"error": f"No se puede conectar con AnkiConnect: {str(e)}"}
 
-    # Mapear nombres a los que realmente existen en Anki
-    model_map = {
-        "basic_card": "Basic",
-        "reversed_card": "Basic (and reversed card)",
-        "Basic": "Basic", 
-        "Basic (and reversed card)": "Basic (and reversed card)"
-    }
-    
-    deck_map = {
-        "deck_step1": "0 USA::STEP 1",
-        "deck_self_learning": "0 USA::Self-Learning", 
-        "0 USA::STEP 1": "0 USA::STEP 1",
-        "0 USA::Self-Learning": "0 USA::Self-Learning"
-    }
-    
-    # Usar nombres mapeados o los originales
-    final_model = model_map.get(modelName, "Basic")
-    final_deck = deck_map.get(deck_name, deck_name)
-    
-    print(f"modelName final: {final_model}")
-    print(f"deck_name final: {final_deck}")
+    # Los nombres ya vienen resueltos contra los metadatos de Anki (ver anki_metadata.py)
+    final_model = modelName
+    final_deck = deck_name
     
     try:
         if not datos_json:
@@ -92,28 +269,11 @@ def crear_tarjeta_anki(datos_json, modelName, deck_name):
         if not palabra:
             return {"error": "No se encontró la palabra en los datos"}
         
-        # CREAR CONTENIDO FRONT (SIMPLIFICADO)
-        contenido_front = f"{palabra}"
-        if datos_json.get('Pronunciacion'):
-            contenido_front += f" ({datos_json.get('Pronunciacion')})"
-        
-        # CREAR CONTENIDO BACK (SIGNIFICADOS + ORACIONES)
-        contenido_back = ""
-        if isinstance(datos_json.get('Significado'), list):
-            for significado in datos_json.get('Significado'):
-                contenido_back += f"• {significado}<br>"
-        else:
-            contenido_back = f"{datos_json.get('Significado', '')}<br>"
-        
-        # Agregar oraciones al BACK
-        if datos_json.get('Oracion_Comun'):
-            contenido_back += f"<br>💬 <i>{datos_json.get('Oracion_Comun')}</i>"
+        campos = construir_campos_nota(datos_json)
+        contenido_front = campos["Front"]
+        contenido_back = campos["Back"]
         
-        if datos_json.get('Oracion_medica'):
-            contenido_back += f"<br>🏥 <i>{datos_json.get('Oracion_medica')}</i>"
-        
-        print(f"Contenido Front: {contenido_front}")
-        print(f"Contenido Back: {contenido_back}")
+        logger.debug("Contenido Front: %s | Back: %s", contenido_front, contenido_back)
         
         anki_payload = {
             "action": "addNote",
@@ -134,12 +294,9 @@ def crear_tarjeta_anki(datos_json, modelName, deck_name):
             }
         }
         
-        print(f"Enviando payload a AnkiConnect...")
-        response = requests.post("http://localhost:8765", json=anki_payload, timeout=10)
-        print(f"Status code: {response.status_code}")
-        
+        response = enviar_a_ankiconnect(anki_payload, timeout=10)
         result = response.json()
-        print(f"Respuesta completa de AnkiConnect: {result}")
+        logger.debug("addNote: status=%s respuesta=%s", response.status_code, result)
         
         # MEJOR MANEJO DE LA RESPUESTA
         if result.get('error') is not None:
@@ -157,14 +314,112 @@ def crear_tarjeta_anki(datos_json, modelName, deck_name):
         
     except Exception as e:
         error_msg = f"Error: {str(e)}"
-        print(f"EXCEPCIÓN: {error_msg}")
+        logger.exception("Excepción en AnkiConnect: %s", error_msg)
         return {"error": error_msg}  
 
+def crear_tarjetas_lote(lista_datos, modelName, deck_name):
+    """
+    Crea varias tarjetas con una sola llamada a AnkiConnect.
+    Se usa multi/addNote en lugar de addNotes porque así cada nota trae su propio
+    resultado aunque otras fallen (addNotes descarta todos los IDs si una es duplicada).
+    Devuelve una lista con el note_id de cada tarjeta, o None si no se pudo crear.
+    """
+    if not lista_datos:
+        return []
+    
+    payload = {
+        "action": "multi",
+        "version": 6,
+        "params": {
+            "actions": [
+                {
+                    "action": "addNote",
+                    "params": {
+                        "note": {
+                            "deckName": deck_name,
+                            "modelName": modelName,
+                            "fields": construir_campos_nota(datos_json),
+                            "tags": ["telegram-bot"],
+                            "options": {"allowDuplicate": False}
+                        }
+                    }
+                }
+                for datos_json in lista_datos
+            ]
+        }
+    }
+    
+    try:
+        response = enviar_a_ankiconnect(payload, timeout=30)
+        response.raise_for_status()
+        result = response.json()
+    except requests.exceptions.RequestException as e:
+        logger.error("Error de conexión con AnkiConnect: %s", e)
+        return [None] * len(lista_datos)
+    
+    if result.get('error') is not None or not isinstance(result.get('result'), list):
+        logger.error("AnkiConnect error al crear notas en lote: %s", result.get('error'))
+        return [None] * len(lista_datos)
+    
+    note_ids = []
+    for resultado in result['result']:
+        if isinstance(resultado, dict):
+            if resultado.get('error') is not None:
+                logger.debug("Nota no creada: %s", resultado['error'])
+            resultado = resultado.get('result')
+        note_ids.append(resultado)
+    return note_ids
+
+def actualizar_notas_lote(actualizaciones, lanzar=False):
+    """
+    Actualiza varias notas en una sola llamada a AnkiConnect (acción multi).
+    `actualizaciones` es un dict {note_id: {campo: valor}}.
+    Devuelve un dict {note_id: error} solo con las notas que fallaron; con lanzar=True,
+    si falla la llamada entera (conexión o error de AnkiConnect) lanza ErrorAnkiConnect.
+    """
+    if not actualizaciones:
+        return {}
+    
+    note_ids = list(actualizaciones)
+    payload = {
+        "action": "multi",
+        "version": 6,
+        "params": {
+            "actions": [
+                {
+                    "action": "updateNoteFields",
+                    "params": {"note": {"id": note_id, "fields": actualizaciones[note_id]}}
+                }
+                for note_id in note_ids
+            ]
+        }
+    }
+    
+    try:
+        response = enviar_a_ankiconnect(payload, timeout=30)
+        response.raise_for_status()
+        result = response.json()
+    except requests.exceptions.RequestException as e:
+        logger.error("Error de conexión con AnkiConnect: %s", e)
+        if lanzar:
+            raise ErrorAnkiConnect(str(e)) from e
+        return {note_id: str(e) for note_id in note_ids}
+    
+    if result.get('error') is not None:
+        if lanzar:
+            raise ErrorAnkiConnect(result['error'])
+        return {note_id: result['error'] for note_id in note_ids}
+    
+    errores = {}
+    for note_id, resultado in zip(note_ids, result.get('result') or []):
+        if isinstance(resultado, dict) and resultado.get('error') is not None:
+            errores[note_id] = resultado['error']
+    return errores
+
 def editar_tarjeta_existente(note_id, campos_a_editar):
     """
     Edita una tarjeta de Anki existente.
     """
-    url = "http://localhost:8765"
     payload = {
         "action": "updateNoteFields",
         "version": 6,
@@ -177,19 +432,19 @@ def editar_tarjeta_existente(note_id, campos_a_editar):
     }
     
     try:
-        response = requests.post(url, data=json.dumps(payload))
+        response = enviar_a_ankiconnect(payload)
         response.raise_for_status()
         result = response.json()
         return result
     except requests.exceptions.RequestException as e:
         return {"error": f"Error de conexión con AnkiConnect: {e}"}
 
-def buscar_palabra_en_deck(deck_name, palabra_a_buscar):
+def buscar_notas_por_query(query_str, lanzar=False):
     """
-    Busca una palabra específica en un deck de Anki utilizando AnkiConnect.
+    Ejecuta una búsqueda de Anki (findNotes) y devuelve los IDs de las notas.
+    Si AnkiConnect falla devuelve [], o lanza ErrorAnkiConnect con lanzar=True
+    (para quien debe distinguir "sin resultados" de "Anki no respondió").
     """
-    url = "http://localhost:8765"
-    query_str = f'deck:"{deck_name}" "{palabra_a_buscar}"'
     
     payload = {
         "action": "findNotes",
@@ -200,24 +455,79 @@ def buscar_palabra_en_deck(deck_name, palabra_a_buscar):
     }
     
     try:
-        response = requests.post(url, data=json.dumps(payload))
+        response = enviar_a_ankiconnect(payload)
         response.raise_for_status()
         result = response.json()
         
         if result['error'] is not None:
+            if lanzar:
+                raise ErrorAnkiConnect(result['error'])
             return []
             
         return result['result']
         
     except requests.exceptions.RequestException as e:
-        print(f"Error de conexión con AnkiConnect: {e}")
+        logger.error("Error de conexión con AnkiConnect: %s", e)
+        if lanzar:
+            raise ErrorAnkiConnect(str(e)) from e
         return []
 
-def obtener_info_notas(note_ids):
+# Caracteres con significado especial dentro de un término de búsqueda de Anki
+_ESPECIALES_BUSQUEDA = re.compile(r'([\\"*_:])')
+
+def escapar_busqueda(texto):
+    """
+    Escapa un texto para usarlo literalmente dentro de un término entre comillas
+    de la búsqueda de Anki (\\, ", comodines * y _, y ':').
+    """
+    return _ESPECIALES_BUSQUEDA.sub(r'\\\1', texto)
+
+def consulta_deck(deck_name):
+    """Término de búsqueda que limita a un deck (y sus subdecks)"""
+    return f'"deck:{escapar_busqueda(deck_name)}"'
+
+def consulta_decks(decks):
+    """Término que limita a varios decks en una sola búsqueda (vacío = toda la colección)"""
+    if not decks:
+        return ""
+    if len(decks) == 1:
+        return consulta_deck(decks[0])
+    return "(" + " OR ".join(consulta_deck(deck) for deck in decks) + ")"
+
+def consulta_palabra_en_deck(deck_name, palabra):
+    """
+    Búsqueda acotada al campo Front: coincide con "palabra" exacta o con
+    "palabra (pronunciación)", el formato que crea el bot. No mira el Back,
+    así que las oraciones de ejemplo que contienen la palabra no cuentan.
+    """
+    return f'{consulta_deck(deck_name)} {consulta_front(palabra)}'
+
+def consulta_front(palabra):
+    """
+    Término que coincide en el campo Front con "palabra" exacta, "palabra (pronunciación)"
+    o "palabra [sound:...]"
+    """
+    palabra = escapar_busqueda(palabra.strip())
+    return f'("front:{palabra}" OR "front:{palabra} (*" OR "front:{palabra} [sound:*")'
+
+def buscar_palabra_en_deck(deck_name, palabra_a_buscar):
+    """
+    Busca una palabra específica en un deck de Anki utilizando AnkiConnect.
+    """
+    return buscar_notas_por_query(consulta_palabra_en_deck(deck_name, palabra_a_buscar))
+
+def buscar_palabra_en_decks(decks, palabra_a_buscar):
+    """
+    Busca una palabra en varios decks con una sola llamada findNotes,
+    así añadir decks al alcance no añade peticiones a AnkiConnect.
+    """
+    return buscar_notas_por_query(f"{consulta_decks(decks)} {consulta_front(palabra_a_buscar)}".strip())
+
+def obtener_info_notas(note_ids, lanzar=False):
     """
     Obtiene el contenido completo de las notas a partir de sus IDs.
+    Si AnkiConnect falla devuelve [], o lanza ErrorAnkiConnect con lanzar=True.
     """
-    url = "http://localhost:8765"
     payload = {
         "action": "notesInfo",
         "version": 6,
@@ -227,30 +537,107 @@ def obtener_info_notas(note_ids):
     }
     
     try:
-        response = requests.post(url, data=json.dumps(payload))
+        response = enviar_a_ankiconnect(payload)
         response.raise_for_status()
         result = response.json()
 
         if result['error'] is not None:
+            if lanzar:
+                raise ErrorAnkiConnect(result['error'])
             return []
 
         return result['result']
     except requests.exceptions.RequestException as e:
-        print(f"Error de conexión con AnkiConnect: {e}")
+        logger.error("Error de conexión con AnkiConnect: %s", e)
+        if lanzar:
+            raise ErrorAnkiConnect(str(e)) from e
+        return []
+
+def listar_media(patron):
+    """
+    Nombres de los archivos multimedia de la colección que cumplen `patron` (p. ej. "tts_*").
+    Devuelve None si AnkiConnect no responde.
+    """
+    payload = {"action": "getMediaFilesNames", "version": 6, "params": {"pattern": patron}}
+    try:
+        response = enviar_a_ankiconnect(payload, timeout=30)
+        response.raise_for_status()
+        result = response.json()
+    except requests.exceptions.RequestException as e:
+        logger.error("Error de conexión con AnkiConnect: %s", e)
+        return None
+    if result.get('error') is not None:
+        logger.error("AnkiConnect error al listar la multimedia: %s", result.get('error'))
+        return None
+    return result.get('result') or []
+
+def guardar_media_lote(archivos):
+    """
+    Sube varios archivos multimedia con una sola llamada multi/storeMediaFile.
+    `archivos` es un dict {nombre: bytes}. Devuelve los nombres que no se pudieron subir.
+    """
+    if not archivos:
         return []
+    
+    nombres = list(archivos)
+    payload = {
+        "action": "multi",
+        "version": 6,
+        "params": {
+            "actions": [
+                {
+                    "action": "storeMediaFile",
+                    "params": {"filename": nombre, "data": base64.b64encode(archivos[nombre]).decode("ascii")}
+                }
+                for nombre in nombres
+            ]
+        }
+    }
+    
+    try:
+        response = enviar_a_ankiconnect(payload, timeout=60)
+        response.raise_for_status()
+        result = response.json()
+    except requests.exceptions.RequestException as e:
+        logger.error("Error de conexión con AnkiConnect: %s", e)
+        return nombres
+    
+    if result.get('error') is not None:
+        logger.error("AnkiConnect error al subir multimedia: %s", result.get('error'))
+        return nombres
+    
+    fallidos = []
+    for nombre, resultado in zip(nombres, result.get('result') or []):
+        if isinstance(resultado, dict) and resultado.get('error') is not None:
+            logger.error("No se pudo subir %s: %s", nombre, resultado['error'])
+            fallidos.append(nombre)
+    return fallidos
+
+# Referencias a audio de Anki dentro de un campo
+_ETIQUETA_SONIDO = re.compile(r'\s*\[sound:([^\]]+)\]')
+# Etiquetas que limpia limpiar_html, en el orden en que se sustituyen
+_REEMPLAZOS_HTML = (('<br>', '\n'), ('<ul>', ''), ('</ul>', ''), ('<li>', '- '), ('</li>', ''))
 
 def limpiar_html(texto):
     """
-    Elimina las etiquetas HTML de un texto y formatea las listas.
+    Elimina las etiquetas HTML y de audio de un texto y formatea las listas.
+    Las etiquetas son fijas, así que se sustituyen con str.replace (más rápido que
+    una expresión regular con función de reemplazo) y solo si el texto tiene '<'.
     """
-    limpio = re.sub('<br>', '\n', texto)
-    limpio = re.sub('</?ul>', '', limpio)
-    limpio = re.sub('<li>', '- ', limpio)
-    limpio = re.sub('</?li>', '', limpio)
-    return limpio.strip()
+    if '[sound:' in texto:
+        texto = _ETIQUETA_SONIDO.sub('', texto)
+    if '<' in texto:
+        for etiqueta, reemplazo in _REEMPLAZOS_HTML:
+            texto = texto.replace(etiqueta, reemplazo)
+    return texto.strip()
 
 def formatear_json_para_telegram(datos_json):
-    """Formatea el JSON para mostrarlo en Telegram"""
+    """
+    Formatea el JSON para mostrarlo en Telegram (solo los campos con vista previa).
+    Si aún faltan los extras (primera fase), se muestra solo el núcleo.
+    """
+    # Las entradas antiguas de la cache pueden superar los límites del esquema
+    datos_json = recortar(dict(datos_json))
     mensaje = f"📚 *Información de la palabra:* {datos_json.get('Palabra', 'N/A')}\n\n"
     
     # Significado
@@ -265,6 +652,9 @@ def formatear_json_para_telegram(datos_json):
     # Pronunciación
     mensaje += f"🔊 *Pronunciación:* {datos_json.get('Pronunciacion', 'N/A')}\n\n"
     
+    if campos_pendientes(datos_json):
+        return mensaje + "➕ _Ejemplos, gramática y etimología pendientes_\n"
+    
     # Oración común
     mensaje += f"💬 *Oración común:*\n{datos_json.get('Oracion_Comun', 'N/A')}\n\n"
     
@@ -272,36 +662,12 @@ def formatear_json_para_telegram(datos_json):
     mensaje += f"🏥 *Oración médica:*\n{datos_json.get('Oracion_medica', 'N/A')}\n\n"
     
     # Gramática
-    gramatica = datos_json.get('Gramatica', 'N/A')
-    if len(gramatica) > 200:  # Acortar si es muy largo
-        gramatica = gramatica[:200] + "..."
-    mensaje += f"📝 *Gramática:*\n{gramatica}\n\n"
+    if en_vista_previa('Gramatica'):
+        mensaje += f"📝 *Gramática:*\n{datos_json.get('Gramatica', 'N/A')}\n\n"
     
     # Etimología
-    etimologia = datos_json.get('Etimologia', 'N/A')
-    if len(etimologia) > 200:  # Acortar si es muy largo
-        etimologia = etimologia[:200] + "..."
-    mensaje += f"📜 *Etimología:*\n{etimologia}\n"
-    
-    return mensaje
-
-def formatear_notas_existentes(notas):
-    """
-    Formatea las notas existentes para mostrar en Telegram.
-    """
-    if not notas:
-        return "No se encontraron notas."
-    
-    mensaje = "📋 *Tarjetas existentes encontradas:*\n\n"
-    
-    for i, nota in enumerate(notas, 1):
-        anverso = limpiar_html(nota['fields']['Front']['value'])
-        reverso = limpiar_html(nota['fields']['Back']['value'])
-        
-        mensaje += f"*Tarjeta #{i}:*\n"
-        mensaje += f"*ID:* `{nota['noteId']}`\n"
-        mensaje += f"*Anverso:* {anverso}\n"
-        mensaje += f"*Reverso:* {reverso}\n\n"
+    if en_vista_previa('Etimologia'):
+        mensaje += f"📜 *Etimología:*\n{datos_json.get('Etimologia', 'N/A')}\n"
     
     return mensaje
 
@@ -314,6 +680,10 @@ def convertir_nota_a_datos_anki(nota, palabra_original):
         front = nota['fields']['Front']['value']
         back = nota['fields']['Back']['value']
         
+        # Audio de pronunciación ([sound:...]) para conservarlo al reescribir el Front
+        sonido = _ETIQUETA_SONIDO.search(front)
+        audio = sonido.group(1) if sonido else ""
+        
         # Intentar extraer pronunciación si está entre paréntesis en el Front
         pronunciacion = ""
         if '(' in front and ')' in front:
@@ -356,13 +726,14 @@ def convertir_nota_a_datos_anki(nota, palabra_original):
             'Significado': significados,
             'Pronunciacion': pronunciacion,
             'Oracion_Comun': oracion_comun,
-            'Oracion_medica': oracion_medica
+            'Oracion_medica': oracion_medica,
+            'Audio': audio
         }
         
         return datos_anki
         
     except Exception as e:
-        print(f"Error al convertir nota a datos_anki: {e}")
+        logger.error("Error al convertir nota a datos_anki: %s", e)
         # Devolver estructura básica en caso de error
         return {
             'Palabra': palabra_original,
@@ -372,14 +743,17 @@ def convertir_nota_a_datos_anki(nota, palabra_original):
             'Oracion_medica': ''
         }
 
-def editar_tarjeta_existente_completa(note_id, datos_json, modelName, deck_name):
+def editar_tarjeta_existente_completa(note_id, datos_json, modelName, deck_name,
+                                      campos_originales=None, campos_sucios=None):
     """
     Edita una tarjeta existente en Anki con nuevos datos.
+    Solo envía los campos que cambiaron respecto a `campos_originales`
+    (valores actuales de la nota) y no llama a AnkiConnect si no hay cambios.
+    Si se indica `campos_sucios` (campos de datos_anki editados), solo se
+    reconstruyen los campos de la nota que dependen de ellos.
     """
-    print(f"=== DEBUG editar_tarjeta_existente_completa ===")
-    print(f"note_id: {note_id}")
-    print(f"modelName: {modelName}")
-    print(f"deck_name: {deck_name}")
+    logger.debug("editar_tarjeta_existente_completa: note_id=%s modelName=%s deck_name=%s",
+                 note_id, modelName, deck_name)
     
     try:
         if not datos_json:
@@ -390,61 +764,61 @@ def editar_tarjeta_existente_completa(note_id, datos_json, modelName, deck_name)
             return {"error": "No se encontró la palabra en los datos"}
         
         # Crear contenido actualizado (igual que en crear_tarjeta_anki)
-        contenido_front = f"{palabra}"
-        if datos_json.get('Pronunciacion'):
-            contenido_front += f" ({datos_json.get('Pronunciacion')})"
-        
-        contenido_back = ""
-        if isinstance(datos_json.get('Significado'), list):
-            for significado in datos_json.get('Significado'):
-                contenido_back += f"• {significado}<br>"
-        else:
-            contenido_back = f"{datos_json.get('Significado', '')}<br>"
-        
-        if datos_json.get('Oracion_Comun'):
-            contenido_back += f"<br>💬 <i>{datos_json.get('Oracion_Comun')}</i>"
-        
-        if datos_json.get('Oracion_medica'):
-            contenido_back += f"<br>🏥 <i>{datos_json.get('Oracion_medica')}</i>"
+        campos_nuevos = construir_campos_nota(datos_json)
+        if campos_sucios is not None:
+            campos_nuevos = {
+                nombre: valor for nombre, valor in campos_nuevos.items()
+                if set(DEPENDENCIAS_CAMPOS[nombre]) & set(campos_sucios)
+            }
+        campos_modificados = calcular_campos_modificados(campos_nuevos, campos_originales)
+        
+        bytes_completos = len(json.dumps(construir_campos_nota(datos_json), ensure_ascii=False).encode('utf-8'))
+        METRICAS_EDICION["bytes_completos"] += bytes_completos
+        METRICAS_EDICION["campos_omitidos"] += len(DEPENDENCIAS_CAMPOS) - len(campos_modificados)
+        
+        if not campos_modificados:
+            METRICAS_EDICION["omitidas"] += 1
+            logger.debug("Sin cambios en la nota %s, no se envía updateNoteFields", note_id)
+            return {
+                "success": True,
+                "sin_cambios": True,
+                "message": "La tarjeta no tenía cambios"
+            }
         
-        print(f"Contenido Front actualizado: {contenido_front}")
-        print(f"Contenido Back actualizado: {contenido_back}")
+        logger.debug("Campos actualizados de la nota %s: %s", note_id, campos_modificados)
         
-        # Actualizar los campos de la nota existente
+        # Actualizar solo los campos modificados de la nota existente
         anki_payload = {
             "action": "updateNoteFields",
             "version": 6,
             "params": {
                 "note": {
                     "id": note_id,
-                    "fields": {
-                        "Front": contenido_front,
-                        "Back": contenido_back
-                    }
+                    "fields": campos_modificados
                 }
             }
         }
         
-        print(f"Enviando payload de actualización a AnkiConnect...")
-        response = requests.post("http://localhost:8765", json=anki_payload, timeout=10)
-        print(f"Status code: {response.status_code}")
+        METRICAS_EDICION["escrituras"] += 1
+        METRICAS_EDICION["campos_enviados"] += len(campos_modificados)
+        METRICAS_EDICION["bytes_enviados"] += len(json.dumps(campos_modificados, ensure_ascii=False).encode('utf-8'))
         
+        response = enviar_a_ankiconnect(anki_payload, timeout=10)
         result = response.json()
-        print(f"Respuesta completa de AnkiConnect: {result}")
+        logger.debug("updateNoteFields: status=%s respuesta=%s", response.status_code, result)
         
+        # updateNoteFields devuelve result = null cuando tiene éxito
         if result.get('error') is not None:
             return {"error": f"AnkiConnect error: {result.get('error')}"}
         
-        if result.get('result') is None:
-            return {"error": "La tarjeta no se pudo actualizar"}
-        
         # ÉXITO - la tarjeta fue actualizada
         return {
             "success": True,
+            "campos_actualizados": list(campos_modificados),
             "message": f"Tarjeta actualizada exitosamente"
         }
         
     except Exception as e:
         error_msg = f"Error: {str(e)}"
-        print(f"EXCEPCIÓN: {error_msg}")
-        return {"error": error_msg}
\ No newline at end of file
+        logger.exception("Excepción en AnkiConnect: %s", error_msg)
+        return {"error": error_msg}
@@ -0,0 +1,198 @@
+# anki_metadata.py
+"""
+Decks y modelos de la colección de Anki, en memoria.
+
+Se cargan con deckNames, modelNames y modelFieldNames al arrancar y se refrescan en
+segundo plano cada ANKI_METADATA_REFRESH segundos; refrescar() dice qué cambió (un deck
+nuevo, un modelo borrado) para reindexar solo cuando hace falta. Los manejadores leen
+de aquí qué decks ofrecer y dónde buscar sin consultar a Anki.
+
+Cada usuario puede elegir con /decks en qué decks se buscan sus palabras y cuáles se
+le ofrecen al crear tarjetas (su alcance). Sin elegir, se usa ANKI_SEARCH_DECKS o,
+si está vacío, todos los decks de la colección.
+"""
+import os
+import json
+import time
+import logging
+import threading
+
+import requests
+
+from anki_functions import enviar_a_ankiconnect
+
+logger = logging.getLogger(__name__)
+
+# Segundos entre refrescos de la lista de decks y modelos
+ANKI_METADATA_REFRESH = int(os.getenv("ANKI_METADATA_REFRESH", "300"))
+# Alcance por defecto, decks separados por comas (vacío = todos)
+ANKI_SEARCH_DECKS = [d.strip() for d in os.getenv("ANKI_SEARCH_DECKS", "").split(",") if d.strip()]
+# Modelos de los botones 📝 Básica y 🔄 Reversible
+ANKI_MODEL_BASIC = os.getenv("ANKI_MODEL_BASIC", "Basic")
+ANKI_MODEL_REVERSED = os.getenv("ANKI_MODEL_REVERSED", "Basic (and reversed card)")
+ANKI_SCOPES_PATH = os.getenv("ANKI_SCOPES_PATH", "search_scopes.json")
+
+# Tipo de tarjeta elegido con los botones -> modelo de Anki
+MODELOS_TARJETA = {
+    "basic_card": ANKI_MODEL_BASIC,
+    "reversed_card": ANKI_MODEL_REVERSED,
+}
+# Campos que necesita un modelo para las notas del bot
+CAMPOS_REQUERIDOS = ("Front", "Back")
+
+
+def _invocar(accion, **params):
+    """Llama a AnkiConnect y devuelve `result`; lanza RuntimeError si Anki responde con error"""
+    respuesta = enviar_a_ankiconnect({"action": accion, "version": 6, "params": params}, timeout=10)
+    respuesta.raise_for_status()
+    datos = respuesta.json()
+    if datos.get("error") is not None:
+        raise RuntimeError(datos["error"])
+    return datos["result"]
+
+
+def etiqueta_deck(deck):
+    """Nombre corto para un botón: el último nivel ("0 USA::STEP 1" -> "STEP 1")"""
+    return deck.rsplit("::", 1)[-1]
+
+
+class MetadatosAnki:
+    """Decks y modelos (con sus campos) de la colección, refrescados en segundo plano"""
+
+    def __init__(self, ruta_alcances=ANKI_SCOPES_PATH):
+        self.decks = []
+        self.modelos = {}
+        self.cargado = False
+        self.actualizado = 0.0
+        self.ruta_alcances = ruta_alcances
+        self._alcances = {}
+        self._lock = threading.Lock()
+        self._cargar_alcances()
+
+    # --- Colección -----------------------------------------------------------
+
+    def refrescar(self):
+        """
+        Vuelve a leer decks y modelos de AnkiConnect (bloqueante, fuera del event loop).
+        Devuelve el conjunto de lo que cambió; vacío si nada cambió o Anki no responde.
+        """
+        try:
+            decks = sorted(_invocar("deckNames"))
+            nombres = _invocar("modelNames")
+            # Los campos de todos los modelos en una sola petición multi
+            respuestas = _invocar("multi", actions=[
+                {"action": "modelFieldNames", "version": 6, "params": {"modelName": nombre}}
+                for nombre in nombres
+            ])
+            modelos = {}
+            for nombre, respuesta in zip(nombres, respuestas):
+                if isinstance(respuesta, dict):
+                    if respuesta.get("error") is not None:
+                        raise RuntimeError(respuesta["error"])
+                    respuesta = respuesta.get("result")
+                modelos[nombre] = respuesta
+        except (requests.exceptions.RequestException, RuntimeError, ValueError) as e:
+            logger.warning("No se pudieron leer los decks y modelos de Anki: %s", e)
+            return set()
+
+        cambios = set()
+        with self._lock:
+            if decks != self.decks:
+                cambios.add("decks")
+            if modelos != self.modelos:
+                cambios.add("modelos")
+            anteriores = set(self.decks)
+            self.decks, self.modelos = decks, modelos
+            self.actualizado = time.time()
+            primera_carga = not self.cargado
+            self.cargado = True
+
+        if primera_carga:
+            logger.info("Metadatos de Anki cargados: %d decks, %d modelos", len(decks), len(modelos))
+        elif cambios:
+            nuevos, borrados = set(decks) - anteriores, anteriores - set(decks)
+            logger.info("Metadatos de Anki actualizados (%s): decks nuevos %s, borrados %s",
+                        ", ".join(sorted(cambios)), sorted(nuevos) or "-", sorted(borrados) or "-")
+        return cambios
+
+    def existe_deck(self, deck):
+        return deck in self.decks
+
+    def modelo(self, tipo):
+        """
+        Modelo de Anki para un tipo de tarjeta (basic_card / reversed_card).
+        Si el configurado no existe o no tiene Front y Back, usa el primero que sí los tenga.
+        """
+        nombre = MODELOS_TARJETA.get(tipo, tipo)
+        if not self.cargado or self._valido(nombre):
+            return nombre
+        alternativo = next((m for m in sorted(self.modelos) if self._valido(m)), nombre)
+        logger.warning("El modelo '%s' no existe en Anki o no tiene %s; se usa '%s'",
+                       nombre, "/".join(CAMPOS_REQUERIDOS), alternativo)
+        return alternativo
+
+    def _valido(self, modelo):
+        campos = self.modelos.get(modelo)
+        return campos is not None and all(c in campos for c in CAMPOS_REQUERIDOS)
+
+    # --- Alcance por usuario -------------------------------------------------
+
+    def _cargar_alcances(self):
+        if not self.ruta_alcances or not os.path.exists(self.ruta_alcances):
+            return
+        try:
+            with open(self.ruta_alcances, "r", encoding="utf-8") as f:
+                self._alcances = {int(user_id): decks for user_id, decks in json.load(f).items()}
+        except (OSError, ValueError) as e:
+            logger.error("No se pudieron cargar los alcances de búsqueda: %s", e)
+
+    def _persistir_alcances(self):
+        if not self.ruta_alcances:
+            return
+        temporal = f"{self.ruta_alcances}.tmp"
+        try:
+            with open(temporal, "w", encoding="utf-8") as f:
+                json.dump({str(user_id): decks for user_id, decks in self._alcances.items()}, f, ensure_ascii=False)
+            os.replace(temporal, self.ruta_alcances)
+        except OSError as e:
+            logger.error("No se pudieron guardar los alcances de búsqueda: %s", e)
+
+    def alcance_por_defecto(self):
+        """Decks de ANKI_SEARCH_DECKS que existen o, si no hay, todos"""
+        if ANKI_SEARCH_DECKS:
+            if not self.cargado:
+                return list(ANKI_SEARCH_DECKS)
+            existentes = [d for d in ANKI_SEARCH_DECKS if d in self.decks]
+            if existentes:
+                return existentes
+        return list(self.decks)
+
+    def alcance(self, user_id):
+        """Decks donde se buscan las palabras del usuario y que se le ofrecen al crear"""
+        elegidos = self._alcances.get(user_id)
+        if elegidos:
+            # Los decks borrados en Anki desaparecen del alcance
+            existentes = [d for d in elegidos if d in self.decks] if self.cargado else elegidos
+            if existentes:
+                return existentes
+        return self.alcance_por_defecto()
+
+    def guardar_alcance(self, user_id, decks):
+        """Guarda el alcance elegido por el usuario (vacío = volver al de por defecto)"""
+        with self._lock:
+            if decks:
+                self._alcances[user_id] = list(decks)
+            else:
+                self._alcances.pop(user_id, None)
+            self._persistir_alcances()
+
+    def estadisticas(self):
+        return {
+            "decks": len(self.decks),
+            "modelos": len(self.modelos),
+            "antiguedad": time.time() - self.actualizado if self.cargado else None,
+            "alcances": len(self._alcances),
+        }
+
+
+metadatos_anki = MetadatosAnki()
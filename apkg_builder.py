@@ -0,0 +1,304 @@
+# apkg_builder.py
+"""
+Generador de paquetes de Anki (.apkg) sin AnkiConnect.
+
+Escribe las tarjetas directamente en una colección SQLite (esquema 11, el que
+importan todas las versiones de Anki) y la empaqueta junto con la multimedia.
+Usa los mismos modelos ("Basic" y "Basic (and reversed card)") y nombres de deck
+que crear_tarjeta_anki, y el mismo contenido de Front/Back.
+
+Los IDs de modelo y deck son fijos y el guid de cada nota depende de la palabra,
+así que importar otra vez el mismo paquete actualiza las notas en lugar de duplicarlas.
+
+Uso: python apkg_builder.py salida.apkg [--deck "0 USA::STEP 1"] [--modelo Basic]
+                                        [--palabras lista.txt] [--audio]
+     Sin --palabras se empaquetan todas las palabras de la cache local; con
+     --palabras, las que falten en la cache se generan con la IA por lotes.
+     --audio añade la pronunciación con el motor de TTS_ENGINE (ver pronunciation_audio.py);
+     cada archivo de audio distinto se incluye una sola vez.
+"""
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import zipfile
+import argparse
+import tempfile
+
+from anki_functions import construir_campos_nota, limpiar_html
+
+logger = logging.getLogger(__name__)
+
+ESQUEMA = """
+CREATE TABLE col (
+    id integer primary key, crt integer not null, mod integer not null, scm integer not null,
+    ver integer not null, dty integer not null, usn integer not null, ls integer not null,
+    conf text not null, models text not null, decks text not null, dconf text not null,
+    tags text not null
+);
+CREATE TABLE notes (
+    id integer primary key, guid text not null, mid integer not null, mod integer not null,
+    usn integer not null, tags text not null, flds text not null, sfld integer not null,
+    csum integer not null, flags integer not null, data text not null
+);
+CREATE TABLE cards (
+    id integer primary key, nid integer not null, did integer not null, ord integer not null,
+    mod integer not null, usn integer not null, type integer not null, queue integer not null,
+    due integer not null, ivl integer not null, factor integer not null, reps integer not null,
+    lapses integer not null, left integer not null, odue integer not null, odid integer not null,
+    flags integer not null, data text not null
+);
+CREATE TABLE revlog (
+    id integer primary key, cid integer not null, usn integer not null, ease integer not null,
+    ivl integer not null, lastIvl integer not null, factor integer not null, time integer not null,
+    type integer not null
+);
+CREATE TABLE graves (usn integer not null, oid integer not null, type integer not null);
+CREATE INDEX ix_notes_usn ON notes (usn);
+CREATE INDEX ix_cards_usn ON cards (usn);
+CREATE INDEX ix_revlog_usn ON revlog (usn);
+CREATE INDEX ix_cards_nid ON cards (nid);
+CREATE INDEX ix_cards_sched ON cards (did, queue, due);
+CREATE INDEX ix_revlog_cid ON revlog (cid);
+CREATE INDEX ix_notes_csum ON notes (csum);
+"""
+
+CSS = """.card {
+ font-family: arial;
+ font-size: 20px;
+ text-align: center;
+ color: black;
+ background-color: white;
+}
+"""
+
+# Plantillas de cada modelo: (nombre, pregunta, respuesta)
+PLANTILLAS = {
+    "Basic": [
+        ("Card 1", "{{Front}}", "{{FrontSide}}\n\n<hr id=answer>\n\n{{Back}}"),
+    ],
+    "Basic (and reversed card)": [
+        ("Card 1", "{{Front}}", "{{FrontSide}}\n\n<hr id=answer>\n\n{{Back}}"),
+        ("Card 2", "{{Back}}", "{{FrontSide}}\n\n<hr id=answer>\n\n{{Front}}"),
+    ],
+}
+CAMPOS = ["Front", "Back"]
+
+CONFIG_MAZO = {
+    "id": 1, "name": "Default", "replayq": True, "timer": 0, "maxTaken": 60, "usn": 0, "mod": 0,
+    "autoplay": True, "dyn": False,
+    "new": {"delays": [1, 10], "ints": [1, 4, 7], "initialFactor": 2500, "separate": True,
+            "order": 1, "perDay": 20, "bury": False},
+    "rev": {"perDay": 200, "ease4": 1.3, "fuzz": 0.05, "minSpace": 1, "ivlFct": 1,
+            "maxIvl": 36500, "bury": False},
+    "lapse": {"delays": [10], "mult": 0, "minInt": 1, "leechFails": 8, "leechAction": 0},
+}
+
+
+def id_estable(texto):
+    """ID positivo de 13 dígitos derivado de un nombre (igual en cada ejecución)"""
+    return 1_000_000_000_000 + zlib.crc32(texto.encode("utf-8")) * 100
+
+
+def guid_nota(modelo, palabra):
+    """guid de Anki: el mismo para la misma palabra y modelo en cualquier paquete"""
+    return hashlib.sha1(f"{modelo}\x1f{palabra.lower()}".encode("utf-8")).hexdigest()[:10]
+
+
+def _modelo(nombre, deck_id, ahora):
+    plantillas = PLANTILLAS[nombre]
+    return {
+        "id": id_estable(f"modelo:{nombre}"),
+        "name": nombre,
+        "type": 0,
+        "mod": ahora,
+        "usn": -1,
+        "sortf": 0,
+        "did": deck_id,
+        "tmpls": [
+            {"name": plantilla, "ord": orden, "qfmt": pregunta, "afmt": respuesta,
+             "did": None, "bqfmt": "", "bafmt": ""}
+            for orden, (plantilla, pregunta, respuesta) in enumerate(plantillas)
+        ],
+        "flds": [
+            {"name": campo, "ord": orden, "sticky": False, "rtl": False, "font": "Arial",
+             "size": 20, "media": []}
+            for orden, campo in enumerate(CAMPOS)
+        ],
+        "css": CSS,
+        "latexPre": "\\documentclass[12pt]{article}\n\\special{papersize=3in,5in}\n"
+                    "\\usepackage[utf8]{inputenc}\n\\usepackage{amssymb,amsmath}\n"
+                    "\\pagestyle{empty}\n\\setlength{\\parindent}{0in}\n\\begin{document}\n",
+        "latexPost": "\\end{document}",
+        "latexsvg": False,
+        "req": [[orden, "any", [orden]] for orden in range(len(plantillas))],
+        "tags": [],
+        "vers": [],
+    }
+
+
+def _deck(deck_id, nombre, ahora):
+    return {
+        "id": deck_id, "name": nombre, "mod": ahora, "usn": -1, "desc": "", "dyn": 0, "conf": 1,
+        "collapsed": False, "browserCollapsed": False, "extendNew": 0, "extendRev": 0,
+        "newToday": [0, 0], "revToday": [0, 0], "lrnToday": [0, 0], "timeToday": [0, 0],
+    }
+
+
+class PaqueteApkg:
+    """Acumula tarjetas y multimedia y las escribe como un .apkg"""
+
+    def __init__(self):
+        self.notas = []
+        self.media = {}
+
+    def agregar(self, datos_json, modelName="Basic", deck_name="0 USA::STEP 1", tags=("telegram-bot",)):
+        """Añade una tarjeta con los mismos campos que crear_tarjeta_anki"""
+        modelo = modelName if modelName in PLANTILLAS else "Basic"
+        self.notas.append((modelo, deck_name, datos_json.get("Palabra", ""),
+                           construir_campos_nota(datos_json), tuple(tags)))
+
+    def agregar_media(self, ruta, nombre=None):
+        """
+        Incluye un archivo multimedia, referenciado en los campos por `nombre`
+        (por defecto, el nombre del archivo). Un mismo nombre se incluye una vez.
+        """
+        self.media[nombre or os.path.basename(ruta)] = ruta
+
+    def _escribir_coleccion(self, ruta_db):
+        ahora = int(time.time())
+        ahora_ms = int(time.time() * 1000)
+
+        decks = {"1": _deck(1, "Default", ahora)}
+        for _, deck, _, _, _ in self.notas:
+            deck_id = id_estable(f"deck:{deck}")
+            decks.setdefault(str(deck_id), _deck(deck_id, deck, ahora))
+        modelos = {}
+        for modelo, deck, _, _, _ in self.notas:
+            modelo_json = _modelo(modelo, id_estable(f"deck:{deck}"), ahora)
+            modelos.setdefault(str(modelo_json["id"]), modelo_json)
+
+        conf = {
+            "activeDecks": [1], "curDeck": 1, "newSpread": 0, "collapseTime": 1200, "timeLim": 0,
+            "estTimes": True, "dueCounts": True, "curModel": None, "nextPos": len(self.notas) + 1,
+            "sortType": "noteFld", "sortBackwards": False, "addToCur": True,
+        }
+
+        conexion = sqlite3.connect(ruta_db)
+        try:
+            conexion.executescript(ESQUEMA)
+            conexion.execute(
+                "INSERT INTO col VALUES (1, ?, ?, ?, 11, 0, 0, 0, ?, ?, ?, ?, '{}')",
+                (ahora - ahora % 86400, ahora_ms, ahora_ms, json.dumps(conf), json.dumps(modelos),
+                 json.dumps(decks), json.dumps({"1": CONFIG_MAZO}))
+            )
+
+            filas_notas, filas_tarjetas = [], []
+            siguiente_id = ahora_ms
+            for posicion, (modelo, deck, palabra, campos, tags) in enumerate(self.notas, start=1):
+                siguiente_id += 1
+                note_id = siguiente_id
+                orden = limpiar_html(campos["Front"])
+                filas_notas.append((
+                    note_id, guid_nota(modelo, palabra or campos["Front"]), id_estable(f"modelo:{modelo}"),
+                    ahora, -1, f" {' '.join(tags)} " if tags else "",
+                    "\x1f".join(campos[campo] for campo in CAMPOS), orden,
+                    int(hashlib.sha1(orden.encode("utf-8")).hexdigest()[:8], 16), 0, ""
+                ))
+                for ord_plantilla in range(len(PLANTILLAS[modelo])):
+                    siguiente_id += 1
+                    filas_tarjetas.append((
+                        siguiente_id, note_id, id_estable(f"deck:{deck}"), ord_plantilla, ahora, -1,
+                        0, 0, posicion, 0, 0, 0, 0, 0, 0, 0, 0, ""
+                    ))
+
+            conexion.executemany("INSERT INTO notes VALUES (?,?,?,?,?,?,?,?,?,?,?)", filas_notas)
+            conexion.executemany("INSERT INTO cards VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", filas_tarjetas)
+            conexion.commit()
+        finally:
+            conexion.close()
+
+    def escribir(self, ruta):
+        """Escribe el paquete .apkg (collection.anki2 + media) en `ruta`"""
+        with tempfile.TemporaryDirectory() as temporal:
+            ruta_db = os.path.join(temporal, "collection.anki2")
+            self._escribir_coleccion(ruta_db)
+            with zipfile.ZipFile(ruta, "w", zipfile.ZIP_DEFLATED) as paquete:
+                paquete.write(ruta_db, "collection.anki2")
+                indice_media = {}
+                for numero, (nombre, ruta_media) in enumerate(self.media.items()):
+                    paquete.write(ruta_media, str(numero))
+                    indice_media[str(numero)] = nombre
+                paquete.writestr("media", json.dumps(indice_media))
+        logger.info("Paquete %s escrito: %d notas, %d archivos multimedia", ruta, len(self.notas), len(self.media))
+
+
+def main():
+    from word_cache import cache_palabras, normalizar_palabra
+    from card_schema import campos_pendientes
+    from anki_functions import obtener_info_lote_ia
+
+    parser = argparse.ArgumentParser(description="Genera un paquete .apkg sin AnkiConnect")
+    parser.add_argument("salida", help="ruta del .apkg")
+    parser.add_argument("--deck", default="0 USA::STEP 1")
+    parser.add_argument("--modelo", default="Basic", choices=sorted(PLANTILLAS))
+    parser.add_argument("--palabras", help="archivo con una palabra por línea")
+    parser.add_argument("--lote", type=int, default=10, help="palabras por llamada a la IA")
+    parser.add_argument("--audio", action="store_true", help="incluir el audio de pronunciación (TTS_ENGINE)")
+    parser.add_argument("--completar", action="store_true",
+                        help="sin --palabras, generar con la IA los extras que les faltan a las palabras de la cache")
+    args = parser.parse_args()
+
+    if args.audio:
+        from pronunciation_audio import audio_pronunciacion
+        if not audio_pronunciacion.activo:
+            parser.error("--audio necesita un motor de voz disponible en TTS_ENGINE (p. ej. espeak)")
+
+    if args.palabras:
+        with open(args.palabras, "r", encoding="utf-8") as f:
+            palabras = [linea.strip() for linea in f if linea.strip() and not linea.startswith("#")]
+    else:
+        # Toda la cache. Las entradas de solo núcleo (generación en dos fases) no tienen
+        # oraciones de ejemplo: se completan con --completar o se dejan fuera
+        palabras = []
+        omitidas = 0
+        for clave, datos_json in cache_palabras.elementos():
+            if args.completar or not campos_pendientes(datos_json):
+                palabras.append(clave)
+            else:
+                omitidas += 1
+        if omitidas:
+            print(f"⚠️ {omitidas} palabras de la cache sin extras omitidas (usa --completar para generarlos)")
+
+    datos = {}
+    faltan = []
+    for palabra in palabras:
+        en_cache = cache_palabras.obtener(palabra, completa=True)
+        if en_cache is not None:
+            datos[normalizar_palabra(palabra)] = en_cache
+        else:
+            faltan.append(palabra)
+    for inicio in range(0, len(faltan), args.lote):
+        for palabra, datos_json in obtener_info_lote_ia(faltan[inicio:inicio + args.lote]).items():
+            cache_palabras.guardar(palabra, datos_json)
+            datos[normalizar_palabra(palabra)] = datos_json
+    lista_datos = [datos[normalizar_palabra(p)] for p in palabras if normalizar_palabra(p) in datos]
+
+    paquete = PaqueteApkg()
+    inicio = time.perf_counter()
+    if args.audio:
+        lista_datos = audio_pronunciacion.con_audio(lista_datos, subir=False)
+    for datos_json in lista_datos:
+        paquete.agregar(datos_json, args.modelo, args.deck)
+        if datos_json.get("Audio"):
+            paquete.agregar_media(audio_pronunciacion.ruta_media(datos_json["Audio"]), datos_json["Audio"])
+    paquete.escribir(args.salida)
+    print(f"📦 {len(lista_datos)} tarjetas y {len(paquete.media)} audios escritos en {args.salida} "
+          f"en {time.perf_counter() - inicio:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
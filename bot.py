@@ -1,33 +1,98 @@
 # bot.py
+import io
 import os
+import asyncio
+import contextvars
+import time
+import base64
+import hashlib
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
+from telegram import (
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InlineQueryResultsButton,
+    InputTextMessageContent
+)
+from telegram.error import TelegramError
+from telegram.ext import (
+    Application,
+    CommandHandler,
+    MessageHandler,
+    filters,
+    ContextTypes,
+    CallbackQueryHandler,
+    InlineQueryHandler,
+    TypeHandler
+)
 from dotenv import load_dotenv
+import anki_functions
 from anki_functions import (
-    obtener_info_completa_ia, 
+    obtener_info_nucleo_ia,
+    obtener_info_extras_ia,
+    obtener_info_lote_ia,
     crear_tarjeta_anki, 
-    buscar_palabra_en_deck,
+    crear_tarjetas_lote,
+    buscar_palabra_en_decks,
     obtener_info_notas,
     formatear_json_para_telegram,
-    formatear_notas_existentes,
     convertir_nota_a_datos_anki,
-    editar_tarjeta_existente_completa
+    editar_tarjeta_existente_completa,
+    construir_campos_nota,
+    regenerar_campo_stream,
+    interpretar_campo,
+    METRICAS_EDICION,
+    METRICAS_FASES
 )
+from card_schema import campos_nucleo, campos_extra, campos_pendientes
+from word_cache import cache_palabras, normalizar_palabra
+from deck_index import indice_decks, palabra_desde_front
+from anki_metadata import metadatos_anki, etiqueta_deck, ANKI_METADATA_REFRESH
+from pronunciation_audio import audio_pronunciacion
+from note_pages import paginas_notas
+from callback_registry import registro_callbacks, callback_data
+from session_store import sesiones, BorradorTarjeta, CAMPOS_BORRADOR
+from note_sidecar import almacen_notas
+from quota_scheduler import planificador_cuota
+from warmup import calentar_cache
+from update_scheduler import PlanificadorUpdates
+from task_manager import gestor_tareas
+from profiler import perfilador, PROFILE_LOOP_LAG_MS
+from reenrich import gestor_reenriquecimiento
+from vocab_mining import es_texto, extraer_candidatas, MINING_BATCH_SIZE
+from recorder import registrar_update, registrar_accion
+from log_config import configurar_logging, asignar_id_peticion
 
 # Cargar variables de entorno
 load_dotenv()
 
-# Configuración de logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Configuración de logging (ver log_config.configurar_logging en main)
 logger = logging.getLogger(__name__)
 
 # Variables de entorno
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 ALLOWED_USER_IDS = [int(user_id) for user_id in os.getenv("ALLOWED_USER_IDS", "").split(",") if user_id]
+# Administradores (comandos de mantenimiento); por defecto, ninguno
+ADMIN_USER_IDS = [int(user_id) for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id]
+
+# Segundos que Telegram puede cachear las respuestas inline
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))
+INLINE_MAX_RESULTS = 10
+# Cuándo se generan los extras (oraciones, gramática, etimología) de una palabra nueva:
+# "demanda" = al pulsar «Más» o al confirmar la creación; "fondo" = en cuanto se muestra el núcleo
+EXTRAS_MODE = os.getenv("EXTRAS_MODE", "demanda")
+# Segundos mínimos entre ediciones del mensaje mientras llega un campo regenerado (límite de Telegram)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+
+# Campos del menú de edición: (nombre, etiqueta, se puede regenerar con IA)
+CAMPOS_EDICION = (
+    ("Palabra", "📝 Palabra", False),
+    ("Pronunciacion", "🔊 Pronunciación", True),
+    ("Significado", "📖 Significado", True),
+    ("Oracion_Comun", "💬 Oración común", True),
+    ("Oracion_medica", "🏥 Oración médica", True),
+)
 
 # Estados de conversación
 (
@@ -36,13 +101,187 @@ ALLOWED_USER_IDS = [int(user_id) for user_id in os.getenv("ALLOWED_USER_IDS", ""
     CHOOSE_CARD_TYPE,
     CHOOSE_DECK,
     EDITING_CARD,
-    EDITING_FIELD
-) = range(6)
+    EDITING_FIELD,
+    SELECTING_WORDS,
+    SELECTING_DECKS
+) = range(8)
+
+# Botón para abortar una búsqueda o generación en curso (ver motivo_interrupcion)
+TECLADO_CANCELAR = InlineKeyboardMarkup([[InlineKeyboardButton("❌ Cancelar", callback_data="cancel")]])
+
+# Máximo de decks que se ofrecen como botones (el resto se acota con /decks)
+MAX_BOTONES_DECK = 12
+# Máximo de decks en el teclado de /decks (Telegram admite 100 botones por teclado)
+MAX_DECKS_ALCANCE = 90
+
+# El trabajo en curso de una sesión desalojada ya no tiene a quién responder
+sesiones.al_desalojar = lambda user_id: gestor_tareas.cancelar(user_id, "sesion_expirada")
 
 def is_user_authorized(user_id: int) -> bool:
     """Verifica si el usuario está autorizado"""
     return user_id in ALLOWED_USER_IDS
 
+def is_user_admin(user_id: int) -> bool:
+    """Verifica si el usuario puede usar los comandos de administración"""
+    return user_id in ADMIN_USER_IDS
+
+def codificar_parametro_start(palabra: str):
+    """Codifica una palabra como parámetro de /start (máx. 64 caracteres [A-Za-z0-9_-])"""
+    codificado = base64.urlsafe_b64encode(palabra.encode('utf-8')).decode('ascii').rstrip('=')
+    return codificado if len(codificado) <= 64 else None
+
+def decodificar_parametro_start(parametro: str):
+    """Decodifica el parámetro de /start generado por codificar_parametro_start"""
+    try:
+        relleno = '=' * (-len(parametro) % 4)
+        return base64.urlsafe_b64decode(parametro + relleno).decode('utf-8')
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def motivo_interrupcion(update):
+    """
+    Motivo por el que un Update cancela el trabajo en curso de su usuario, o None.
+    El botón Cancelar y una palabra (o texto) nueva dejan obsoleta cualquier generación o búsqueda anterior.
+    """
+    if not isinstance(update, Update):
+        return None
+    if update.callback_query is not None and update.callback_query.data:
+        accion = registro_callbacks.resolver(update.callback_query.data)
+        return "cancelar" if accion is not None and accion.nombre == "cancel" else None
+    mensaje = update.message
+    if mensaje is None or not mensaje.text or update.effective_user is None:
+        return None
+    if mensaje.text.startswith("/word"):
+        return "palabra_nueva"
+    # Mientras se edita un campo, el texto es el nuevo valor del campo
+    if not mensaje.text.startswith("/") and sesiones.estado(update.effective_user.id) != EDITING_FIELD:
+        return "palabra_nueva"
+    return None
+
+def datos_del_borrador(sesion):
+    """Devuelve el borrador de la sesión en formato datos_anki (dict) o None"""
+    return sesion.borrador.a_dict() if sesion.borrador is not None else None
+
+def obtener_datos_palabra(palabra: str):
+    """
+    Obtiene los datos de una palabra desde la cache local o, si no está, desde la IA.
+    De la IA solo se piden los campos del núcleo; los extras se completan con completar_datos_palabra.
+    """
+    datos_anki = cache_palabras.obtener(palabra)
+    if datos_anki is not None:
+        return dict(datos_anki)
+    
+    planificador_cuota.registrar_llamada()
+    datos_anki = obtener_info_nucleo_ia(palabra)
+    if datos_anki is not None:
+        cache_palabras.guardar(palabra, datos_anki)
+    return datos_anki
+
+def completar_datos_palabra(palabra: str, datos_anki):
+    """Segunda fase: genera los extras que faltan y los guarda junto al núcleo en la cache"""
+    completos = cache_palabras.obtener(palabra, completa=True)
+    if completos is not None:
+        return dict(completos)
+    
+    nucleo = {campo.nombre: datos_anki[campo.nombre] for campo in campos_nucleo() if campo.nombre in datos_anki}
+    planificador_cuota.registrar_llamada()
+    completos = obtener_info_extras_ia(palabra, nucleo)
+    if completos is not None:
+        cache_palabras.guardar(palabra, completos)
+    return completos
+
+# Generaciones de extras en curso por palabra (varias peticiones de la misma palabra comparten una)
+_tareas_extras = {}
+
+def iniciar_extras(palabra: str, datos_anki):
+    """Lanza (o reutiliza) la generación de los extras de una palabra en segundo plano"""
+    clave = normalizar_palabra(palabra)
+    tarea = _tareas_extras.get(clave)
+    if tarea is None:
+        # Contexto vacío: la tarea es compartida y no debe heredar la operación (ni la
+        # cancelación) del usuario que la lanzó
+        tarea = asyncio.create_task(
+            asyncio.to_thread(completar_datos_palabra, palabra, datos_anki),
+            context=contextvars.Context()
+        )
+        _tareas_extras[clave] = tarea
+        tarea.add_done_callback(lambda _: _tareas_extras.pop(clave, None))
+    return tarea
+
+async def asegurar_extras(sesion):
+    """Completa el borrador de la sesión con los extras si aún faltan (sin pisar lo editado)"""
+    if not sesion.extras_pendientes or sesion.borrador is None:
+        return
+    # shield: si se cancela la operación de este usuario, la generación sigue para los demás
+    datos = await asyncio.shield(iniciar_extras(sesion.borrador.Palabra, datos_del_borrador(sesion)))
+    sesion.extras_pendientes = False
+    if datos is None:
+        logger.warning("No se pudieron generar los extras de %s", sesion.borrador.Palabra)
+        return
+    for campo in campos_extra():
+        if campo.nombre in CAMPOS_BORRADOR and not getattr(sesion.borrador, campo.nombre) and datos.get(campo.nombre):
+            sesion.borrador.asignar(campo.nombre, datos[campo.nombre])
+
+def cargar_borrador(sesion, datos_anki, nota_existente=None):
+    """
+    Carga un borrador en la sesión olvidando el anterior: la nota que se editaba,
+    los campos modificados y los extras pendientes. Con `nota_existente` el borrador
+    edita esa nota y nunca se completa con extras generados.
+    """
+    sesion.borrador = BorradorTarjeta.desde_dict(datos_anki)
+    sesion.campos_sucios = frozenset()
+    if nota_existente is None:
+        sesion.nota_existente_id = None
+        sesion.campos_originales = None
+        sesion.extras_pendientes = bool(campos_pendientes(datos_anki))
+    else:
+        sesion.nota_existente_id = nota_existente['noteId']
+        sesion.campos_originales = {
+            nombre: campo['value'] for nombre, campo in nota_existente['fields'].items()
+        }
+        sesion.extras_pendientes = False
+
+def preparar_borrador(user_id: int, datos_anki):
+    """Guarda los datos de la palabra en la sesión y devuelve el teclado de confirmación"""
+    sesion = sesiones.obtener(user_id)
+    cargar_borrador(sesion, datos_anki)
+    sesion.estado = CONFIRM_CREATION
+    
+    keyboard = [
+        [
+            InlineKeyboardButton("✅ Crear tarjeta", callback_data="confirm_create"),
+            InlineKeyboardButton("❌ Cancelar", callback_data="cancel")
+        ]
+    ]
+    if sesion.extras_pendientes:
+        keyboard.insert(1, [InlineKeyboardButton("➕ Más", callback_data="more_info")])
+        if EXTRAS_MODE == "fondo":
+            iniciar_extras(sesion.borrador.Palabra, datos_anki)
+    return InlineKeyboardMarkup(keyboard)
+
+async def obtener_datos_palabras(palabras):
+    """
+    Obtiene los datos de varias palabras: las que no están en la cache se piden
+    a la IA en lotes de MINING_BATCH_SIZE, todos los lotes en paralelo.
+    """
+    datos = {}
+    faltan = []
+    for palabra in palabras:
+        en_cache = cache_palabras.obtener(palabra, completa=True)
+        if en_cache is not None:
+            datos[palabra] = dict(en_cache)
+        else:
+            faltan.append(palabra)
+    
+    lotes = [faltan[i:i + MINING_BATCH_SIZE] for i in range(0, len(faltan), MINING_BATCH_SIZE)]
+    for _ in lotes:
+        planificador_cuota.registrar_llamada()
+    for generados in await asyncio.gather(*(asyncio.to_thread(obtener_info_lote_ia, lote) for lote in lotes)):
+        for palabra, datos_anki in generados.items():
+            cache_palabras.guardar(palabra, datos_anki)
+            datos[palabra] = datos_anki
+    return datos
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja el comando /start"""
     user_id = update.effective_user.id
@@ -51,6 +290,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ No estás autorizado para usar este bot.")
         return
     
+    # Enlace profundo desde el modo inline: /start <palabra codificada>
+    if context.args:
+        palabra = decodificar_parametro_start(context.args[0])
+        if palabra:
+            with planificador_cuota.interactivo():
+                await process_word(update, context, palabra)
+            return
+    
     welcome_text = """
 🤖 *¡Bienvenido al Bot de Anki con IA!*
 
@@ -58,6 +305,12 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /start - Muestra este mensaje
 /help - Muestra la ayuda
 /word - Buscar una palabra y crear tarjeta
+/stats - Estadísticas internas del bot
+/decks - Elegir en qué decks buscar y crear tarjetas
+/reenrich - Re-enriquecer un deck existente (admin)
+/profile - Perfilar el bot durante N updates o T segundos (admin)
+
+*Modo inline:* escribe `@bot palabra` en cualquier chat
 
 *¿Cómo usar?*
 1. Envía /word o simplemente escribe una palabra en inglés
@@ -88,6 +341,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • Obtener información completa con IA Gemini
 • Crear tarjetas en Anki automáticamente
 • Verificar si la palabra ya existe en tus mazos
+• Pegar un texto para extraer su vocabulario nuevo y crear varias tarjetas a la vez
 
 *Flujo de trabajo:*
 1. Escribe una palabra en inglés
@@ -109,11 +363,12 @@ async def handle_word_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     # Si se proporciona la palabra directamente con el comando
     if context.args:
         palabra = ' '.join(context.args)
-        await process_word(update, context, palabra)
+        with planificador_cuota.interactivo():
+            await process_word(update, context, palabra)
     else:
         # Solicitar la palabra
         await update.message.reply_text("✍️ Por favor, escribe la palabra en inglés que quieres buscar:")
-        context.user_data['state'] = WAITING_WORD
+        sesiones.obtener(user_id).estado = WAITING_WORD
 
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja mensajes de texto normales"""
@@ -124,203 +379,427 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
     
     text = update.message.text.strip()
+    sesion = sesiones.obtener(user_id)
     
-    # Si estamos esperando una palabra
-    if context.user_data.get('state') == WAITING_WORD:
-        await process_word(update, context, text)
-    
-    # Si estamos editando un campo
-    elif context.user_data.get('state') == EDITING_FIELD:
-        await handle_edit_text(update, context)
-    
-    else:
-        # Si no hay estado específico, asumimos que es una palabra para buscar
-        await process_word(update, context, text)
+    # Mientras se atiende al usuario se pausan los trabajos en segundo plano
+    with planificador_cuota.interactivo():
+        # Un párrafo pegado: extraer el vocabulario en lugar de buscarlo como palabra
+        if sesion.estado != EDITING_FIELD and es_texto(text):
+            await process_text(update, context, text)
+        
+        # Si estamos esperando una palabra
+        elif sesion.estado == WAITING_WORD:
+            await process_word(update, context, text)
+        
+        # Si estamos editando un campo
+        elif sesion.estado == EDITING_FIELD:
+            await handle_edit_text(update, context)
+        
+        else:
+            # Si no hay estado específico, asumimos que es una palabra para buscar
+            await process_word(update, context, text)
 
 async def process_word(update: Update, context: ContextTypes.DEFAULT_TYPE, palabra: str):
     """Procesa una palabra buscada - VERSIÓN MEJORADA"""
+    buscando = await update.message.reply_text(
+        f"🔍 *Buscando información para: {palabra}*", parse_mode='Markdown', reply_markup=TECLADO_CANCELAR
+    )
+    try:
+        await buscar_y_mostrar_palabra(update, context, palabra)
+    except asyncio.CancelledError:
+        # Interrumpida (Cancelar, palabra nueva o plazo): que el botón no cancele lo siguiente
+        try:
+            await buscando.edit_text(f"⏹️ Búsqueda de '{palabra}' interrumpida.")
+        except Exception:
+            pass
+        raise
+    # Terminada la búsqueda, el botón ya no tiene nada que cancelar
+    await buscando.edit_reply_markup(reply_markup=None)
+
+async def buscar_y_mostrar_palabra(update: Update, context: ContextTypes.DEFAULT_TYPE, palabra: str):
+    """Busca la palabra en los decks y, si no existe, muestra la información generada"""
     user_id = update.effective_user.id
     
-    await update.message.reply_text(f"🔍 *Buscando información para: {palabra}*", parse_mode='Markdown')
-    
-    # PRIMERO: Buscar en todos los decks de Anki
-    decks = ["0 USA::STEP 1", "0 USA::Self-Learning"]
-    todas_notas_ids = []
-    
-    for deck in decks:
-        note_ids = buscar_palabra_en_deck(deck, palabra)
-        todas_notas_ids.extend(note_ids)
+    # PRIMERO: Buscar en los decks del alcance del usuario (una sola búsqueda)
+    decks = metadatos_anki.alcance(user_id)
+    todas_notas_ids = await asyncio.to_thread(buscar_palabra_en_decks, decks, palabra)
     
-    # SI EXISTE EN ANKI: Mostrar opciones
+    # SI EXISTE EN ANKI: Mostrar opciones (solo se piden a Anki las notas de la primera página)
     if todas_notas_ids:
-        notas_existentes = obtener_info_notas(todas_notas_ids)
-        mensaje = formatear_notas_existentes(notas_existentes)
-        
-        keyboard = [
-            [
-                InlineKeyboardButton("✏️ Editar existente", callback_data=f"edit_existing:{palabra}"),
-                InlineKeyboardButton("🆕 Crear nueva", callback_data=f"create_new:{palabra}")
-            ],
-            [InlineKeyboardButton("❌ Cancelar", callback_data="cancel")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        sesion = sesiones.obtener(user_id)
+        sesion.palabra_encontrada = palabra
+        sesion.notas_encontradas = tuple(todas_notas_ids)
+        sesion.botones_notas = ()
+        sesion.boton_crear_nota = callback_data("create_new", palabra)
+        mensaje, reply_markup = await pagina_notas_existentes(sesion, 0)
         
-        await update.message.reply_text(
-            f"✅ *La palabra '{palabra}' ya existe en Anki*\n\n{mensaje}",
-            parse_mode='Markdown', 
-            reply_markup=reply_markup
-        )
+        await update.message.reply_text(mensaje, parse_mode='Markdown', reply_markup=reply_markup)
         return
     
     # SI NO EXISTE: Proceder con IA como antes
-    datos_anki = obtener_info_completa_ia(palabra)
+    datos_anki = await asyncio.to_thread(obtener_datos_palabra, palabra)
     
     if datos_anki is None:
         await update.message.reply_text("❌ Error al obtener la información de la IA. Intenta nuevamente.")
         return
     
-    # Guardar datos en el contexto del usuario
-    context.user_data['current_word_data'] = datos_anki
-    context.user_data['state'] = CONFIRM_CREATION
+    # Guardar datos en la sesión del usuario
+    reply_markup = preparar_borrador(user_id, datos_anki)
     
     # Formatear y mostrar la información
     mensaje_info = formatear_json_para_telegram(datos_anki)
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ Crear tarjeta", callback_data="confirm_create"),
-            InlineKeyboardButton("❌ Cancelar", callback_data="cancel")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     await update.message.reply_text(mensaje_info, parse_mode='Markdown', reply_markup=reply_markup)
 
+async def pagina_notas_existentes(sesion, pagina):
+    """Mensaje y teclado de una página de las notas que ya existen para la palabra buscada"""
+    note_ids = sesion.notas_encontradas
+    texto, pagina, mostradas = await paginas_notas.pagina(note_ids, pagina)
+    total = paginas_notas.paginas(note_ids)
+    
+    cabecera = (f"✅ *La palabra '{sesion.palabra_encontrada}' ya existe en Anki*\n\n"
+                f"📋 *Tarjetas existentes encontradas:* {len(note_ids)}")
+    if total > 1:
+        cabecera += f" (página {pagina + 1} de {total})"
+    
+    # Un botón de edición por nota mostrada; el token de cada nota se reutiliza al volver a su página
+    tokens = dict(sesion.botones_notas)
+    for _, note_id in mostradas:
+        if note_id not in tokens:
+            tokens[note_id] = callback_data("edit_existing", note_id)
+    sesion.botones_notas = tuple(tokens.items())
+    keyboard = []
+    if mostradas:
+        keyboard.append([
+            InlineKeyboardButton(f"✏️ Editar #{numero}", callback_data=tokens[note_id])
+            for numero, note_id in mostradas
+        ])
+    keyboard.append([InlineKeyboardButton("🆕 Crear nueva", callback_data=sesion.boton_crear_nota)])
+    navegacion = []
+    if pagina > 0:
+        navegacion.append(InlineKeyboardButton("◀️ Anteriores", callback_data=callback_data("notes_page", pagina - 1)))
+    if pagina + 1 < total:
+        navegacion.append(InlineKeyboardButton("Siguientes ▶️", callback_data=callback_data("notes_page", pagina + 1)))
+    if navegacion:
+        keyboard.append(navegacion)
+    keyboard.append([InlineKeyboardButton("❌ Cancelar", callback_data="cancel")])
+    return f"{cabecera}\n\n{texto}", InlineKeyboardMarkup(keyboard)
+
+async def boton_pagina_notas(query, context, accion):
+    """Muestra otra página de las notas existentes de la palabra buscada"""
+    sesion = sesiones.obtener(query.from_user.id)
+    if not sesion.notas_encontradas:
+        await query.edit_message_text("⌛ Esta búsqueda ha expirado. Vuelve a buscar la palabra.")
+        return
+    mensaje, reply_markup = await pagina_notas_existentes(sesion, int(accion.argumento))
+    await query.edit_message_text(mensaje, parse_mode='Markdown', reply_markup=reply_markup)
+
 async def handle_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Maneja los botones inline"""
+    """Maneja los botones inline despachando por tabla según la acción"""
     query = update.callback_query
     await query.answer()
     
     user_id = query.from_user.id
-    data = query.data
     
     if not is_user_authorized(user_id):
         await query.edit_message_text("❌ No estás autorizado para usar este bot.")
         return
     
-    if data == "cancel":
-        await query.edit_message_text("❌ Operación cancelada.")
-        context.user_data.clear()
+    accion = registro_callbacks.resolver(query.data)
+    if accion is None:
+        await query.edit_message_text("⌛ Este botón ha expirado. Vuelve a buscar la palabra.")
+        return
     
-    # Editar tarjeta existente
-    elif data.startswith("edit_existing:"):
-        palabra = data.split(":")[1]
-        await query.edit_message_text(f"✏️ *Editando tarjeta existente para: {palabra}*", parse_mode='Markdown')
-        
-        # Buscar la tarjeta existente
-        decks = ["0 USA::STEP 1", "0 USA::Self-Learning"]
-        todas_notas_ids = []
-        
-        for deck in decks:
-            note_ids = buscar_palabra_en_deck(deck, palabra)
-            todas_notas_ids.extend(note_ids)
-        
-        if not todas_notas_ids:
-            await query.edit_message_text("❌ No se encontró la tarjeta para editar.")
-            return
-        
-        # Obtener información de la primera tarjeta encontrada
-        notas_existentes = obtener_info_notas([todas_notas_ids[0]])
-        if not notas_existentes:
-            await query.edit_message_text("❌ Error al obtener información de la tarjeta.")
-            return
-        
-        # Convertir la tarjeta existente al formato que usa el sistema de edición
-        nota_existente = notas_existentes[0]
-        datos_existentes = convertir_nota_a_datos_anki(nota_existente, palabra)
-        
-        context.user_data['current_word_data'] = datos_existentes
-        context.user_data['editing_existing_note'] = True
-        context.user_data['existing_note_id'] = nota_existente['noteId']
-        
-        await edit_card_menu(query, context)
+    registrar_accion(query.data, accion)
+    manejador = BUTTON_HANDLERS.get(accion.nombre)
+    if manejador is None:
+        logger.warning("Acción de botón desconocida: %s", accion.nombre)
+        return
     
-    # Crear nueva tarjeta aunque exista
-    elif data.startswith("create_new:"):
-        palabra = data.split(":")[1]
-        await query.edit_message_text(f"🆕 *Creando nueva tarjeta para: {palabra}*", parse_mode='Markdown')
-        
-        # Proceder con IA como normalmente
-        datos_anki = obtener_info_completa_ia(palabra)
-        
-        if datos_anki is None:
-            await query.edit_message_text("❌ Error al obtener la información de la IA. Intenta nuevamente.")
-            return
-        
-        context.user_data['current_word_data'] = datos_anki
-        context.user_data['state'] = CONFIRM_CREATION
-        
-        mensaje_info = formatear_json_para_telegram(datos_anki)
-        
-        keyboard = [
-            [
-                InlineKeyboardButton("✅ Crear tarjeta", callback_data="confirm_create"),
-                InlineKeyboardButton("❌ Cancelar", callback_data="cancel")
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(mensaje_info, parse_mode='Markdown', reply_markup=reply_markup)
+    with planificador_cuota.interactivo():
+        await manejador(query, context, accion)
+
+async def process_text(update: Update, context: ContextTypes.DEFAULT_TYPE, texto: str):
+    """Extrae las palabras nuevas de un texto y ofrece elegirlas con un teclado de selección múltiple"""
+    candidatas = extraer_candidatas(texto)
+    if not candidatas:
+        await update.message.reply_text("✅ No encontré palabras nuevas en el texto: ya están todas en tus decks.")
+        return
     
-    elif data.startswith("create_anyway:"):
-        palabra = data.split(":")[1]
-        await query.edit_message_text(f"🔍 *Buscando información para: {palabra}*", parse_mode='Markdown')
-        
-        datos_anki = obtener_info_completa_ia(palabra)
-        
-        if datos_anki is None:
-            await query.edit_message_text("❌ Error al obtener la información de la IA. Intenta nuevamente.")
-            return
-        
-        context.user_data['current_word_data'] = datos_anki
-        context.user_data['state'] = CONFIRM_CREATION
-        
-        mensaje_info = formatear_json_para_telegram(datos_anki)
-        
-        keyboard = [
-            [
-                InlineKeyboardButton("✅ Crear tarjeta", callback_data="confirm_create"),
-                InlineKeyboardButton("❌ Cancelar", callback_data="cancel")
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(mensaje_info, parse_mode='Markdown', reply_markup=reply_markup)
+    sesion = sesiones.obtener(update.effective_user.id)
+    sesion.estado = SELECTING_WORDS
+    sesion.candidatas = tuple(candidatas)
+    # Los tokens de los botones se registran una sola vez y se reutilizan al redibujar
+    sesion.botones_candidatas = tuple(callback_data("mine_toggle", i) for i in range(len(candidatas)))
+    sesion.botones_decks = tuple(
+        (deck, callback_data("mine_deck", deck)) for deck in await decks_ofrecidos(update.effective_user.id)
+    )
+    sesion.seleccion = frozenset()
     
-    elif data == "confirm_create":
-        await choose_card_type(query, context)
+    await update.message.reply_text(
+        f"📝 *Encontré {len(candidatas)} palabras nuevas en el texto*\n\n"
+        "Marca las que quieras aprender y elige el deck:",
+        parse_mode='Markdown',
+        reply_markup=teclado_seleccion(sesion)
+    )
+
+def teclado_seleccion(sesion):
+    """Teclado de selección múltiple de las palabras candidatas"""
+    botones = [
+        InlineKeyboardButton(f"{'✅' if i in sesion.seleccion else '▫️'} {palabra}", callback_data=token)
+        for i, (palabra, token) in enumerate(zip(sesion.candidatas, sesion.botones_candidatas))
+    ]
+    keyboard = [botones[i:i + 3] for i in range(0, len(botones), 3)]
+    keyboard.append([InlineKeyboardButton("☑️ Todas", callback_data="mine_all")])
+    decks = [
+        InlineKeyboardButton(f"📚 {etiqueta_deck(deck)} ({len(sesion.seleccion)})", callback_data=token)
+        for deck, token in sesion.botones_decks
+    ]
+    keyboard.extend(decks[i:i + 2] for i in range(0, len(decks), 2))
+    keyboard.append([InlineKeyboardButton("❌ Cancelar", callback_data="cancel")])
+    return InlineKeyboardMarkup(keyboard)
+
+async def decks_ofrecidos(user_id):
+    """Decks del alcance del usuario para los botones (los metadatos se cargan si aún no están)"""
+    if not metadatos_anki.cargado:
+        await asyncio.to_thread(metadatos_anki.refrescar)
+    return metadatos_anki.alcance(user_id)[:MAX_BOTONES_DECK]
+
+async def boton_alternar_candidata(query, context, accion):
+    """Marca o desmarca una palabra candidata (mine_toggle / mine_all)"""
+    sesion = sesiones.obtener(query.from_user.id)
+    if sesion.estado != SELECTING_WORDS:
+        await query.edit_message_text("⌛ Esta selección ha expirado. Vuelve a enviar el texto.")
+        return
+    if accion.nombre == "mine_all":
+        todas = frozenset(range(len(sesion.candidatas)))
+        sesion.seleccion = frozenset() if sesion.seleccion == todas else todas
+    else:
+        sesion.seleccion = sesion.seleccion ^ {accion.argumento}
+    await query.edit_message_reply_markup(reply_markup=teclado_seleccion(sesion))
+
+async def boton_generar_seleccion(query, context, accion):
+    """Genera las palabras elegidas en lotes y las crea en Anki con una sola llamada"""
+    sesion = sesiones.obtener(query.from_user.id)
+    if sesion.estado != SELECTING_WORDS:
+        await query.edit_message_text("⌛ Esta selección ha expirado. Vuelve a enviar el texto.")
+        return
+    if not sesion.seleccion:
+        await query.edit_message_text(
+            "📝 *Marca al menos una palabra* y elige el deck:",
+            parse_mode='Markdown',
+            reply_markup=teclado_seleccion(sesion)
+        )
+        return
     
-    elif data in ["basic_card", "reversed_card"]:
-        context.user_data['card_type'] = "Basic" if data == "basic_card" else "Basic (and reversed card)"
-        await choose_deck(query, context)
+    palabras = [sesion.candidatas[i] for i in sorted(sesion.seleccion)]
+    deck_name = accion.argumento
+    sesiones.limpiar(query.from_user.id)
+    
+    await query.edit_message_text(f"⏳ Generando {len(palabras)} palabras con IA...", reply_markup=TECLADO_CANCELAR)
+    datos = await obtener_datos_palabras(palabras)
+    generadas = [palabra for palabra in palabras if palabra in datos]
+    datos.update(zip(generadas, await audio_pronunciacion.con_audio_async([datos[p] for p in generadas])))
+    
+    await query.edit_message_text(f"⏳ Creando {len(generadas)} tarjetas en Anki...")
+    note_ids = await asyncio.to_thread(crear_tarjetas_lote, [datos[p] for p in generadas],
+                                    metadatos_anki.modelo("basic_card"), deck_name)
+    creadas = {palabra: note_id for palabra, note_id in zip(generadas, note_ids) if note_id}
+    
+    for palabra, note_id in creadas.items():
+        await asyncio.to_thread(almacen_notas.guardar, note_id, datos[palabra])
+    for nota in await asyncio.to_thread(obtener_info_notas, list(creadas.values())) if creadas else []:
+        indice_decks.agregar_nota(nota, deck_name)
+    
+    mensaje = f"✅ {len(creadas)} tarjetas creadas en {deck_name}"
+    if creadas:
+        mensaje += ":\n" + ", ".join(creadas)
+    no_generadas = [p for p in palabras if p not in datos]
+    duplicadas = [p for p in generadas if p not in creadas]
+    if no_generadas:
+        mensaje += f"\n\n❌ Sin respuesta de la IA: {', '.join(no_generadas)}"
+    if duplicadas:
+        mensaje += f"\n\n⚠️ No creadas (duplicadas o error de Anki): {', '.join(duplicadas)}"
+    await query.edit_message_text(mensaje)
+
+async def handle_decks_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Maneja /decks: elegir en qué decks se buscan las palabras y cuáles se ofrecen al crear"""
+    user_id = update.effective_user.id
     
-    elif data in ["deck_step1", "deck_self_learning"]:
-        context.user_data['chosen_deck'] = data
-        await show_card_preview(query, context)
+    if not is_user_authorized(user_id):
+        await update.message.reply_text("❌ No estás autorizado.")
+        return
     
-    elif data == "confirm_create_final":
-        await create_card_final(query, context)
+    if not metadatos_anki.cargado:
+        await asyncio.to_thread(metadatos_anki.refrescar)
+    if not metadatos_anki.decks:
+        await update.message.reply_text("❌ No se pudo leer la lista de decks de Anki. ¿Está Anki ejecutándose?")
+        return
     
-    # Manejo de edición
-    elif data == "edit_card":
-        await edit_card_menu(query, context)
+    # Misma selección múltiple que la minería de textos, con los decks como candidatas
+    sesion = sesiones.obtener(user_id)
+    sesion.estado = SELECTING_DECKS
+    sesion.candidatas = tuple(metadatos_anki.decks[:MAX_DECKS_ALCANCE])
+    sesion.botones_candidatas = tuple(callback_data("scope_toggle", i) for i in range(len(sesion.candidatas)))
+    alcance = set(metadatos_anki.alcance(user_id))
+    sesion.seleccion = frozenset(i for i, deck in enumerate(sesion.candidatas) if deck in alcance)
+    
+    await update.message.reply_text(
+        "🗂️ *Decks donde buscar tus palabras*\n\n"
+        "Los marcados se consultan al buscar y se ofrecen al crear tarjetas:",
+        parse_mode='Markdown',
+        reply_markup=teclado_alcance(sesion)
+    )
+
+def teclado_alcance(sesion):
+    """Teclado de /decks: un deck por fila, marcado si está en el alcance"""
+    keyboard = [
+        [InlineKeyboardButton(f"{'✅' if i in sesion.seleccion else '▫️'} {deck}", callback_data=token)]
+        for i, (deck, token) in enumerate(zip(sesion.candidatas, sesion.botones_candidatas))
+    ]
+    keyboard.append([
+        InlineKeyboardButton(f"💾 Guardar ({len(sesion.seleccion)})", callback_data="scope_save"),
+        InlineKeyboardButton("↩️ Por defecto", callback_data="scope_reset")
+    ])
+    keyboard.append([InlineKeyboardButton("❌ Cancelar", callback_data="cancel")])
+    return InlineKeyboardMarkup(keyboard)
+
+async def boton_alternar_alcance(query, context, accion):
+    """Marca o desmarca un deck del alcance (scope_toggle)"""
+    sesion = sesiones.obtener(query.from_user.id)
+    if sesion.estado != SELECTING_DECKS:
+        await query.edit_message_text("⌛ Esta selección ha expirado. Vuelve a usar /decks.")
+        return
+    sesion.seleccion = sesion.seleccion ^ {accion.argumento}
+    await query.edit_message_reply_markup(reply_markup=teclado_alcance(sesion))
+
+async def boton_guardar_alcance(query, context, accion):
+    """Guarda los decks marcados (scope_save) o vuelve al alcance por defecto (scope_reset)"""
+    user_id = query.from_user.id
+    sesion = sesiones.obtener(user_id)
+    if sesion.estado != SELECTING_DECKS:
+        await query.edit_message_text("⌛ Esta selección ha expirado. Vuelve a usar /decks.")
+        return
+    if accion.nombre == "scope_save" and not sesion.seleccion:
+        await query.edit_message_text(
+            "🗂️ *Marca al menos un deck* o vuelve al alcance por defecto:",
+            parse_mode='Markdown',
+            reply_markup=teclado_alcance(sesion)
+        )
+        return
     
-    elif data.startswith("edit_field:"):
-        field_name = data.split(":")[1]
-        await handle_field_edit(query, context, field_name)
+    decks = [sesion.candidatas[i] for i in sorted(sesion.seleccion)] if accion.nombre == "scope_save" else []
+    await asyncio.to_thread(metadatos_anki.guardar_alcance, user_id, decks)
+    sesiones.limpiar(user_id)
     
-    elif data == "finish_editing":
-        await finish_editing(query, context)
+    alcance = metadatos_anki.alcance(user_id)
+    titulo = "✅ Alcance guardado" if decks else "↩️ Alcance por defecto"
+    await query.edit_message_text(f"{titulo}: busco en {len(alcance)} decks\n" + "\n".join(f"• {d}" for d in alcance))
+
+async def boton_cancelar(query, context, accion):
+    await query.edit_message_text("❌ Operación cancelada.")
+    sesiones.limpiar(query.from_user.id)
+
+async def boton_editar_existente(query, context, accion):
+    """Editar la tarjeta existente cuyo botón se pulsó (el botón lleva su noteId)"""
+    note_id = int(accion.argumento)
+    sesion = sesiones.obtener(query.from_user.id)
+    await query.edit_message_text(f"✏️ *Editando tarjeta existente* `{note_id}`", parse_mode='Markdown')
+    
+    notas_existentes = await asyncio.to_thread(obtener_info_notas, [note_id])
+    if not notas_existentes or not notas_existentes[0]:
+        await query.edit_message_text("❌ No se encontró la tarjeta para editar.")
+        return
+    
+    # Cargar el borrador guardado junto a la nota; solo si no existe (o la nota
+    # se modificó fuera del bot) se convierte el HTML de la tarjeta
+    nota_existente = notas_existentes[0]
+    if note_id in sesion.notas_encontradas:
+        palabra = sesion.palabra_encontrada
+    else:
+        # Botón de una búsqueda anterior a la de la sesión: la palabra sale de la propia nota
+        palabra = palabra_desde_front(nota_existente['fields']['Front']['value'])
+    datos_existentes = cargar_datos_nota(nota_existente, palabra)
+    
+    cargar_borrador(sesion, datos_existentes, nota_existente)
+    
+    await edit_card_menu(query, context)
+
+def cargar_datos_nota(nota, palabra):
+    """Obtiene el borrador editable de una nota desde el almacén local o reinterpretando su HTML"""
+    datos_guardados = almacen_notas.obtener(nota['noteId'])
+    if datos_guardados is not None:
+        valores_actuales = {nombre: campo['value'] for nombre, campo in nota['fields'].items()}
+        campos_guardados = construir_campos_nota(datos_guardados)
+        if all(valores_actuales.get(nombre) == valor for nombre, valor in campos_guardados.items()):
+            return datos_guardados
+    
+    datos_existentes = convertir_nota_a_datos_anki(nota, palabra)
+    # Conservar lo que no se puede reconstruir desde la tarjeta
+    if datos_guardados is not None:
+        for campo in ('Gramatica', 'Etimologia'):
+            if datos_guardados.get(campo):
+                datos_existentes[campo] = datos_guardados[campo]
+    return datos_existentes
+
+async def boton_generar_palabra(query, context, accion):
+    """Crear nueva tarjeta aunque exista (create_new / create_anyway)"""
+    palabra = accion.argumento
+    if accion.nombre == "create_new":
+        await query.edit_message_text(f"🆕 *Creando nueva tarjeta para: {palabra}*", parse_mode='Markdown',
+                                      reply_markup=TECLADO_CANCELAR)
+    else:
+        await query.edit_message_text(f"🔍 *Buscando información para: {palabra}*", parse_mode='Markdown',
+                                      reply_markup=TECLADO_CANCELAR)
+    
+    # Proceder con IA como normalmente
+    datos_anki = await asyncio.to_thread(obtener_datos_palabra, palabra)
+    
+    if datos_anki is None:
+        await query.edit_message_text("❌ Error al obtener la información de la IA. Intenta nuevamente.")
+        return
+    
+    reply_markup = preparar_borrador(query.from_user.id, datos_anki)
+    mensaje_info = formatear_json_para_telegram(datos_anki)
+    await query.edit_message_text(mensaje_info, parse_mode='Markdown', reply_markup=reply_markup)
+
+async def boton_mas_info(query, context, accion):
+    """Genera los extras de la palabra y muestra la información completa"""
+    sesion = sesiones.obtener(query.from_user.id)
+    if sesion.borrador is None:
+        await query.edit_message_text("⌛ Esta búsqueda ha expirado. Vuelve a buscar la palabra.")
+        return
+    
+    await asegurar_extras(sesion)
+    sesion.estado = CONFIRM_CREATION
+    keyboard = [
+        [
+            InlineKeyboardButton("✅ Crear tarjeta", callback_data="confirm_create"),
+            InlineKeyboardButton("❌ Cancelar", callback_data="cancel")
+        ]
+    ]
+    await query.edit_message_text(
+        formatear_json_para_telegram(datos_del_borrador(sesion)),
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+async def boton_confirmar_creacion(query, context, accion):
+    """Confirma la creación; los extras que falten se generan mientras se eligen tipo y deck"""
+    sesion = sesiones.obtener(query.from_user.id)
+    if sesion.extras_pendientes and sesion.borrador is not None:
+        iniciar_extras(sesion.borrador.Palabra, datos_del_borrador(sesion))
+    await choose_card_type(query, context)
+
+async def boton_tipo_tarjeta(query, context, accion):
+    sesiones.obtener(query.from_user.id).tipo_tarjeta = metadatos_anki.modelo(accion.nombre)
+    await choose_deck(query, context)
+
+async def boton_deck(query, context, accion):
+    sesiones.obtener(query.from_user.id).deck_elegido = accion.argumento
+    await show_card_preview(query, context)
+
+async def boton_editar_campo(query, context, accion):
+    await handle_field_edit(query, context, accion.argumento)
 
 async def choose_card_type(query, context):
     """Permite elegir el tipo de tarjeta"""
@@ -340,14 +819,17 @@ async def choose_card_type(query, context):
     )
 
 async def choose_deck(query, context):
-    """Permite elegir el deck"""
-    keyboard = [
-        [
-            InlineKeyboardButton("📚 STEP 1", callback_data="deck_step1"),
-            InlineKeyboardButton("🎓 Self-Learning", callback_data="deck_self_learning")
-        ],
-        [InlineKeyboardButton("❌ Cancelar", callback_data="cancel")]
+    """Permite elegir el deck entre los del alcance del usuario"""
+    decks = await decks_ofrecidos(query.from_user.id)
+    if not decks:
+        await query.edit_message_text("❌ No se pudo leer la lista de decks de Anki. ¿Está Anki ejecutándose?")
+        return
+    botones = [
+        InlineKeyboardButton(f"📚 {etiqueta_deck(deck)}", callback_data=callback_data("deck", deck))
+        for deck in decks
     ]
+    keyboard = [botones[i:i + 2] for i in range(0, len(botones), 2)]
+    keyboard.append([InlineKeyboardButton("❌ Cancelar", callback_data="cancel")])
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     await query.edit_message_text(
@@ -358,8 +840,10 @@ async def choose_deck(query, context):
 
 async def show_card_preview(query, context):
     """Muestra una vista previa de la tarjeta antes de crear"""
-    datos_anki = context.user_data.get('current_word_data')
-    card_type = context.user_data.get('card_type', 'Basic')
+    sesion = sesiones.obtener(query.from_user.id)
+    await asegurar_extras(sesion)
+    datos_anki = datos_del_borrador(sesion)
+    card_type = sesion.tipo_tarjeta or metadatos_anki.modelo("basic_card")
     
     if not datos_anki:
         await query.edit_message_text("❌ Error: No hay datos de la palabra.")
@@ -405,13 +889,15 @@ async def show_card_preview(query, context):
 
 async def create_card_final(query, context):
     """Crea la tarjeta final en Anki o edita una existente - VERSIÓN CORREGIDA"""
-    datos_anki = context.user_data.get('current_word_data')
-    card_type = context.user_data.get('card_type', 'Basic')
-    deck_name = context.user_data.get('chosen_deck')
+    sesion = sesiones.obtener(query.from_user.id)
+    await asegurar_extras(sesion)
+    datos_anki = datos_del_borrador(sesion)
+    card_type = sesion.tipo_tarjeta or metadatos_anki.modelo("basic_card")
+    deck_name = sesion.deck_elegido
     
     # Verificar si estamos editando una tarjeta existente
-    editing_existing = context.user_data.get('editing_existing_note', False)
-    existing_note_id = context.user_data.get('existing_note_id')
+    existing_note_id = sesion.nota_existente_id
+    editing_existing = existing_note_id is not None
     
     if not datos_anki:
         await query.edit_message_text("❌ Error: No hay datos de la palabra. Intenta nuevamente.")
@@ -423,13 +909,31 @@ async def create_card_final(query, context):
     
     if editing_existing and existing_note_id:
         await query.edit_message_text("⏳ Actualizando tarjeta en Anki...")
-        resultado = editar_tarjeta_existente_completa(existing_note_id, datos_anki, card_type, deck_name)
+        # Todas las ediciones del borrador se envían en una única llamada con solo los campos modificados
+        resultado = await asyncio.to_thread(
+            editar_tarjeta_existente_completa,
+            existing_note_id, datos_anki, card_type, deck_name,
+            campos_originales=sesion.campos_originales,
+            campos_sucios=sesion.campos_sucios
+        )
     else:
         await query.edit_message_text("⏳ Creando tarjeta en Anki...")
-        resultado = crear_tarjeta_anki(datos_anki, card_type, deck_name)
+        # El audio se sintetiza (o sale de la cache) en el pool de voz y se sube solo si Anki no lo tiene
+        datos_anki = (await audio_pronunciacion.con_audio_async([datos_anki]))[0]
+        resultado = await asyncio.to_thread(crear_tarjeta_anki, datos_anki, card_type, deck_name)
     
     # Limpiar datos del usuario PRIMERO
-    context.user_data.clear()
+    sesiones.limpiar(query.from_user.id)
+    
+    # Mantener el índice local y el borrador guardado al día con la nota nueva o actualizada
+    if isinstance(resultado, dict) and resultado.get('success'):
+        nota_id = existing_note_id if editing_existing else resultado.get('note_id')
+        if not resultado.get('sin_cambios'):
+            await asyncio.to_thread(almacen_notas.guardar, nota_id, datos_anki)
+            paginas_notas.olvidar([nota_id])
+        notas = await asyncio.to_thread(obtener_info_notas, [nota_id]) if nota_id else []
+        for nota in notas:
+            indice_decks.agregar_nota(nota, deck_name)
     
     # MANEJO DE RESPUESTAS
     if resultado is None:
@@ -487,7 +991,7 @@ async def create_card_final(query, context):
         await query.edit_message_text(mensaje_final, parse_mode='Markdown')
     except Exception as e:
         # Si falla Markdown, enviar sin formato
-        print(f"Error con Markdown, enviando sin formato: {e}")
+        logger.warning("Error con Markdown, enviando sin formato: %s", e)
         mensaje_sin_formato = f"""
 🎉 TARJETA {action.upper()} CON ÉXITO
 
@@ -505,9 +1009,23 @@ CONTENIDO FINAL:
         """
         await query.edit_message_text(mensaje_sin_formato)
 
+def teclado_edicion():
+    """Teclado del menú de edición: editar a mano o regenerar con IA cada campo"""
+    keyboard = []
+    for nombre, etiqueta, regenerable in CAMPOS_EDICION:
+        fila = [InlineKeyboardButton(etiqueta, callback_data=callback_data("edit_field", nombre))]
+        if regenerable:
+            fila.append(InlineKeyboardButton("🔄 regenerar", callback_data=callback_data("regen_field", nombre)))
+        keyboard.append(fila)
+    keyboard.append([
+        InlineKeyboardButton("✅ Finalizar edición", callback_data="finish_editing"),
+        InlineKeyboardButton("🚪 Salir sin guardar", callback_data="cancel")
+    ])
+    return InlineKeyboardMarkup(keyboard)
+
 async def edit_card_menu(query, context):
     """Menú para seleccionar qué campo editar - VERSIÓN SIMPLIFICADA"""
-    datos_anki = context.user_data.get('current_word_data')
+    datos_anki = datos_del_borrador(sesiones.obtener(query.from_user.id))
     
     if not datos_anki:
         await query.edit_message_text("❌ Error: No hay datos de la palabra para editar.")
@@ -546,25 +1064,18 @@ async def edit_card_menu(query, context):
     """
     
     # TECLADO SIMPLIFICADO - Solo campos que van a Anki
-    keyboard = [
-        [InlineKeyboardButton("📝 Palabra", callback_data="edit_field:Palabra")],
-        [InlineKeyboardButton("🔊 Pronunciación", callback_data="edit_field:Pronunciacion")],
-        [InlineKeyboardButton("📖 Significado", callback_data="edit_field:Significado")],
-        [InlineKeyboardButton("💬 Oración común", callback_data="edit_field:Oracion_Comun")],
-        [InlineKeyboardButton("🏥 Oración médica", callback_data="edit_field:Oracion_medica")],
-        [
-            InlineKeyboardButton("✅ Finalizar edición", callback_data="finish_editing"),
-            InlineKeyboardButton("🚪 Salir sin guardar", callback_data="cancel")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = teclado_edicion()
     
     await query.edit_message_text(preview_text, parse_mode='Markdown', reply_markup=reply_markup)
 
 async def handle_field_edit(query, context, field_name):
     """Maneja la edición de un campo específico - VERSIÓN MEJORADA"""
-    context.user_data['editing_field'] = field_name
-    context.user_data['state'] = EDITING_FIELD
+    sesion = sesiones.obtener(query.from_user.id)
+    if sesion.borrador is None:
+        await query.edit_message_text("❌ Error: No hay datos de la palabra para editar.")
+        return
+    sesion.campo_editando = field_name
+    sesion.estado = EDITING_FIELD
     
     field_descriptions = {
         'Palabra': 'la palabra principal',
@@ -575,9 +1086,9 @@ async def handle_field_edit(query, context, field_name):
     }
     
     description = field_descriptions.get(field_name, field_name)
-    current_value = context.user_data['current_word_data'].get(field_name, '')
+    current_value = getattr(sesion.borrador, field_name, '')
     
-    if isinstance(current_value, list):
+    if isinstance(current_value, tuple):
         current_value = '\n'.join([f"• {item}" for item in current_value])
     
     # ENVIAR NUEVO MENSAJE en lugar de editar el anterior
@@ -602,6 +1113,81 @@ async def handle_field_edit(query, context, field_name):
     # Mantener el mensaje anterior con los botones visible
     await query.answer(f"Preparado para editar {description}...")
 
+async def boton_regenerar_campo(query, context, accion):
+    """
+    Regenera un solo campo con un prompt corto (el resto del borrador como contexto),
+    mostrando el texto a medida que llega y guardándolo en el borrador y en la cache.
+    """
+    field_name = accion.argumento
+    sesion = sesiones.obtener(query.from_user.id)
+    if sesion.borrador is None:
+        await query.edit_message_text("❌ Error: No hay datos de la palabra para editar.")
+        return
+    
+    etiqueta = next((e for nombre, e, _ in CAMPOS_EDICION if nombre == field_name), field_name)
+    mensaje = await context.bot.send_message(chat_id=query.message.chat_id, text=f"🔄 Regenerando {etiqueta}...")
+    
+    planificador_cuota.registrar_llamada()
+    trozos = regenerar_campo_stream(field_name, datos_del_borrador(sesion))
+    texto = ""
+    ultima_edicion = time.monotonic()
+    siguiente = None
+    try:
+        # El backend es síncrono: cada trozo se espera en un hilo para no bloquear el bucle.
+        # shield: al cancelar, el next() en curso no se abandona (sigue corriendo en el hilo)
+        while True:
+            siguiente = asyncio.ensure_future(asyncio.to_thread(next, trozos, None))
+            trozo = await asyncio.shield(siguiente)
+            if trozo is None:
+                break
+            texto += trozo
+            if time.monotonic() - ultima_edicion >= STREAM_EDIT_INTERVAL:
+                ultima_edicion = time.monotonic()
+                try:
+                    await mensaje.edit_text(f"🔄 {etiqueta}:\n{texto}")
+                except TelegramError as e:
+                    # Un fallo al mostrar el progreso (límite de ediciones, red) no es un
+                    # fallo de la IA: se sigue leyendo y se reintenta en la próxima edición
+                    logger.debug("No se pudo mostrar el progreso de %s: %s", field_name, e)
+    except asyncio.CancelledError:
+        # Cerrar el generador mientras next() se ejecuta en el hilo lanzaría
+        # "generator already executing": primero se espera a que termine
+        if siguiente is not None:
+            await asyncio.wait({siguiente})
+            if not siguiente.cancelled():
+                siguiente.exception()  # ya no interesa: que no se registre como no recogida
+        try:
+            await mensaje.edit_text(f"⏹️ Regeneración de {etiqueta} cancelada.")
+        except TelegramError:
+            pass
+        raise
+    except Exception as e:
+        logger.error("Error al regenerar %s: %s", field_name, e)
+        await mensaje.edit_text(f"❌ No se pudo regenerar {etiqueta}. Intenta nuevamente.")
+        return
+    finally:
+        trozos.close()
+    
+    valor = interpretar_campo(field_name, texto)
+    if not valor:
+        await mensaje.edit_text(f"❌ La IA no devolvió un valor para {etiqueta}.")
+        return
+    
+    valor_anterior = getattr(sesion.borrador, field_name)
+    sesion.borrador.asignar(field_name, valor)
+    if getattr(sesion.borrador, field_name) != valor_anterior:
+        sesion.campos_sucios = sesion.campos_sucios | {field_name}
+    
+    # La próxima búsqueda de la palabra ya muestra el valor regenerado
+    palabra = sesion.borrador.Palabra
+    en_cache = cache_palabras.obtener(palabra)
+    if en_cache is not None:
+        cache_palabras.guardar(palabra, dict(en_cache, **{field_name: valor}))
+    
+    mostrado = "\n".join(f"• {v}" for v in valor) if isinstance(valor, list) else valor
+    await mensaje.edit_text(f"✅ {etiqueta} regenerado:\n{mostrado}")
+    await edit_card_menu(query, context)
+
 async def handle_edit_text(update, context):
     """Maneja el texto ingresado para editar un campo - VERSIÓN MEJORADA"""
     user_id = update.effective_user.id
@@ -611,8 +1197,9 @@ async def handle_edit_text(update, context):
         await update.message.reply_text("❌ No estás autorizado.")
         return
     
-    field_name = context.user_data.get('editing_field')
-    if not field_name:
+    sesion = sesiones.obtener(user_id)
+    field_name = sesion.campo_editando
+    if not field_name or sesion.borrador is None:
         await update.message.reply_text("❌ Error: No se está editando ningún campo.")
         return
     
@@ -620,12 +1207,12 @@ async def handle_edit_text(update, context):
     if text == "/skip":
         await update.message.reply_text("⏭️ Campo no modificado. Volviendo al menú de edición...")
         # Limpiar el estado de edición
-        context.user_data['state'] = EDITING_CARD
-        context.user_data.pop('editing_field', None)
+        sesion.estado = EDITING_CARD
+        sesion.campo_editando = None
         await edit_card_menu_from_update(update, context)
         return
     
-    datos_anki = context.user_data.get('current_word_data', {})
+    valor_anterior = getattr(sesion.borrador, field_name)
     
     # Procesar el campo según su tipo
     if field_name == 'Significado':
@@ -633,21 +1220,24 @@ async def handle_edit_text(update, context):
         lines = [line.strip() for line in text.split('\n') if line.strip()]
         # Remover viñetas si existen
         cleaned_lines = [line.replace('- ', '').replace('• ', '') for line in lines]
-        datos_anki[field_name] = cleaned_lines
+        sesion.borrador.asignar(field_name, cleaned_lines)
     else:
-        datos_anki[field_name] = text
+        sesion.borrador.asignar(field_name, text)
+    
+    # Marcar el campo como modificado para enviar solo lo necesario a Anki
+    if getattr(sesion.borrador, field_name) != valor_anterior:
+        sesion.campos_sucios = sesion.campos_sucios | {field_name}
     
-    context.user_data['current_word_data'] = datos_anki
     await update.message.reply_text("✅ Campo actualizado correctamente.")
     
     # Limpiar el estado de edición y volver al menú
-    context.user_data['state'] = EDITING_CARD
-    context.user_data.pop('editing_field', None)
+    sesion.estado = EDITING_CARD
+    sesion.campo_editando = None
     await edit_card_menu_from_update(update, context)
 
 async def edit_card_menu_from_update(update, context):
     """Versión de edit_card_menu para ser llamada desde update - VERSIÓN SIMPLIFICADA"""
-    datos_anki = context.user_data.get('current_word_data')
+    datos_anki = datos_del_borrador(sesiones.obtener(update.effective_user.id))
     
     if not datos_anki:
         await update.message.reply_text("❌ Error: No hay datos de la palabra para editar.")
@@ -685,18 +1275,7 @@ async def edit_card_menu_from_update(update, context):
     """
     
     # TECLADO SIMPLIFICADO - Solo campos que van a Anki
-    keyboard = [
-        [InlineKeyboardButton("📝 Palabra", callback_data="edit_field:Palabra")],
-        [InlineKeyboardButton("🔊 Pronunciación", callback_data="edit_field:Pronunciacion")],
-        [InlineKeyboardButton("📖 Significado", callback_data="edit_field:Significado")],
-        [InlineKeyboardButton("💬 Oración común", callback_data="edit_field:Oracion_Comun")],
-        [InlineKeyboardButton("🏥 Oración médica", callback_data="edit_field:Oracion_medica")],
-        [
-            InlineKeyboardButton("✅ Finalizar edición", callback_data="finish_editing"),
-            InlineKeyboardButton("🚪 Salir sin guardar", callback_data="cancel")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = teclado_edicion()
     
     await update.message.reply_text(preview_text, parse_mode='Markdown', reply_markup=reply_markup)
 
@@ -714,42 +1293,304 @@ async def handle_skip_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
     
     # Verificar si estamos en modo edición
-    if context.user_data.get('state') == EDITING_FIELD:
-        field_name = context.user_data.get('editing_field')
+    sesion = sesiones.obtener(user_id)
+    if sesion.estado == EDITING_FIELD:
+        field_name = sesion.campo_editando
         await update.message.reply_text(f"⏭️ Campo '{field_name}' no modificado. Volviendo al menú...")
         
         # Limpiar estado de edición y volver al menú
-        context.user_data['state'] = EDITING_CARD
-        context.user_data.pop('editing_field', None)
+        sesion.estado = EDITING_CARD
+        sesion.campo_editando = None
         await edit_card_menu_from_update(update, context)
     else:
         await update.message.reply_text("ℹ️ El comando /skip solo funciona cuando estás editando un campo.")
     
+async def handle_inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Responde consultas inline (@bot palabra) desde la cache local y el índice de decks"""
+    inline_query = update.inline_query
+    
+    if not is_user_authorized(inline_query.from_user.id):
+        await inline_query.answer([], cache_time=0, is_personal=True)
+        return
+    
+    texto = inline_query.query.strip()
+    if not texto:
+        await inline_query.answer([], cache_time=0, is_personal=True)
+        return
+    
+    resultados = []
+    
+    # Notas que ya existen en Anki
+    for nota in indice_decks.buscar(texto):
+        resultados.append(InlineQueryResultArticle(
+            id=f"n{nota['noteId']}",
+            title=f"✅ {nota['front']}",
+            description=nota['back'][:100],
+            input_message_content=InputTextMessageContent(f"{nota['front']}\n\n{nota['back']}")
+        ))
+    
+    # Palabras ya generadas por la IA (coincidencia por prefijo)
+    for datos in cache_palabras.buscar_prefijo(texto, limite=INLINE_MAX_RESULTS - len(resultados)):
+        palabra = datos.get('Palabra', texto)
+        significado = datos.get('Significado', '')
+        if isinstance(significado, list):
+            significado = ', '.join(significado)
+        resultados.append(InlineQueryResultArticle(
+            id="c" + hashlib.sha1(palabra.encode('utf-8')).hexdigest()[:32],
+            title=f"📚 {palabra} ({datos.get('Pronunciacion', '')})",
+            description=str(significado)[:100],
+            input_message_content=InputTextMessageContent(
+                formatear_json_para_telegram(datos), parse_mode='Markdown'
+            )
+        ))
+    
+    if resultados:
+        await inline_query.answer(
+            resultados[:INLINE_MAX_RESULTS],
+            cache_time=INLINE_CACHE_TIME,
+            is_personal=True
+        )
+        return
+    
+    # Sin resultados locales: ofrecer generar la palabra en el chat privado con el bot
+    parametro = codificar_parametro_start(texto)
+    boton = None
+    if parametro:
+        boton = InlineQueryResultsButton(text=f"🤖 Generar '{texto}'", start_parameter=parametro)
+    await inline_query.answer([], cache_time=0, is_personal=True, button=boton)
+
+async def handle_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Maneja el comando /stats con métricas internas del bot"""
+    user_id = update.effective_user.id
+    
+    if not is_user_authorized(user_id):
+        await update.message.reply_text("❌ No estás autorizado.")
+        return
+    
+    stats_sesiones = sesiones.estadisticas()
+    stats_cuota = planificador_cuota.estadisticas()
+    stats_updates = context.application.update_processor.estadisticas()
+    stats_ia = anki_functions.backend_ia.estadisticas()
+    stats_tareas = gestor_tareas.estadisticas()
+    stats_anki = metadatos_anki.estadisticas()
+    stats_audio = audio_pronunciacion.estadisticas()
+    stats_paginas = paginas_notas.estadisticas()
+    leidos = f"hace {stats_anki['antiguedad']:.0f}s" if stats_anki['antiguedad'] is not None else "sin leer"
+    if stats_audio['motor']:
+        linea_audio = (f"{stats_audio['motor']}, {stats_audio['en_disco']} en disco, {stats_audio['sintetizados']} sintetizados, "
+                       f"{stats_audio['aciertos']} de cache, {stats_audio['subidos']} subidos, "
+                       f"{stats_audio['ya_en_anki']} ya en Anki, {stats_audio['errores']} errores")
+    else:
+        linea_audio = "desactivado"
+    canceladas = ", ".join(f"{motivo} {n}" for motivo, n in stats_tareas['canceladas'].items()) or "0"
+    
+    mensaje = f"""
+📊 Estadísticas del bot
+
+👥 Sesiones activas: {stats_sesiones['sesiones']}
+💾 Memoria de sesiones: {stats_sesiones['bytes'] / 1024:.1f} KB
+⌛ Sesiones expiradas: {stats_sesiones['desalojadas_ttl']}
+🧹 Desalojadas por memoria: {stats_sesiones['desalojadas_memoria']}
+✏️ Escrituras de notas: {METRICAS_EDICION['escrituras']} (omitidas sin cambios: {METRICAS_EDICION['omitidas']})
+📦 Campos enviados/omitidos: {METRICAS_EDICION['campos_enviados']}/{METRICAS_EDICION['campos_omitidos']}
+📉 Bytes enviados: {METRICAS_EDICION['bytes_enviados']} de {METRICAS_EDICION['bytes_completos']}
+📚 Palabras en cache: {len(cache_palabras)}
+🗂️ Palabras indexadas en decks: {len(indice_decks)}
+📄 Notas existentes: {stats_paginas['en_cache']} en cache, {stats_paginas['aciertos']} servidas sin Anki, {stats_paginas['leidas']} leídas, {stats_paginas['limpiadas']} limpiadas
+🗃️ Anki: {stats_anki['decks']} decks, {stats_anki['modelos']} modelos ({leidos}), {stats_anki['alcances']} alcances personalizados
+🔊 Audio: {linea_audio}
+🤖 Llamadas IA hoy: {stats_cuota['interactivas']} interactivas, {stats_cuota['fondo']}/{stats_cuota['cuota_diaria']} en segundo plano
+🧠 Backend IA ({stats_ia['backend']}): {stats_ia['llamadas']} llamadas, {stats_ia['errores']} errores, p50 {stats_ia['p50']:.1f}s, p95 {stats_ia['p95']:.1f}s, tokens {stats_ia['tokens_entrada']} entrada / {stats_ia['tokens_salida']} salida
+🧩 Palabras nuevas: {max(0, METRICAS_FASES['nucleo'] - METRICAS_FASES['extras'])} solo núcleo, {METRICAS_FASES['extras']} completadas con extras
+🛑 Tareas canceladas: {canceladas}; vencidas: {stats_tareas['vencidas']}; {stats_tareas['segundos_abortados']:.0f}s de trabajo abortado, {stats_tareas['llamadas_evitadas']} llamadas evitadas
+📬 Updates en curso: {stats_updates['en_curso']}, en cola: {stats_updates['pendientes']}, descartados: {stats_updates['descartados']}
+    """
+    await update.message.reply_text(mensaje)
+
+async def handle_reenrich_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Maneja /reenrich <start|pause|status> <deck>"""
+    user_id = update.effective_user.id
+    
+    if not is_user_admin(user_id):
+        await update.message.reply_text("❌ No estás autorizado.")
+        return
+    
+    if len(context.args) < 2 or context.args[0] not in ("start", "pause", "status"):
+        await update.message.reply_text(
+            "Uso: /reenrich <start|pause|status> <deck>\n"
+            "Ejemplo: /reenrich start 0 USA::STEP 1"
+        )
+        return
+    
+    accion, deck = context.args[0], " ".join(context.args[1:])
+    if accion == "start" and metadatos_anki.cargado and not metadatos_anki.existe_deck(deck):
+        await update.message.reply_text(f"❌ El deck '{deck}' no existe en Anki.")
+        return
+    if accion == "start" and planificador_cuota.cuota_diaria <= 0:
+        # Sin cuota de fondo el trabajo esperaría para siempre
+        await update.message.reply_text(
+            "❌ El re-enriquecimiento usa la cuota de segundo plano y BACKGROUND_DAILY_QUOTA es 0. "
+            "Configúrala (p. ej. 200) y reinicia el bot."
+        )
+        return
+    if accion == "start":
+        trabajo = gestor_reenriquecimiento.iniciar(deck)
+    elif accion == "pause":
+        trabajo = gestor_reenriquecimiento.pausar(deck)
+    else:
+        trabajo = gestor_reenriquecimiento.trabajo(deck)
+    await update.message.reply_text(trabajo.resumen())
+
+async def handle_profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Maneja /profile [N updates] [Ts] [Xms] | stop: perfila el bot y envía el informe como documento"""
+    user_id = update.effective_user.id
+    
+    if not is_user_admin(user_id):
+        await update.message.reply_text("❌ No estás autorizado.")
+        return
+    
+    chat_id = update.effective_chat.id
+    
+    async def enviar_informe(informe):
+        nombre = f"perfil-{time.strftime('%Y%m%d-%H%M%S')}.txt"
+        await context.bot.send_document(
+            chat_id=chat_id,
+            document=io.BytesIO(informe.encode("utf-8")),
+            filename=nombre,
+            caption=f"📈 Perfil: {perfilador.updates} updates, {perfilador.muestras} muestras"
+        )
+    
+    if context.args == ["stop"]:
+        if perfilador.detener() is None:
+            await update.message.reply_text("ℹ️ No hay ningún perfilado en curso.")
+        return
+    
+    max_updates, segundos, umbral = None, None, PROFILE_LOOP_LAG_MS
+    try:
+        for argumento in context.args:
+            if argumento.endswith("ms"):
+                umbral = float(argumento[:-2])
+            elif argumento.endswith("s"):
+                segundos = float(argumento[:-1])
+            else:
+                max_updates = int(argumento)
+    except ValueError:
+        max_updates = segundos = None
+    if not max_updates and not segundos:
+        await update.message.reply_text(
+            "Uso: /profile <N updates> <T segundos>s [X ms]ms | /profile stop\n"
+            "Ejemplos: /profile 50 · /profile 30s · /profile 100 120s 50ms"
+        )
+        return
+    
+    if not perfilador.iniciar(max_updates, segundos, umbral, al_terminar=enviar_informe):
+        await update.message.reply_text("⏳ Ya hay un perfilado en curso (/profile stop para terminarlo).")
+        return
+    limites = " o ".join(filter(None, (max_updates and f"{max_updates} updates", segundos and f"{segundos:g}s")))
+    await update.message.reply_text(
+        f"📈 Perfilando durante {limites}. Bloqueos del bucle a partir de {umbral:g} ms. "
+        "El informe llegará como documento."
+    )
+
+async def barrer_sesiones_periodicamente():
+    """Desaloja sesiones inactivas aunque no lleguen mensajes"""
+    while True:
+        await asyncio.sleep(60)
+        sesiones.barrer()
+
+def cargar_metadatos_e_indice():
+    """Lee los decks y modelos de Anki y después indexa los decks (fuera del event loop)"""
+    metadatos_anki.refrescar()
+    indice_decks.construir()
+
+async def refrescar_metadatos_periodicamente():
+    """Relee decks y modelos de Anki; si cambiaron los decks, reconstruye el índice"""
+    while True:
+        await asyncio.sleep(ANKI_METADATA_REFRESH)
+        cambios = await asyncio.to_thread(metadatos_anki.refrescar)
+        if "decks" in cambios:
+            await asyncio.to_thread(indice_decks.construir)
+
+async def post_init(application: Application):
+    """Carga los metadatos de Anki y construye el índice de decks en segundo plano al iniciar"""
+    asyncio.get_running_loop().run_in_executor(None, cargar_metadatos_e_indice)
+    application.create_task(refrescar_metadatos_periodicamente())
+    application.create_task(barrer_sesiones_periodicamente())
+    application.create_task(calentar_cache())
+    gestor_reenriquecimiento.reanudar_pendientes()
+
+async def marcar_peticion(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Asocia los registros de log de este Update a su update_id"""
+    asignar_id_peticion(update.update_id)
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja errores"""
-    logger.error(f"Error: {context.error}")
+    logger.error("Error: %s", context.error, exc_info=context.error)
     
     if update and update.effective_message:
         await update.effective_message.reply_text(
             "❌ Ocurrió un error inesperado. Por favor, intenta nuevamente."
         )
 
-def main():
-    """Función principal para ejecutar el bot"""
-    if not TELEGRAM_BOT_TOKEN:
-        raise ValueError("❌ TELEGRAM_BOT_TOKEN no está configurado en las variables de entorno")
-    
-    if not ALLOWED_USER_IDS:
-        raise ValueError("❌ ALLOWED_USER_IDS no está configurado en las variables de entorno")
+# Tabla de despacho de botones: acción -> manejador(query, context, accion)
+BUTTON_HANDLERS = {
+    "cancel": boton_cancelar,
+    "edit_existing": boton_editar_existente,
+    "notes_page": boton_pagina_notas,
+    "create_new": boton_generar_palabra,
+    "create_anyway": boton_generar_palabra,
+    "confirm_create": boton_confirmar_creacion,
+    "more_info": boton_mas_info,
+    "basic_card": boton_tipo_tarjeta,
+    "reversed_card": boton_tipo_tarjeta,
+    "deck": boton_deck,
+    "confirm_create_final": lambda query, context, accion: create_card_final(query, context),
+    "edit_card": lambda query, context, accion: edit_card_menu(query, context),
+    "edit_field": boton_editar_campo,
+    "regen_field": boton_regenerar_campo,
+    "finish_editing": lambda query, context, accion: finish_editing(query, context),
+    "mine_toggle": boton_alternar_candidata,
+    "mine_all": boton_alternar_candidata,
+    "mine_deck": boton_generar_seleccion,
+    "scope_toggle": boton_alternar_alcance,
+    "scope_save": boton_guardar_alcance,
+    "scope_reset": boton_guardar_alcance,
+}
+
+def construir_aplicacion(token, request=None, base_url=None, post_init_callback=post_init):
+    """
+    Crea la aplicación con todos los manejadores registrados.
+    `request` y `base_url` permiten usar un sustituto local de la API de Telegram.
+    """
+    # Updates en paralelo entre usuarios y en orden dentro de cada usuario
+    builder = Application.builder().token(token).concurrent_updates(PlanificadorUpdates(interrumpe=motivo_interrupcion))
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    if base_url is not None:
+        builder = builder.base_url(base_url)
+    if post_init_callback is not None:
+        builder = builder.post_init(post_init_callback)
+    application = builder.build()
+    
+    # En chats privados el id del usuario es el del chat
+    gestor_tareas.al_vencer = lambda user_id: application.bot.send_message(
+        user_id, "⌛ La operación tardó demasiado y se canceló. Intenta nuevamente."
+    )
     
-    # Crear la aplicación
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    # Identificar cada Update en los logs y grabar el tráfico (si RECORD_TRAFFIC=1)
+    # antes que cualquier otro manejador
+    application.add_handler(TypeHandler(Update, marcar_peticion), group=-2)
+    application.add_handler(TypeHandler(Update, registrar_update), group=-1)
     
     # Manejar comandos
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("word", handle_word_command))
     application.add_handler(CommandHandler("skip", handle_skip_command))
+    application.add_handler(CommandHandler("stats", handle_stats_command))
+    application.add_handler(CommandHandler("decks", handle_decks_command))
+    application.add_handler(CommandHandler("reenrich", handle_reenrich_command))
+    application.add_handler(CommandHandler("profile", handle_profile_command))
     
     # Manejar mensajes de texto
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
@@ -757,12 +1598,30 @@ def main():
     # Manejar botones inline
     application.add_handler(CallbackQueryHandler(handle_button))
     
+    # Manejar consultas inline (@bot palabra)
+    application.add_handler(InlineQueryHandler(handle_inline_query))
+    
     # Manejar errores
     application.add_error_handler(error_handler)
     
+    return application
+
+def main():
+    """Función principal para ejecutar el bot"""
+    configurar_logging()
+    
+    if not TELEGRAM_BOT_TOKEN:
+        raise ValueError("❌ TELEGRAM_BOT_TOKEN no está configurado en las variables de entorno")
+    
+    if not ALLOWED_USER_IDS:
+        raise ValueError("❌ ALLOWED_USER_IDS no está configurado en las variables de entorno")
+    
+    # Crear la aplicación
+    application = construir_aplicacion(TELEGRAM_BOT_TOKEN)
+    
     # Iniciar el bot
-    print("🤖 Bot de Telegram iniciado...")
-    print("📚 Conectado a Anki a través de AnkiConnect")
+    logger.info("🤖 Bot de Telegram iniciado...")
+    logger.info("📚 Conectado a Anki a través de AnkiConnect")
     application.run_polling()
 
 if __name__ == "__main__":
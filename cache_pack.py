@@ -0,0 +1,164 @@
+# cache_pack.py
+"""
+Paquete compacto y de solo lectura con la información de palabras generada por la IA.
+
+Formato (little-endian):
+    cabecera   : magic "AKWC", versión (u16), reservado (u16), número de entradas (u32), reservado (u32)
+    índice     : por entrada, ordenado por clave: offset_clave (u64), largo_clave (u32),
+                 offset_datos (u64), largo_datos (u32)
+    claves     : claves UTF-8 concatenadas
+    datos      : JSON de cada entrada comprimido con zlib
+
+El archivo se abre con mmap: solo se leen las páginas de las entradas consultadas,
+por lo que miles de entradas se sirven sin cargarlas en memoria.
+
+Uso:
+    python cache_pack.py export salida.akwc      # cache local (+ paquete actual) -> paquete
+    python cache_pack.py import entrada.akwc     # instala el paquete en WORD_CACHE_PACK
+    python cache_pack.py info archivo.akwc
+"""
+import os
+import sys
+import json
+import mmap
+import zlib
+import struct
+import shutil
+
+MAGIC = b"AKWC"
+VERSION = 1
+CABECERA = struct.Struct("<4sHHII")
+ENTRADA = struct.Struct("<QIQI")
+
+
+def escribir_paquete(ruta, entradas):
+    """
+    Escribe un paquete a partir de un dict {clave_normalizada: datos_json}.
+    La escritura es atómica (archivo temporal + os.replace).
+    """
+    claves = sorted(entradas, key=lambda clave: clave.encode("utf-8"))
+    claves_bytes = [clave.encode("utf-8") for clave in claves]
+    datos_bytes = [
+        zlib.compress(json.dumps(entradas[clave], ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 9)
+        for clave in claves
+    ]
+
+    inicio_claves = CABECERA.size + ENTRADA.size * len(claves)
+    inicio_datos = inicio_claves + sum(len(c) for c in claves_bytes)
+
+    temporal = f"{ruta}.tmp"
+    with open(temporal, "wb") as f:
+        f.write(CABECERA.pack(MAGIC, VERSION, 0, len(claves), 0))
+        offset_clave, offset_datos = inicio_claves, inicio_datos
+        for clave, datos in zip(claves_bytes, datos_bytes):
+            f.write(ENTRADA.pack(offset_clave, len(clave), offset_datos, len(datos)))
+            offset_clave += len(clave)
+            offset_datos += len(datos)
+        for clave in claves_bytes:
+            f.write(clave)
+        for datos in datos_bytes:
+            f.write(datos)
+    os.replace(temporal, ruta)
+    return len(claves)
+
+
+class PaqueteCache:
+    """Lector de paquetes AKWC mapeados en memoria"""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._archivo = open(ruta, "rb")
+        self._mapa = mmap.mmap(self._archivo.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self._total, _ = CABECERA.unpack_from(self._mapa, 0)
+        if magic != MAGIC or version != VERSION:
+            self.cerrar()
+            raise ValueError(f"{ruta} no es un paquete de cache válido")
+
+    def _entrada(self, i):
+        return ENTRADA.unpack_from(self._mapa, CABECERA.size + i * ENTRADA.size)
+
+    def _clave(self, i):
+        offset_clave, largo_clave, _, _ = self._entrada(i)
+        return self._mapa[offset_clave:offset_clave + largo_clave]
+
+    def _datos(self, i):
+        _, _, offset_datos, largo_datos = self._entrada(i)
+        return json.loads(zlib.decompress(self._mapa[offset_datos:offset_datos + largo_datos]))
+
+    def _limite_inferior(self, clave_bytes):
+        bajo, alto = 0, self._total
+        while bajo < alto:
+            medio = (bajo + alto) // 2
+            if self._clave(medio) < clave_bytes:
+                bajo = medio + 1
+            else:
+                alto = medio
+        return bajo
+
+    def obtener(self, clave):
+        """Devuelve los datos de una clave ya normalizada o None (búsqueda binaria)"""
+        clave_bytes = clave.encode("utf-8")
+        i = self._limite_inferior(clave_bytes)
+        if i < self._total and self._clave(i) == clave_bytes:
+            return self._datos(i)
+        return None
+
+    def buscar_prefijo(self, prefijo, limite=5):
+        """Devuelve hasta `limite` entradas (clave, datos) cuya clave empieza por el prefijo"""
+        prefijo_bytes = prefijo.encode("utf-8")
+        resultados = []
+        i = self._limite_inferior(prefijo_bytes)
+        while i < self._total and len(resultados) < limite and self._clave(i).startswith(prefijo_bytes):
+            resultados.append((self._clave(i).decode("utf-8"), self._datos(i)))
+            i += 1
+        return resultados
+
+    def elementos(self):
+        """Itera todas las entradas (clave, datos)"""
+        for i in range(self._total):
+            yield self._clave(i).decode("utf-8"), self._datos(i)
+
+    def __contains__(self, clave):
+        """Solo busca en el índice: no descomprime la entrada"""
+        clave_bytes = clave.encode("utf-8")
+        i = self._limite_inferior(clave_bytes)
+        return i < self._total and self._clave(i) == clave_bytes
+
+    def __len__(self):
+        return self._total
+
+    def cerrar(self):
+        self._mapa.close()
+        self._archivo.close()
+
+
+def main():
+    from word_cache import CachePalabras, WORD_CACHE_PACK
+
+    if len(sys.argv) != 3 or sys.argv[1] not in ("export", "import", "info"):
+        print(__doc__)
+        sys.exit(1)
+
+    comando, ruta = sys.argv[1], sys.argv[2]
+
+    if comando == "export":
+        cache = CachePalabras()
+        total = escribir_paquete(ruta, dict(cache.elementos()))
+        print(f"📦 Exportadas {total} palabras a {ruta} ({os.path.getsize(ruta) / 1024:.1f} KB)")
+
+    elif comando == "import":
+        paquete = PaqueteCache(ruta)
+        total = len(paquete)
+        paquete.cerrar()
+        shutil.copyfile(ruta, f"{WORD_CACHE_PACK}.tmp")
+        os.replace(f"{WORD_CACHE_PACK}.tmp", WORD_CACHE_PACK)
+        print(f"📥 Importadas {total} palabras en {WORD_CACHE_PACK}. Reinicia el bot para usarlas.")
+
+    else:
+        paquete = PaqueteCache(ruta)
+        print(f"📦 {ruta}: {len(paquete)} palabras, {os.path.getsize(ruta) / 1024:.1f} KB")
+        paquete.cerrar()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# callback_registry.py
+import os
+import time
+import secrets
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Union
+
+# Prefijo que distingue los tokens opacos de las acciones estáticas ("cancel", ...)
+PREFIJO_TOKEN = "~"
+
+CALLBACK_REGISTRY_SIZE = int(os.getenv("CALLBACK_REGISTRY_SIZE", "5000"))
+CALLBACK_REGISTRY_TTL = int(os.getenv("CALLBACK_REGISTRY_TTL", str(24 * 3600)))
+
+
+@dataclass(frozen=True, slots=True)
+class AccionBoton:
+    """Acción asociada a un botón inline con su argumento opcional"""
+    nombre: str
+    argumento: Optional[Union[str, int]] = None
+
+
+class RegistroCallbacks:
+    """
+    Registro en servidor de tokens cortos y opacos para callback_data.
+    Evita enviar datos del usuario dentro del botón (límite de 64 bytes, ':' en frases).
+    Desaloja por antigüedad (TTL) y por tamaño (LRU).
+    """
+
+    def __init__(self, capacidad=CALLBACK_REGISTRY_SIZE, ttl=CALLBACK_REGISTRY_TTL):
+        self.capacidad = capacidad
+        self.ttl = ttl
+        self._tokens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def registrar(self, accion: AccionBoton) -> str:
+        """Guarda la acción y devuelve el token que va en callback_data"""
+        token = PREFIJO_TOKEN + secrets.token_urlsafe(8)
+        ahora = time.monotonic()
+        with self._lock:
+            self._tokens[token] = (accion, ahora + self.ttl)
+            self._desalojar(ahora)
+        return token
+
+    def _desalojar(self, ahora):
+        # Los más antiguos están al principio del OrderedDict
+        while self._tokens:
+            token, (_, expira) = next(iter(self._tokens.items()))
+            if expira > ahora and len(self._tokens) <= self.capacidad:
+                break
+            self._tokens.popitem(last=False)
+
+    def resolver(self, data: str) -> Optional[AccionBoton]:
+        """
+        Convierte callback_data en una acción.
+        Devuelve None si el token expiró o no existe.
+        """
+        if not data.startswith(PREFIJO_TOKEN):
+            return AccionBoton(data)
+        with self._lock:
+            entrada = self._tokens.get(data)
+            if entrada is None:
+                return None
+            accion, expira = entrada
+            ahora = time.monotonic()
+            if expira <= ahora:
+                del self._tokens[data]
+                return None
+            # Renovar el TTL mantiene el OrderedDict ordenado por expiración
+            self._tokens[data] = (accion, ahora + self.ttl)
+            self._tokens.move_to_end(data)
+            return accion
+
+    def restaurar(self, token: str, accion: AccionBoton):
+        """Vuelve a registrar un token conocido (reproducción de tráfico grabado)"""
+        with self._lock:
+            self._tokens[token] = (accion, time.monotonic() + self.ttl)
+
+    def __len__(self):
+        return len(self._tokens)
+
+
+registro_callbacks = RegistroCallbacks()
+
+
+def callback_data(nombre: str, argumento=None) -> str:
+    """
+    Devuelve el callback_data para un botón.
+    Las acciones sin argumento usan su nombre directamente; el resto, un token.
+    """
+    if argumento is None:
+        return nombre
+    return registro_callbacks.registrar(AccionBoton(nombre, argumento))
@@ -0,0 +1,157 @@
+# card_schema.py
+"""
+Esquema declarativo de los campos de una tarjeta.
+
+Cada campo indica qué se le pide a la IA, su longitud máxima y su destino:
+- "tarjeta":      se escribe en la nota de Anki (y se ve en la vista previa)
+- "vista_previa": solo se muestra en Telegram antes de crear la tarjeta
+- "ninguno":      no se genera
+
+Los prompts se construyen a partir del esquema, así que no se piden (ni se
+pagan) campos que se van a descartar ni textos más largos de lo que se usa.
+CARD_SCHEMA_PATH puede apuntar a un JSON que modifique campos existentes, p. ej.:
+    {"Etimologia": {"destino": "ninguno"}, "Oracion_Comun": {"max_caracteres": 100}}
+
+Los campos del núcleo (nucleo=True) son los que bastan para decidir si crear la
+tarjeta: se generan primero con un prompt corto y el resto (extras) después,
+solo si hace falta.
+"""
+import os
+import json
+import logging
+from dataclasses import dataclass, replace
+
+logger = logging.getLogger(__name__)
+
+CARD_SCHEMA_PATH = os.getenv("CARD_SCHEMA_PATH", "")
+
+TARJETA, VISTA_PREVIA, NINGUNO = "tarjeta", "vista_previa", "ninguno"
+
+
+@dataclass(frozen=True, slots=True)
+class CampoTarjeta:
+    """Un campo del JSON que genera la IA"""
+    nombre: str
+    instruccion: str
+    max_caracteres: int
+    destino: str = TARJETA
+    # Para campos de tipo lista: número máximo de elementos (max_caracteres es por elemento)
+    max_elementos: int = 0
+    # Se genera en la primera fase (lo que se muestra al buscar la palabra)
+    nucleo: bool = False
+
+    @property
+    def es_lista(self):
+        return self.max_elementos > 0
+
+
+ESQUEMA_POR_DEFECTO = (
+    CampoTarjeta("Palabra", "La palabra pedida", 60, nucleo=True),
+    CampoTarjeta("Significado", "Significados en español. Solo palabra clave o frase corta sin oraciones completas",
+                 40, max_elementos=4, nucleo=True),
+    CampoTarjeta("Pronunciacion", "La pronunciación fonética simplificada en español. No la pronunciación oficial, "
+                 "sino en español, por ejemplo Hello = /jelou/ o Help=/jelp/", 40, nucleo=True),
+    CampoTarjeta("Oracion_Comun", "Una oracion en ingles, de ejemplo en contexto general", 150),
+    CampoTarjeta("Oracion_medica", "Una oracion en ingles, de ejemplo en contexto médico", 150),
+    CampoTarjeta("Gramatica", "El infinitivo y las formas verbales más comunes (si aplica)", 200,
+                 destino=VISTA_PREVIA),
+    CampoTarjeta("Etimologia", "El origen de la palabra en una frase, algo para ayudar a memorizarla", 200,
+                 destino=VISTA_PREVIA),
+)
+
+
+def cargar_esquema(ruta=CARD_SCHEMA_PATH):
+    """Esquema por defecto con las modificaciones del JSON de `ruta` (si existe)"""
+    if not ruta:
+        return ESQUEMA_POR_DEFECTO
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            cambios = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error("No se pudo leer el esquema de tarjeta %s: %s", ruta, e)
+        return ESQUEMA_POR_DEFECTO
+
+    esquema = []
+    for campo in ESQUEMA_POR_DEFECTO:
+        ajustes = cambios.get(campo.nombre, {})
+        if campo.nombre == "Palabra":
+            ajustes = {}
+        if ajustes.get("destino", campo.destino) not in (TARJETA, VISTA_PREVIA, NINGUNO):
+            logger.error("Destino no válido para %s: %s", campo.nombre, ajustes["destino"])
+            ajustes = {}
+        esquema.append(replace(campo, **{
+            clave: valor for clave, valor in ajustes.items()
+            if clave in ("instruccion", "max_caracteres", "destino", "max_elementos", "nucleo")
+        }))
+    return tuple(esquema)
+
+
+esquema_tarjeta = cargar_esquema()
+
+
+def campos_generados(esquema=None):
+    """Campos que se piden a la IA"""
+    return [campo for campo in esquema or esquema_tarjeta if campo.destino != NINGUNO]
+
+
+def campo_por_nombre(nombre, esquema=None):
+    """Definición de un campo del esquema o None"""
+    return next((campo for campo in esquema or esquema_tarjeta if campo.nombre == nombre), None)
+
+
+def campos_nucleo(esquema=None):
+    """Campos de la primera fase"""
+    return [campo for campo in campos_generados(esquema) if campo.nucleo]
+
+
+def campos_extra(esquema=None):
+    """Campos que se generan en la segunda fase"""
+    return [campo for campo in campos_generados(esquema) if not campo.nucleo]
+
+
+def campos_pendientes(datos_json, esquema=None):
+    """Campos generados que aún faltan en los datos (p. ej. extras de una entrada de primera fase)"""
+    return [campo for campo in campos_generados(esquema) if campo.nombre not in datos_json]
+
+
+def en_tarjeta(nombre, esquema=None):
+    """True si el campo se escribe en la nota de Anki"""
+    return any(campo.nombre == nombre and campo.destino == TARJETA for campo in esquema or esquema_tarjeta)
+
+
+def en_vista_previa(nombre, esquema=None):
+    """True si el campo se muestra en Telegram"""
+    return any(campo.nombre == nombre and campo.destino != NINGUNO for campo in esquema or esquema_tarjeta)
+
+
+def describir_campos(esquema=None, campos=None):
+    """Bloque de campos del prompt con sus límites de longitud (por defecto, todos los generados)"""
+    lineas = []
+    for campo in campos if campos is not None else campos_generados(esquema):
+        if campo.es_lista:
+            descripcion = (f"[Lista, máx. {campo.max_elementos} elementos de {campo.max_caracteres} "
+                           f"caracteres]. {campo.instruccion}")
+        else:
+            descripcion = f"(máx. {campo.max_caracteres} caracteres) {campo.instruccion}"
+        lineas.append(f'        "{campo.nombre}": "{descripcion}",')
+    return "\n".join(lineas)
+
+
+def recortar(datos_json, esquema=None):
+    """Aplica los límites del esquema a una respuesta de la IA (por si no los respetó)"""
+    for campo in esquema or esquema_tarjeta:
+        valor = datos_json.get(campo.nombre)
+        if valor is None:
+            continue
+        if campo.destino == NINGUNO and campo.nombre != "Palabra":
+            datos_json.pop(campo.nombre)
+        elif campo.es_lista and isinstance(valor, list):
+            datos_json[campo.nombre] = [_recortar_texto(str(v), campo.max_caracteres)
+                                        for v in valor[:campo.max_elementos]]
+        elif isinstance(valor, str):
+            datos_json[campo.nombre] = _recortar_texto(valor, campo.max_caracteres)
+    return datos_json
+
+
+def _recortar_texto(texto, maximo):
+    return texto if len(texto) <= maximo else texto[:maximo - 1].rstrip() + "…"
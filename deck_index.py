@@ -0,0 +1,89 @@
+# deck_index.py
+import logging
+import threading
+
+from anki_functions import buscar_notas_por_query, consulta_deck, obtener_info_notas, limpiar_html
+from anki_metadata import metadatos_anki
+from word_cache import normalizar_palabra
+
+logger = logging.getLogger(__name__)
+
+# Tamaño de los bloques de notesInfo al construir el índice
+TAMANO_BLOQUE = 500
+
+
+def palabra_desde_front(front):
+    """
+    Extrae la palabra principal del Front de una nota ("word (pron)" -> "word").
+    """
+    texto = limpiar_html(front)
+    if " (" in texto:
+        texto = texto.split(" (", 1)[0]
+    return normalizar_palabra(texto)
+
+
+class IndiceDecks:
+    """
+    Índice en memoria palabra -> notas existentes en los decks de Anki.
+    Permite responder sin consultar AnkiConnect.
+    """
+
+    def __init__(self):
+        self._notas = {}
+        self._lock = threading.Lock()
+        self.construido = False
+
+    def agregar_nota(self, nota, deck=None, textos=None):
+        """
+        Agrega (o reemplaza) una nota de notesInfo en el índice.
+        `textos` es el (anverso, reverso) ya limpio, si se tiene, para no limpiarlo otra vez.
+        """
+        campos = nota.get('fields', {})
+        if 'Front' not in campos or 'Back' not in campos:
+            return
+        front = campos['Front']['value']
+        anverso, reverso = textos or (limpiar_html(front), limpiar_html(campos['Back']['value']))
+        entrada = {
+            'noteId': nota['noteId'],
+            'deck': deck,
+            'front': anverso,
+            'back': reverso
+        }
+        clave = palabra_desde_front(front)
+        with self._lock:
+            notas = [n for n in self._notas.get(clave, []) if n['noteId'] != entrada['noteId']]
+            notas.append(entrada)
+            self._notas[clave] = notas
+
+    def buscar(self, palabra):
+        """Devuelve las notas indexadas para una palabra exacta"""
+        return list(self._notas.get(normalizar_palabra(palabra), []))
+
+    def contiene(self, palabra):
+        return normalizar_palabra(palabra) in self._notas
+
+    def construir(self, decks=None):
+        """
+        Recorre los decks completos vía AnkiConnect y reconstruye el índice.
+        Sin `decks`, indexa el alcance por defecto (ver anki_metadata.py).
+        Pensado para ejecutarse fuera del event loop.
+        """
+        nuevo = IndiceDecks()
+        decks = decks or metadatos_anki.alcance_por_defecto()
+        # Los subdecks ya entran en la búsqueda de su deck padre
+        decks = [deck for deck in decks if not any(deck.startswith(f"{otro}::") for otro in decks)]
+        for deck in decks:
+            note_ids = buscar_notas_por_query(consulta_deck(deck))
+            for inicio in range(0, len(note_ids), TAMANO_BLOQUE):
+                for nota in obtener_info_notas(note_ids[inicio:inicio + TAMANO_BLOQUE]):
+                    nuevo.agregar_nota(nota, deck)
+        with self._lock:
+            self._notas = nuevo._notas
+            self.construido = True
+        logger.info("Índice de decks construido: %d palabras", len(self._notas))
+
+    def __len__(self):
+        return len(self._notas)
+
+
+indice_decks = IndiceDecks()
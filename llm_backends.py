@@ -0,0 +1,347 @@
+# llm_backends.py
+"""
+Backends de IA intercambiables para generar la información de las palabras.
+
+Todos comparten la misma interfaz (BackendIA):
+- generar(prompt) -> texto                 (síncrono)
+- generar_async(prompt) -> texto           (asíncrono)
+- generar_stream(prompt) -> trozos de texto (streaming)
+- generar_lote(prompts) -> [texto o None]  (varios prompts en paralelo)
+y llevan sus propias métricas de latencia y errores.
+
+Implementaciones:
+- BackendGemini: google.generativeai (se importa solo si se usa)
+- BackendOpenAI: servidor local compatible con la API de OpenAI (/v1/chat/completions),
+  con un pool de conexiones HTTP reutilizables
+- BackendFalso: local y determinista, con latencia e inyección de errores
+  configurables, para pruebas de carga y trabajo sin conexión
+
+LLM_BACKEND elige el backend: gemini (por defecto), openai o falso.
+"""
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+from recorder import cronometrar
+from task_manager import OperacionCancelada, comprobar_cancelacion, esperar_cancelable
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+LLM_MODEL = os.getenv("LLM_MODEL", "")
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "http://localhost:8080/v1")
+LLM_API_KEY = os.getenv("LLM_API_KEY", "")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+# Conexiones HTTP reutilizables y prompts simultáneos en generar_lote
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "4"))
+LLM_FAKE_LATENCY = float(os.getenv("LLM_FAKE_LATENCY", "0"))
+LLM_FAKE_ERROR_RATE = float(os.getenv("LLM_FAKE_ERROR_RATE", "0"))
+
+# Latencias recientes que se guardan por backend para los percentiles
+MUESTRAS_LATENCIA = 1000
+
+
+class ErrorBackend(Exception):
+    """Fallo de un backend de IA (red, cuota, respuesta inválida o error inyectado)"""
+
+
+def estimar_tokens(texto):
+    """Estimación aproximada (~4 caracteres por token) cuando el backend no informa del uso"""
+    return max(1, len(texto) // 4)
+
+
+class BackendIA:
+    """Interfaz común y métricas; las subclases implementan _generar (y opcionalmente _stream)"""
+
+    nombre = "base"
+
+    def __init__(self):
+        self.llamadas = 0
+        self.errores = 0
+        self.tokens_entrada = 0
+        self.tokens_salida = 0
+        self._latencias = deque(maxlen=MUESTRAS_LATENCIA)
+        self._lock = threading.Lock()
+
+    def _generar(self, prompt):
+        raise NotImplementedError
+
+    def _stream(self, prompt):
+        yield self._generar(prompt)
+
+    def _sumar_tokens(self, entrada, salida):
+        with self._lock:
+            self.tokens_entrada += entrada or 0
+            self.tokens_salida += salida or 0
+
+    def _registrar(self, inicio, error):
+        with self._lock:
+            self.llamadas += 1
+            self.errores += error
+            self._latencias.append(time.perf_counter() - inicio)
+
+    def generar(self, prompt):
+        """Devuelve el texto generado para el prompt"""
+        comprobar_cancelacion()
+        inicio, error = time.perf_counter(), True
+        try:
+            with cronometrar("ia", "generate_content"):
+                texto = self._generar(prompt)
+            error = False
+            return texto
+        finally:
+            self._registrar(inicio, error)
+
+    async def generar_async(self, prompt):
+        """Versión asíncrona de generar (por defecto, en un hilo)"""
+        return await asyncio.to_thread(self.generar, prompt)
+
+    def generar_stream(self, prompt):
+        """Genera el texto por trozos a medida que llegan (se detiene si la tarea se cancela)"""
+        comprobar_cancelacion()
+        inicio, error = time.perf_counter(), True
+        try:
+            with cronometrar("ia", "generate_content_stream"):
+                for trozo in self._stream(prompt):
+                    comprobar_cancelacion()
+                    yield trozo
+            error = False
+        finally:
+            self._registrar(inicio, error)
+
+    def generar_lote(self, prompts):
+        """Genera varios prompts en paralelo; None en los que fallan"""
+        def generar_o_none(prompt):
+            try:
+                return self.generar(prompt)
+            except OperacionCancelada:
+                return None
+            except Exception as e:
+                logger.error("Error del backend %s: %s", self.nombre, e)
+                return None
+
+        # Los hilos del pool no heredan el contexto (ni la cancelación de la tarea): se copia
+        contexto = contextvars.copy_context()
+        with ThreadPoolExecutor(max_workers=max(1, min(LLM_POOL_SIZE, len(prompts)))) as ejecutor:
+            return list(ejecutor.map(lambda prompt: contexto.copy().run(generar_o_none, prompt), prompts))
+
+    def estadisticas(self):
+        with self._lock:
+            latencias = sorted(self._latencias)
+        def percentil(p):
+            return latencias[min(len(latencias) - 1, int(len(latencias) * p))] if latencias else 0.0
+        return {
+            "backend": self.nombre,
+            "llamadas": self.llamadas,
+            "errores": self.errores,
+            "tokens_entrada": self.tokens_entrada,
+            "tokens_salida": self.tokens_salida,
+            "p50": percentil(0.5),
+            "p95": percentil(0.95),
+        }
+
+
+class BackendGemini(BackendIA):
+    """Gemini a través de google.generativeai"""
+
+    nombre = "gemini"
+
+    def __init__(self, modelo=None, api_key=None):
+        super().__init__()
+        api_key = api_key or os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            raise ValueError("Error: La clave de API no está configurada. Asegúrate de crear un archivo .env con GOOGLE_API_KEY.")
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        self.modelo = genai.GenerativeModel(modelo or LLM_MODEL or 'gemini-2.5-flash')
+
+    def _contar_uso(self, respuesta):
+        uso = getattr(respuesta, "usage_metadata", None)
+        if uso is not None:
+            self._sumar_tokens(uso.prompt_token_count, uso.candidates_token_count)
+
+    def _generar(self, prompt):
+        respuesta = self.modelo.generate_content(prompt)
+        self._contar_uso(respuesta)
+        return respuesta.text
+
+    def _stream(self, prompt):
+        for trozo in self.modelo.generate_content(prompt, stream=True):
+            if trozo.text:
+                yield trozo.text
+
+    async def generar_async(self, prompt):
+        inicio, error = time.perf_counter(), True
+        try:
+            with cronometrar("ia", "generate_content"):
+                respuesta = await self.modelo.generate_content_async(prompt)
+            self._contar_uso(respuesta)
+            error = False
+            return respuesta.text
+        finally:
+            self._registrar(inicio, error)
+
+
+class BackendOpenAI(BackendIA):
+    """Servidor compatible con la API de OpenAI (llama.cpp, vLLM, Ollama, LM Studio...)"""
+
+    nombre = "openai"
+
+    def __init__(self, url=LLM_BASE_URL, modelo=None, api_key=LLM_API_KEY, tamano_pool=LLM_POOL_SIZE):
+        super().__init__()
+        self.url = url.rstrip("/") + "/chat/completions"
+        self.modelo = modelo or LLM_MODEL or "local"
+        self.sesion = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=tamano_pool)
+        self.sesion.mount("http://", adaptador)
+        self.sesion.mount("https://", adaptador)
+        if api_key:
+            self.sesion.headers["Authorization"] = f"Bearer {api_key}"
+
+    def _peticion(self, prompt, stream):
+        try:
+            respuesta = self.sesion.post(self.url, json={
+                "model": self.modelo,
+                "messages": [{"role": "user", "content": prompt}],
+                "stream": stream,
+            }, timeout=LLM_TIMEOUT, stream=stream)
+            respuesta.raise_for_status()
+            return respuesta
+        except requests.exceptions.RequestException as e:
+            raise ErrorBackend(f"Error de conexión con {self.url}: {e}") from e
+
+    def _generar(self, prompt):
+        datos = self._peticion(prompt, stream=False).json()
+        uso = datos.get("usage") if isinstance(datos, dict) else None
+        if uso:
+            self._sumar_tokens(uso.get("prompt_tokens"), uso.get("completion_tokens"))
+        try:
+            return datos["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError) as e:
+            raise ErrorBackend(f"Respuesta inesperada: {datos}") from e
+
+    def _stream(self, prompt):
+        with self._peticion(prompt, stream=True) as respuesta:
+            for linea in respuesta.iter_lines(decode_unicode=True):
+                if not linea or not linea.startswith("data:"):
+                    continue
+                contenido = linea[5:].strip()
+                if contenido == "[DONE]":
+                    break
+                trozo = json.loads(contenido)["choices"][0].get("delta", {}).get("content")
+                if trozo:
+                    yield trozo
+
+
+class BackendFalso(BackendIA):
+    """
+    Backend local y determinista: la misma palabra produce siempre la misma respuesta.
+    `latencia` son segundos por llamada, o una función que los devuelve.
+    `tasa_error` es la fracción de llamadas que fallan con ErrorBackend.
+    """
+
+    nombre = "falso"
+
+    def __init__(self, latencia=LLM_FAKE_LATENCY, tasa_error=LLM_FAKE_ERROR_RATE, semilla=0):
+        super().__init__()
+        self.latencia = latencia
+        self.tasa_error = tasa_error
+        self._aleatorio = random.Random(semilla)
+
+    def _espera(self):
+        return self.latencia() if callable(self.latencia) else self.latencia
+
+    def _fallar(self):
+        with self._lock:
+            return self._aleatorio.random() < self.tasa_error
+
+    @staticmethod
+    def datos_palabra(palabra):
+        """Información ficticia pero estable para una palabra"""
+        huella = hashlib.sha1(palabra.lower().encode("utf-8")).hexdigest()
+        return {
+            "Palabra": palabra,
+            "Significado": [f"significado {huella[:4]} de {palabra}", f"acepción {huella[4:8]}"],
+            "Pronunciacion": f"/{palabra.lower()}/",
+            "Gramatica": f"{palabra} (sustantivo)",
+            "Etimologia": f"Del término {huella[8:12]}",
+            "Oracion_Comun": f"This is a sentence with {palabra}.",
+            "Oracion_medica": f"The patient reported {palabra}.",
+        }
+
+    def respuesta(self, prompt):
+        """Texto JSON que respondería un modelo real al prompt"""
+        # Las palabras pedidas van entre comillas en la primera línea del prompt
+        palabras = re.findall(r'"([^"]+)"', prompt.strip().split("\n", 1)[0]) or ["word"]
+        # Regeneración de un solo campo: texto plano
+        campo = re.search(r"^Campo: (\w+)$", prompt, re.MULTILINE)
+        if campo:
+            valor = self.datos_palabra(palabras[0]).get(campo.group(1), "")
+            return "\n".join(valor) if isinstance(valor, list) else valor
+        if len(palabras) > 1 or "lista JSON" in prompt:
+            return json.dumps([self.datos_palabra(p) for p in palabras], ensure_ascii=False)
+        return json.dumps(self.datos_palabra(palabras[0]), ensure_ascii=False)
+
+    def _generar(self, prompt):
+        espera = self._espera()
+        if espera:
+            esperar_cancelable(espera)
+        if self._fallar():
+            raise ErrorBackend("Error inyectado por el backend falso")
+        texto = self.respuesta(prompt)
+        self._sumar_tokens(estimar_tokens(prompt), estimar_tokens(texto))
+        return texto
+
+    def _stream(self, prompt):
+        texto = self._generar(prompt)
+        for inicio in range(0, len(texto), 40):
+            yield texto[inicio:inicio + 40]
+
+    async def generar_async(self, prompt):
+        inicio, error = time.perf_counter(), True
+        try:
+            with cronometrar("ia", "generate_content"):
+                espera = self._espera()
+                if espera:
+                    await asyncio.sleep(espera)
+                if self._fallar():
+                    raise ErrorBackend("Error inyectado por el backend falso")
+                texto = self.respuesta(prompt)
+            self._sumar_tokens(estimar_tokens(prompt), estimar_tokens(texto))
+            error = False
+            return texto
+        finally:
+            self._registrar(inicio, error)
+
+
+BACKENDS = {
+    "gemini": BackendGemini,
+    "openai": BackendOpenAI,
+    "falso": BackendFalso,
+    "fake": BackendFalso,
+}
+
+
+def crear_backend(nombre=LLM_BACKEND):
+    """Crea el backend configurado por nombre"""
+    try:
+        clase = BACKENDS[nombre.lower()]
+    except KeyError:
+        raise ValueError(f"LLM_BACKEND desconocido: {nombre} (opciones: {', '.join(BACKENDS)})")
+    logger.info("Backend de IA: %s", clase.nombre)
+    return clase()
@@ -0,0 +1,102 @@
+# log_config.py
+"""
+Configuración de logging estructurado y no bloqueante.
+
+- Los registros se encolan (QueueHandler) y un hilo aparte (QueueListener)
+  los formatea y escribe, de modo que el event loop nunca hace E/S de logs.
+- LOG_LEVEL fija el nivel general y LOG_LEVELS los niveles por módulo,
+  por ejemplo: LOG_LEVELS="anki_functions=DEBUG,httpx=WARNING".
+- LOG_DEBUG_SAMPLE (0..1) conserva solo una fracción de las peticiones con
+  registros DEBUG; todos los registros de una misma petición se conservan juntos.
+- Cada registro lleva el request_id del Update que lo originó.
+- LOG_FORMAT=json escribe un objeto JSON por línea; "texto" el formato clásico.
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import zlib
+import logging
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.getenv("LOG_LEVELS", "httpx=WARNING")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "texto")
+LOG_FILE = os.getenv("LOG_FILE", "")
+LOG_DEBUG_SAMPLE = float(os.getenv("LOG_DEBUG_SAMPLE", "1.0"))
+
+_id_peticion = contextvars.ContextVar("id_peticion", default="-")
+_listener = None
+
+
+def asignar_id_peticion(request_id):
+    """Asocia los registros del contexto actual a una petición"""
+    _id_peticion.set(str(request_id))
+
+
+class FiltroPeticion(logging.Filter):
+    """Añade el request_id y muestrea los registros DEBUG por petición"""
+
+    def __init__(self, muestreo=LOG_DEBUG_SAMPLE):
+        super().__init__()
+        self.umbral = int(max(0.0, min(1.0, muestreo)) * 1000)
+
+    def filter(self, record):
+        record.request_id = _id_peticion.get()
+        if record.levelno <= logging.DEBUG and self.umbral < 1000:
+            return zlib.crc32(record.request_id.encode("utf-8")) % 1000 < self.umbral
+        return True
+
+
+class FormatoJSON(logging.Formatter):
+    """Un objeto JSON por línea"""
+
+    def format(self, record):
+        registro = {
+            "t": self.formatTime(record),
+            "nivel": record.levelname,
+            "modulo": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "mensaje": record.getMessage(),
+        }
+        if record.exc_info:
+            registro["excepcion"] = self.formatException(record.exc_info)
+        return json.dumps(registro, ensure_ascii=False)
+
+
+def configurar_logging():
+    """Instala el pipeline de logging; se puede llamar varias veces"""
+    global _listener
+    if _listener is not None:
+        return
+
+    if LOG_FORMAT == "json":
+        formato = FormatoJSON()
+    else:
+        formato = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s')
+
+    destinos = [logging.StreamHandler(sys.stdout)]
+    if LOG_FILE:
+        destinos.append(logging.FileHandler(LOG_FILE, encoding="utf-8"))
+    for destino in destinos:
+        destino.setFormatter(formato)
+
+    cola = queue.SimpleQueue()
+    manejador_cola = QueueHandler(cola)
+    manejador_cola.addFilter(FiltroPeticion())
+
+    raiz = logging.getLogger()
+    for manejador in list(raiz.handlers):
+        raiz.removeHandler(manejador)
+    raiz.addHandler(manejador_cola)
+    raiz.setLevel(LOG_LEVEL.upper())
+
+    for par in [p.strip() for p in LOG_LEVELS.split(",") if "=" in p]:
+        modulo, nivel = par.split("=", 1)
+        logging.getLogger(modulo.strip()).setLevel(nivel.strip().upper())
+
+    _listener = QueueListener(cola, *destinos, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
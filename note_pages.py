@@ -0,0 +1,183 @@
+# note_pages.py
+"""
+Vista paginada de las notas que ya existen para una palabra.
+
+Una palabra común puede coincidir con decenas de notas: en lugar de pedirlas todas
+con notesInfo y mandarlas en un solo mensaje (que puede pasar del límite de 4096
+caracteres de Telegram), solo se piden y se muestran las de la página actual.
+Mientras el usuario la lee, la página siguiente se precarga en segundo plano.
+
+El texto limpio (sin HTML) de cada nota se guarda en una cache LRU por noteId junto
+con su `mod`: durante EXISTING_NOTES_FRESH segundos se reutiliza sin consultar a Anki
+y, pasado ese tiempo, se vuelve a pedir la nota pero no se vuelve a limpiar si no cambió.
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+
+from anki_functions import obtener_info_notas, limpiar_html
+from deck_index import indice_decks
+
+logger = logging.getLogger(__name__)
+
+EXISTING_NOTES_PAGE_SIZE = int(os.getenv("EXISTING_NOTES_PAGE_SIZE", "5"))
+# Notas cuyo texto limpio se guarda en memoria
+EXISTING_NOTES_CACHE = int(os.getenv("EXISTING_NOTES_CACHE", "2000"))
+# Segundos que una nota leída o precargada se muestra sin volver a pedirla a Anki
+EXISTING_NOTES_FRESH = float(os.getenv("EXISTING_NOTES_FRESH", "120"))
+
+# Límite de Telegram por mensaje y margen para la cabecera de la página
+MAX_MENSAJE_TELEGRAM = 4096
+MARGEN_CABECERA = 400
+
+
+def recortar_texto(texto, maximo):
+    """Recorta un texto a `maximo` caracteres terminando en '…'"""
+    return texto if len(texto) <= maximo else texto[:max(0, maximo - 1)].rstrip() + "…"
+
+
+class PaginasNotas:
+    """Cache del texto limpio de las notas, lectura por páginas y precarga de la siguiente"""
+
+    def __init__(self, por_pagina=EXISTING_NOTES_PAGE_SIZE, capacidad=EXISTING_NOTES_CACHE,
+                 frescura=EXISTING_NOTES_FRESH):
+        self.por_pagina = max(1, por_pagina)
+        self.capacidad = capacidad
+        self.frescura = frescura
+        # noteId -> (leída en, mod, anverso, reverso)
+        self._textos = OrderedDict()
+        self._precargas = {}
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.leidas = 0
+        self.limpiadas = 0
+
+    def paginas(self, note_ids):
+        return max(1, -(-len(note_ids) // self.por_pagina))
+
+    def ids_pagina(self, note_ids, pagina):
+        inicio = pagina * self.por_pagina
+        return list(note_ids[inicio:inicio + self.por_pagina])
+
+    # --- Cache ---------------------------------------------------------------
+
+    def _frescas(self, note_ids, contar=True):
+        """Textos de las notas leídas hace menos de `frescura` segundos"""
+        ahora = time.monotonic()
+        with self._lock:
+            frescas = {}
+            for note_id in note_ids:
+                entrada = self._textos.get(note_id)
+                if entrada is not None and ahora - entrada[0] < self.frescura:
+                    self._textos.move_to_end(note_id)
+                    frescas[note_id] = entrada[2:]
+            if contar:
+                self.aciertos += len(frescas)
+            return frescas
+
+    def _leer(self, note_ids):
+        """Pide las notas a Anki (bloqueante) y devuelve sus textos limpios"""
+        notas = obtener_info_notas(note_ids)
+        ahora = time.monotonic()
+        textos = {}
+        for nota in notas:
+            campos = nota.get('fields', {}) if nota else {}
+            if 'Front' not in campos or 'Back' not in campos:
+                continue
+            with self._lock:
+                anterior = self._textos.get(nota['noteId'])
+            limpiar = anterior is None or anterior[1] != nota.get('mod')
+            if limpiar:
+                anverso = limpiar_html(campos['Front']['value'])
+                reverso = limpiar_html(campos['Back']['value'])
+            else:
+                anverso, reverso = anterior[2:]
+            indice_decks.agregar_nota(nota, textos=(anverso, reverso))
+            textos[nota['noteId']] = (anverso, reverso)
+            with self._lock:
+                self._textos[nota['noteId']] = (ahora, nota.get('mod'), anverso, reverso)
+                self._textos.move_to_end(nota['noteId'])
+                while len(self._textos) > self.capacidad:
+                    self._textos.popitem(last=False)
+                self.limpiadas += limpiar
+        with self._lock:
+            self.leidas += len(notas)
+        return textos
+
+    async def textos(self, note_ids):
+        """Textos (anverso, reverso) de las notas, en orden; pide a Anki solo las que faltan"""
+        clave = tuple(note_ids)
+        precarga = self._precargas.get(clave)
+        if precarga is not None:
+            # Espera la precarga en curso de esta página (sin cancelarla ni propagar su error)
+            await asyncio.wait({precarga})
+        textos = self._frescas(note_ids)
+        faltan = [note_id for note_id in note_ids if note_id not in textos]
+        if faltan:
+            textos.update(await asyncio.to_thread(self._leer, faltan))
+        return [(note_id, *textos[note_id]) for note_id in note_ids if note_id in textos]
+
+    def precargar(self, note_ids):
+        """Lee en segundo plano las notas de la página siguiente que no estén en la cache"""
+        clave = tuple(note_ids)
+        if not clave or clave in self._precargas:
+            return
+        frescas = self._frescas(note_ids, contar=False)
+        faltan = [note_id for note_id in note_ids if note_id not in frescas]
+        if not faltan:
+            return
+
+        def terminar(tarea):
+            self._precargas.pop(clave, None)
+            if not tarea.cancelled() and tarea.exception() is not None:
+                logger.warning("No se pudo precargar la página de notas: %s", tarea.exception())
+
+        tarea = asyncio.create_task(asyncio.to_thread(self._leer, faltan))
+        self._precargas[clave] = tarea
+        tarea.add_done_callback(terminar)
+
+    def olvidar(self, note_ids):
+        """Descarta el texto guardado de notas que el bot acaba de modificar"""
+        with self._lock:
+            for note_id in note_ids:
+                self._textos.pop(note_id, None)
+
+    # --- Mensaje -------------------------------------------------------------
+
+    async def pagina(self, note_ids, pagina):
+        """
+        Texto de la página `pagina` (desde 0) y precarga de la siguiente.
+        Cada nota se recorta para que la página quepa en un mensaje de Telegram.
+        Devuelve (mensaje, pagina, [(número, noteId)] de las notas mostradas).
+        """
+        pagina = min(max(0, pagina), self.paginas(note_ids) - 1)
+        textos = await self.textos(self.ids_pagina(note_ids, pagina))
+        if pagina + 1 < self.paginas(note_ids):
+            self.precargar(self.ids_pagina(note_ids, pagina + 1))
+
+        maximo = (MAX_MENSAJE_TELEGRAM - MARGEN_CABECERA) // self.por_pagina - 40
+        mensaje = ""
+        mostradas = []
+        for numero, (note_id, anverso, reverso) in enumerate(textos, pagina * self.por_pagina + 1):
+            mostradas.append((numero, note_id))
+            anverso = recortar_texto(anverso, maximo // 3)
+            reverso = recortar_texto(reverso, maximo - len(anverso))
+            mensaje += f"*Tarjeta #{numero}:*\n"
+            mensaje += f"*ID:* `{note_id}`\n"
+            mensaje += f"*Anverso:* {anverso}\n"
+            mensaje += f"*Reverso:* {reverso}\n\n"
+        return mensaje or "No se encontraron notas.", pagina, mostradas
+
+    def estadisticas(self):
+        return {
+            "en_cache": len(self._textos),
+            "aciertos": self.aciertos,
+            "leidas": self.leidas,
+            "limpiadas": self.limpiadas,
+        }
+
+
+paginas_notas = PaginasNotas()
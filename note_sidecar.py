@@ -0,0 +1,62 @@
+# note_sidecar.py
+import os
+import json
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+NOTE_SIDECAR_PATH = os.getenv("NOTE_SIDECAR_PATH", "note_sidecar.db")
+
+
+class AlmacenNotas:
+    """
+    Almacén local (SQLite) con el JSON completo generado para cada nota de Anki,
+    indexado por noteId. Permite recuperar el borrador editable de una nota
+    sin reinterpretar su HTML y sin perder Gramatica ni Etimologia.
+    """
+
+    def __init__(self, ruta=NOTE_SIDECAR_PATH):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False)
+        self._conexion.execute(
+            "CREATE TABLE IF NOT EXISTS notas ("
+            " note_id INTEGER PRIMARY KEY,"
+            " datos TEXT NOT NULL)"
+        )
+        self._conexion.commit()
+
+    def guardar(self, note_id, datos_json):
+        """Guarda (o reemplaza) el JSON de una nota"""
+        if note_id is None or not datos_json:
+            return
+        try:
+            with self._lock:
+                self._conexion.execute(
+                    "INSERT OR REPLACE INTO notas (note_id, datos) VALUES (?, ?)",
+                    (int(note_id), json.dumps(datos_json, ensure_ascii=False))
+                )
+                self._conexion.commit()
+        except sqlite3.Error as e:
+            logger.error("No se pudo guardar el sidecar de la nota %s: %s", note_id, e)
+
+    def obtener(self, note_id):
+        """Devuelve el JSON guardado de una nota o None"""
+        try:
+            with self._lock:
+                fila = self._conexion.execute(
+                    "SELECT datos FROM notas WHERE note_id = ?", (int(note_id),)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.error("No se pudo leer el sidecar de la nota %s: %s", note_id, e)
+            return None
+        return json.loads(fila[0]) if fila else None
+
+    def __len__(self):
+        with self._lock:
+            return self._conexion.execute("SELECT COUNT(*) FROM notas").fetchone()[0]
+
+
+almacen_notas = AlmacenNotas()
@@ -0,0 +1,249 @@
+# profiler.py
+"""
+Perfilado bajo demanda del bot en producción (/profile).
+
+Mientras está activo, durante los próximos N Updates o T segundos:
+- un hilo muestrea las pilas de todos los hilos (sys._current_frames) cada
+  PROFILE_SAMPLE_MS y cuenta el tiempo propio y acumulado de cada función;
+- tracemalloc compara la memoria asignada al principio y al final;
+- un latido en el bucle de eventos mide su retraso y, si se queda bloqueado más de
+  PROFILE_LOOP_LAG_MS, el hilo de muestreo captura la pila del bucle en ese momento
+  (el código síncrono que lo bloquea, p. ej. una llamada HTTP dentro de un handler).
+
+Al terminar genera un informe de texto. Desactivado no crea hilos ni tareas ni
+activa tracemalloc: el único coste es comprobar `perfilador.activo` por Update.
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Intervalo de muestreo de las pilas (milisegundos)
+PROFILE_SAMPLE_MS = float(os.getenv("PROFILE_SAMPLE_MS", "5"))
+# Retraso del bucle de eventos a partir del cual se considera bloqueado (milisegundos)
+PROFILE_LOOP_LAG_MS = float(os.getenv("PROFILE_LOOP_LAG_MS", "100"))
+# Duración máxima de un perfilado, aunque no lleguen los Updates pedidos (segundos)
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "600"))
+
+# Intervalo del latido que mide el retraso del bucle (segundos)
+INTERVALO_LATIDO = 0.02
+# Filas de cada sección del informe
+FILAS_INFORME = 25
+
+DIRECTORIO_PROYECTO = os.path.dirname(os.path.abspath(__file__))
+
+# Funciones en las que un hilo está esperando, no trabajando
+_FUNCIONES_INACTIVAS = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+# Lecturas de red: el hilo espera al servidor (Gemini, AnkiConnect, Telegram), no gasta
+# CPU. Solo se descartan del muestreo de CPU; en el hilo del bucle sí son un bloqueo.
+_ESPERAS_RED = {
+    ("socket.py", "readinto"),
+    ("socket.py", "recv"),
+    ("socket.py", "recv_into"),
+    ("socket.py", "create_connection"),
+    ("ssl.py", "read"),
+    ("ssl.py", "recv"),
+    ("ssl.py", "recv_into"),
+    ("ssl.py", "do_handshake"),
+}
+
+
+def _ruta_corta(archivo):
+    """Ruta relativa al proyecto o, fuera de él, solo carpeta/archivo"""
+    if archivo.startswith(DIRECTORIO_PROYECTO):
+        return os.path.relpath(archivo, DIRECTORIO_PROYECTO)
+    return os.path.join(os.path.basename(os.path.dirname(archivo)), os.path.basename(archivo))
+
+
+def _describir(codigo, linea=None):
+    return f"{codigo.co_name} ({_ruta_corta(codigo.co_filename)}:{linea or codigo.co_firstlineno})"
+
+
+def _inactiva(frame, red=True):
+    codigo = frame.f_code
+    funcion = (os.path.basename(codigo.co_filename), codigo.co_name)
+    return funcion in _FUNCIONES_INACTIVAS or (red and funcion in _ESPERAS_RED)
+
+
+class Perfilador:
+    """Sesión de perfilado: muestreo de CPU, diferencia de memoria y retraso del bucle"""
+
+    def __init__(self):
+        self.activo = False
+        self._parar = threading.Event()
+
+    def iniciar(self, max_updates=None, segundos=None, umbral_lag_ms=PROFILE_LOOP_LAG_MS, al_terminar=None):
+        """
+        Empieza a perfilar hasta `max_updates` Updates o `segundos` (lo primero que ocurra).
+        Debe llamarse desde el bucle de eventos. `al_terminar` es una corrutina(informe).
+        Devuelve False si ya había un perfilado en curso.
+        """
+        if self.activo:
+            return False
+        self.activo = True
+        self.max_updates = max_updates
+        self.segundos = min(segundos or PROFILE_MAX_SECONDS, PROFILE_MAX_SECONDS)
+        self.umbral_lag = umbral_lag_ms / 1000
+        self.al_terminar = al_terminar
+        self.updates = 0
+        self.muestras = 0
+        self.propio = Counter()
+        self.acumulado = Counter()
+        self.bloqueos = Counter()
+        self.episodios_bloqueo = Counter()
+        self.retrasos = []
+        self.inicio = time.perf_counter()
+        self.fecha_inicio = datetime.now()
+
+        self._bucle = asyncio.get_running_loop()
+        self._hilo_bucle = threading.get_ident()
+        self._latido = time.perf_counter()
+        self._parar.clear()
+
+        self._tracemalloc_propio = not tracemalloc.is_tracing()
+        if self._tracemalloc_propio:
+            tracemalloc.start()
+        self._memoria_inicio = tracemalloc.take_snapshot()
+
+        self._muestreador = threading.Thread(target=self._muestrear, name="perfilador", daemon=True)
+        self._muestreador.start()
+        self._tarea_latido = self._bucle.create_task(self._medir_latido())
+        self._temporizador = self._bucle.call_later(self.segundos, self.detener)
+        logger.info("Perfilado iniciado: %s updates, %.0fs, umbral de bloqueo %.0f ms",
+                    max_updates or "-", self.segundos, umbral_lag_ms)
+        return True
+
+    def contar_update(self):
+        """Llamado al terminar cada Update mientras el perfilado está activo"""
+        self.updates += 1
+        if self.max_updates and self.updates >= self.max_updates:
+            self._bucle.call_soon(self.detener)
+
+    async def _medir_latido(self):
+        while True:
+            esperado = time.perf_counter() + INTERVALO_LATIDO
+            await asyncio.sleep(INTERVALO_LATIDO)
+            ahora = time.perf_counter()
+            self._latido = ahora
+            self.retrasos.append(max(0.0, ahora - esperado))
+
+    def _muestrear(self):
+        intervalo = PROFILE_SAMPLE_MS / 1000
+        propio_hilo = threading.get_ident()
+        en_bloqueo = False
+        while not self._parar.wait(intervalo):
+            pilas = sys._current_frames()
+            self.muestras += 1
+            for hilo, frame in pilas.items():
+                if hilo == propio_hilo or _inactiva(frame):
+                    continue
+                self.propio[frame.f_code, frame.f_lineno] += 1
+                vistas = set()
+                while frame is not None:
+                    if frame.f_code not in vistas:
+                        vistas.add(frame.f_code)
+                        self.acumulado[frame.f_code] += 1
+                    frame = frame.f_back
+
+            # Bucle sin latido durante más del umbral: capturar qué lo está bloqueando
+            bloqueado = time.perf_counter() - self._latido > self.umbral_lag + INTERVALO_LATIDO
+            frame = pilas.get(self._hilo_bucle)
+            if bloqueado and frame is not None and not _inactiva(frame, red=False):
+                pila = self._pila_bloqueo(frame)
+                self.bloqueos[pila] += 1
+                if not en_bloqueo:
+                    self.episodios_bloqueo[pila] += 1
+            en_bloqueo = bloqueado
+
+    @staticmethod
+    def _pila_bloqueo(frame):
+        """Función más interna del proyecto que bloquea el bucle y la llamada en la que está"""
+        interna = _describir(frame.f_code, frame.f_lineno)
+        while frame is not None and not frame.f_code.co_filename.startswith(DIRECTORIO_PROYECTO):
+            frame = frame.f_back
+        if frame is None:
+            return interna
+        propia = _describir(frame.f_code, frame.f_lineno)
+        return propia if propia == interna else f"{propia} → {interna}"
+
+    def detener(self):
+        """Termina el perfilado, genera el informe y lo entrega a al_terminar"""
+        if not self.activo:
+            return None
+        self.activo = False
+        self._parar.set()
+        self._temporizador.cancel()
+        self._tarea_latido.cancel()
+        self._muestreador.join(timeout=1)
+
+        memoria_fin = tracemalloc.take_snapshot()
+        if self._tracemalloc_propio:
+            tracemalloc.stop()
+        filtros = (tracemalloc.Filter(False, tracemalloc.__file__),
+                   tracemalloc.Filter(False, __file__),
+                   tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                   tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"))
+        diferencias = memoria_fin.filter_traces(filtros).compare_to(
+            self._memoria_inicio.filter_traces(filtros), "lineno"
+        )
+
+        informe = self._informe(diferencias)
+        logger.info("Perfilado terminado: %d updates, %d muestras", self.updates, self.muestras)
+        if self.al_terminar is not None:
+            self._bucle.create_task(self.al_terminar(informe))
+        return informe
+
+    def _informe(self, diferencias):
+        duracion = time.perf_counter() - self.inicio
+        muestras = max(1, self.muestras)
+        lineas = [
+            f"Perfil del bot - {self.fecha_inicio:%Y-%m-%d %H:%M:%S}",
+            f"Duración {duracion:.1f}s, {self.updates} updates, {self.muestras} muestras cada {PROFILE_SAMPLE_MS:g} ms",
+            "",
+            "== Funciones con más tiempo propio (todas las hebras, sin esperas) ==",
+            f"{'muestras':>9} {'%':>6}  función",
+        ]
+        for (codigo, linea), n in self.propio.most_common(FILAS_INFORME):
+            lineas.append(f"{n:>9} {100 * n / muestras:>5.1f}%  {_describir(codigo, linea)}")
+
+        lineas += ["", "== Funciones con más tiempo acumulado (incluye lo que llaman) ==",
+                   f"{'muestras':>9} {'%':>6}  función"]
+        for codigo, n in self.acumulado.most_common(FILAS_INFORME):
+            lineas.append(f"{n:>9} {100 * n / muestras:>5.1f}%  {_describir(codigo)}")
+
+        retrasos = sorted(self.retrasos)
+        def percentil(p):
+            return 1000 * retrasos[min(len(retrasos) - 1, int(len(retrasos) * p))] if retrasos else 0.0
+        lineas += ["", f"== Bucle de eventos bloqueado más de {self.umbral_lag * 1000:.0f} ms ==",
+                   f"Retraso del latido: p50 {percentil(0.5):.1f} ms, p95 {percentil(0.95):.1f} ms, "
+                   f"p99 {percentil(0.99):.1f} ms, máx {percentil(1.0):.1f} ms"]
+        if self.bloqueos:
+            lineas.append(f"{'veces':>6} {'ms':>8}  dónde")
+            for pila, n in self.bloqueos.most_common(FILAS_INFORME):
+                lineas.append(f"{self.episodios_bloqueo[pila]:>6} {n * PROFILE_SAMPLE_MS:>8.0f}  {pila}")
+        else:
+            lineas.append("Sin bloqueos.")
+
+        lineas += ["", "== Memoria asignada durante el perfilado (tracemalloc, por línea) ==",
+                   f"{'KiB':>10} {'bloques':>9}  dónde"]
+        for diferencia in diferencias[:FILAS_INFORME]:
+            traza = diferencia.traceback[0]
+            lineas.append(f"{diferencia.size_diff / 1024:>+10.1f} {diferencia.count_diff:>+9}  "
+                          f"{_ruta_corta(traza.filename)}:{traza.lineno}")
+        return "\n".join(lineas) + "\n"
+
+
+perfilador = Perfilador()
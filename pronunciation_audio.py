@@ -0,0 +1,358 @@
+# pronunciation_audio.py
+"""
+Audio de pronunciación generado con un motor de voz local (TTS), sin conexión.
+
+Los motores son intercambiables (MotorTTS):
+- MotorEspeak: espeak-ng (o espeak) por línea de comandos, salida WAV
+- MotorFalso: un tono corto y determinista por palabra, para pruebas sin espeak
+TTS_ENGINE elige el motor: espeak o falso; vacío (por defecto) desactiva el audio.
+
+Cada audio se guarda en disco por el hash de su contenido (TTS_CACHE_DIR/ab/abcd....wav)
+y un índice de solo añadir relaciona (motor, voz, palabra) con ese hash, así que una
+palabra no se vuelve a sintetizar. En Anki el archivo se llama tts_<hash>.wav: antes
+de subirlo con storeMediaFile se mira si la colección ya lo tiene (getMediaFilesNames),
+de modo que un archivo idéntico se sube una sola vez aunque lo usen miles de notas.
+
+La síntesis corre en un pool de hilos propio (TTS_WORKERS), fuera del event loop;
+dos peticiones de la misma palabra a la vez comparten la misma síntesis.
+"""
+import io
+import os
+import json
+import math
+import time
+import wave
+import shutil
+import asyncio
+import hashlib
+import logging
+import threading
+import subprocess
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from anki_functions import listar_media, guardar_media_lote
+from word_cache import normalizar_palabra
+
+logger = logging.getLogger(__name__)
+
+TTS_ENGINE = os.getenv("TTS_ENGINE", "")
+TTS_VOICE = os.getenv("TTS_VOICE", "en-us")
+# Palabras por minuto
+TTS_SPEED = int(os.getenv("TTS_SPEED", "150"))
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "2"))
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "audio_cache")
+# Segundos que se fía de la lista de audios de la colección antes de volver a pedirla
+TTS_MEDIA_REFRESH = int(os.getenv("TTS_MEDIA_REFRESH", "300"))
+
+# Prefijo de los archivos de audio del bot en la carpeta de multimedia de Anki
+PREFIJO_MEDIA = "tts_"
+# Archivos por llamada multi/storeMediaFile (acota el tamaño de cada petición)
+MEDIA_POR_LLAMADA = 50
+
+
+class ErrorTTS(Exception):
+    """Fallo de un motor de voz (no instalado, proceso fallido o salida vacía)"""
+
+
+class MotorTTS:
+    """Interfaz común; las subclases implementan sintetizar(texto) -> bytes"""
+
+    nombre = "base"
+    extension = "wav"
+
+    def firma(self):
+        """Identifica el motor y sus ajustes: otro ajuste produce otro audio"""
+        return self.nombre
+
+    def sintetizar(self, texto):
+        raise NotImplementedError
+
+
+class MotorEspeak(MotorTTS):
+    """espeak-ng (o espeak) instalado en el sistema"""
+
+    nombre = "espeak"
+
+    def __init__(self, voz=TTS_VOICE, velocidad=TTS_SPEED):
+        self.ejecutable = shutil.which("espeak-ng") or shutil.which("espeak")
+        if self.ejecutable is None:
+            raise ErrorTTS("espeak-ng no está instalado")
+        self.voz = voz
+        self.velocidad = velocidad
+
+    def firma(self):
+        return f"{os.path.basename(self.ejecutable)}:{self.voz}:{self.velocidad}"
+
+    def sintetizar(self, texto):
+        # El texto va por stdin para que una palabra que empieza por '-' no se lea como opción
+        try:
+            proceso = subprocess.run(
+                [self.ejecutable, "-v", self.voz, "-s", str(self.velocidad), "--stdout"],
+                input=texto.encode("utf-8"), capture_output=True, timeout=30, check=True
+            )
+        except (OSError, subprocess.SubprocessError) as e:
+            raise ErrorTTS(f"espeak falló con '{texto}': {e}")
+        if not proceso.stdout:
+            raise ErrorTTS(f"espeak no devolvió audio para '{texto}'")
+        return proceso.stdout
+
+
+class MotorFalso(MotorTTS):
+    """Tono corto cuya frecuencia depende de la palabra: mismo texto, mismos bytes"""
+
+    nombre = "falso"
+    MUESTRAS_POR_SEGUNDO = 8000
+
+    def __init__(self, duracion=0.3):
+        self.duracion = duracion
+
+    def sintetizar(self, texto):
+        huella = int(hashlib.sha1(texto.encode("utf-8")).hexdigest()[:4], 16)
+        frecuencia = 220 + huella % 660
+        muestras = bytes(
+            int(128 + 100 * math.sin(2 * math.pi * frecuencia * i / self.MUESTRAS_POR_SEGUNDO))
+            for i in range(int(self.duracion * self.MUESTRAS_POR_SEGUNDO))
+        )
+        salida = io.BytesIO()
+        with wave.open(salida, "wb") as archivo:
+            archivo.setnchannels(1)
+            archivo.setsampwidth(1)
+            archivo.setframerate(self.MUESTRAS_POR_SEGUNDO)
+            archivo.writeframes(muestras)
+        return salida.getvalue()
+
+
+MOTORES = {
+    "espeak": MotorEspeak,
+    "espeak-ng": MotorEspeak,
+    "falso": MotorFalso,
+    "fake": MotorFalso,
+}
+
+
+def crear_motor(nombre=TTS_ENGINE):
+    """Crea el motor configurado por nombre; None si el audio está desactivado"""
+    if not nombre:
+        return None
+    try:
+        clase = MOTORES[nombre.lower()]
+    except KeyError:
+        raise ValueError(f"TTS_ENGINE desconocido: {nombre} (opciones: {', '.join(MOTORES)})")
+    return clase()
+
+
+class AudioPronunciacion:
+    """Síntesis en un pool, cache en disco por hash de contenido y subida a Anki sin repetir"""
+
+    def __init__(self, motor=None, directorio=TTS_CACHE_DIR, hilos=TTS_WORKERS):
+        self.motor = motor
+        self.directorio = directorio
+        self.hilos = hilos
+        self._indice = {}
+        self._en_coleccion = None
+        self._coleccion_leida = 0.0
+        self._pendientes = {}
+        self._pool = None
+        self._lock = threading.Lock()
+        self.sintetizados = 0
+        self.aciertos = 0
+        self.subidos = 0
+        self.ya_en_anki = 0
+        self.errores = 0
+        if motor is not None:
+            self._cargar_indice()
+
+    @classmethod
+    def desde_entorno(cls):
+        """Instancia con el motor de TTS_ENGINE; sin audio si el motor no está disponible"""
+        try:
+            motor = crear_motor()
+        except (ValueError, ErrorTTS) as e:
+            logger.warning("Audio de pronunciación desactivado: %s", e)
+            motor = None
+        if motor is not None:
+            logger.info("Motor de voz: %s", motor.firma())
+        return cls(motor)
+
+    @property
+    def activo(self):
+        return self.motor is not None
+
+    # --- Cache en disco ------------------------------------------------------
+
+    @property
+    def _ruta_indice(self):
+        return os.path.join(self.directorio, "indice.jsonl")
+
+    def _cargar_indice(self):
+        if not os.path.exists(self._ruta_indice):
+            return
+        try:
+            with open(self._ruta_indice, "r", encoding="utf-8") as f:
+                for linea in f:
+                    try:
+                        entrada = json.loads(linea)
+                        self._indice[entrada["clave"]] = entrada["hash"]
+                    except (ValueError, KeyError):
+                        continue  # línea a medio escribir tras una caída
+            logger.info("Cache de audio cargada: %d palabras", len(self._indice))
+        except OSError as e:
+            logger.error("No se pudo cargar el índice de audio: %s", e)
+
+    def _clave(self, texto):
+        return hashlib.sha1(f"{self.motor.firma()}\x1f{normalizar_palabra(texto)}".encode("utf-8")).hexdigest()
+
+    def ruta(self, huella):
+        """Ruta en disco del audio con ese hash de contenido"""
+        return os.path.join(self.directorio, huella[:2], f"{huella}.{self.motor.extension}")
+
+    def nombre_media(self, huella):
+        """Nombre del archivo en la colección de Anki"""
+        return f"{PREFIJO_MEDIA}{huella}.{self.motor.extension}"
+
+    def ruta_media(self, nombre):
+        """Ruta en disco de un archivo de la colección (tts_<hash>.wav)"""
+        return self.ruta(nombre[len(PREFIJO_MEDIA):].rsplit(".", 1)[0])
+
+    def _guardar(self, clave, audio):
+        huella = hashlib.sha1(audio).hexdigest()
+        ruta = self.ruta(huella)
+        try:
+            if not os.path.exists(ruta):
+                os.makedirs(os.path.dirname(ruta), exist_ok=True)
+                temporal = f"{ruta}.tmp"
+                with open(temporal, "wb") as f:
+                    f.write(audio)
+                os.replace(temporal, ruta)
+            # Solo se añade una línea: el índice nunca se reescribe entero
+            with self._lock, open(self._ruta_indice, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"clave": clave, "hash": huella}) + "\n")
+        except OSError as e:
+            logger.error("No se pudo guardar el audio en la cache: %s", e)
+        return huella
+
+    # --- Síntesis ------------------------------------------------------------
+
+    def _sintetizar(self, clave, texto):
+        try:
+            audio = self.motor.sintetizar(texto)
+        except ErrorTTS as e:
+            with self._lock:
+                self.errores += 1
+            logger.warning("%s", e)
+            return None
+        huella = self._guardar(clave, audio)
+        with self._lock:
+            self._indice[clave] = huella
+            self.sintetizados += 1
+        return huella
+
+    def _futuro(self, texto):
+        """Futuro con el hash del audio de `texto` (ya resuelto si está en la cache)"""
+        clave = self._clave(texto)
+        with self._lock:
+            huella = self._indice.get(clave)
+            if huella is not None and os.path.exists(self.ruta(huella)):
+                self.aciertos += 1
+                futuro = _resuelto(huella)
+            else:
+                futuro = self._pendientes.get(clave)
+                if futuro is None:
+                    if self._pool is None:
+                        self._pool = ThreadPoolExecutor(max_workers=self.hilos, thread_name_prefix="tts")
+                    futuro = self._pool.submit(self._sintetizar, clave, texto)
+                    self._pendientes[clave] = futuro
+                    futuro.add_done_callback(lambda _: self._pendientes.pop(clave, None))
+        return futuro
+
+    # --- Colección de Anki ---------------------------------------------------
+
+    def _subir(self, huellas):
+        """
+        Sube a Anki los audios que la colección aún no tiene (bloqueante).
+        Devuelve el conjunto de hashes que están en la colección.
+        """
+        with self._lock:
+            caducada = time.monotonic() - self._coleccion_leida > TTS_MEDIA_REFRESH
+        if self._en_coleccion is None or caducada:
+            nombres = listar_media(f"{PREFIJO_MEDIA}*")
+            if nombres is None:
+                return set()
+            with self._lock:
+                self._en_coleccion = set(nombres)
+                self._coleccion_leida = time.monotonic()
+
+        faltan = {}
+        for huella in set(huellas):
+            nombre = self.nombre_media(huella)
+            if nombre in self._en_coleccion:
+                with self._lock:
+                    self.ya_en_anki += 1
+                continue
+            try:
+                with open(self.ruta(huella), "rb") as f:
+                    faltan[nombre] = f.read()
+            except OSError as e:
+                logger.error("No se pudo leer el audio %s: %s", huella, e)
+
+        nombres = list(faltan)
+        fallidos = set()
+        for inicio in range(0, len(nombres), MEDIA_POR_LLAMADA):
+            lote = nombres[inicio:inicio + MEDIA_POR_LLAMADA]
+            fallidos.update(guardar_media_lote({nombre: faltan[nombre] for nombre in lote}))
+        with self._lock:
+            subidos = set(nombres) - fallidos
+            self._en_coleccion.update(subidos)
+            self.subidos += len(subidos)
+        return {huella for huella in huellas if self.nombre_media(huella) in self._en_coleccion}
+
+    # --- Uso desde el bot ----------------------------------------------------
+
+    def _con_audio(self, lista_datos, huellas, subir):
+        en_anki = self._subir([h for h in huellas if h]) if subir else None
+        resultado = []
+        for datos_json, huella in zip(lista_datos, huellas):
+            if huella and (en_anki is None or huella in en_anki):
+                datos_json = dict(datos_json, Audio=self.nombre_media(huella))
+            resultado.append(datos_json)
+        return resultado
+
+    def con_audio(self, lista_datos, subir=True):
+        """
+        Copia de `lista_datos` con 'Audio' en las palabras cuyo audio está listo (bloqueante).
+        Con subir=True solo se asigna si el archivo está en la colección de Anki.
+        Los elementos None se devuelven tal cual.
+        """
+        if not self.activo:
+            return list(lista_datos)
+        futuros = [self._futuro(d['Palabra']) if d and d.get('Palabra') else _resuelto(None) for d in lista_datos]
+        wait(futuros)
+        return self._con_audio(lista_datos, [f.result() for f in futuros], subir)
+
+    async def con_audio_async(self, lista_datos):
+        """Igual que con_audio, esperando la síntesis sin bloquear el event loop"""
+        if not self.activo:
+            return list(lista_datos)
+        futuros = [self._futuro(d['Palabra']) if d and d.get('Palabra') else _resuelto(None) for d in lista_datos]
+        huellas = await asyncio.gather(*(asyncio.wrap_future(f) for f in futuros))
+        return await asyncio.to_thread(self._con_audio, lista_datos, huellas, True)
+
+    def estadisticas(self):
+        return {
+            "motor": self.motor.firma() if self.activo else None,
+            "en_disco": len(self._indice),
+            "sintetizados": self.sintetizados,
+            "aciertos": self.aciertos,
+            "subidos": self.subidos,
+            "ya_en_anki": self.ya_en_anki,
+            "errores": self.errores,
+        }
+
+
+def _resuelto(valor):
+    futuro = Future()
+    futuro.set_result(valor)
+    return futuro
+
+
+audio_pronunciacion = AudioPronunciacion.desde_entorno()
@@ -0,0 +1,118 @@
+# quota_scheduler.py
+import os
+import json
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+# Llamadas diarias a la IA que pueden usar los trabajos en segundo plano (0 = desactivados)
+BACKGROUND_DAILY_QUOTA = int(os.getenv("BACKGROUND_DAILY_QUOTA", "0"))
+QUOTA_STATE_PATH = os.getenv("QUOTA_STATE_PATH", "quota_state.json")
+
+
+class PlanificadorCuota:
+    """
+    Reparte las llamadas a la IA entre usuarios y trabajos en segundo plano.
+    Las operaciones interactivas nunca esperan; los trabajos en segundo plano
+    solo avanzan cuando no hay operaciones interactivas en curso y queda cuota diaria.
+    """
+
+    def __init__(self, cuota_diaria=BACKGROUND_DAILY_QUOTA, ruta=QUOTA_STATE_PATH):
+        self.cuota_diaria = cuota_diaria
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._interactivas = 0
+        self._libre = None
+        self._estado = {"fecha": date.today().isoformat(), "fondo": 0, "interactivas": 0}
+        self._cargar()
+
+    def _cargar(self):
+        if not self.ruta or not os.path.exists(self.ruta):
+            return
+        try:
+            with open(self.ruta, "r", encoding="utf-8") as f:
+                estado = json.load(f)
+            if estado.get("fecha") == self._estado["fecha"]:
+                self._estado.update(estado)
+        except (OSError, ValueError) as e:
+            logger.error("No se pudo leer el estado de la cuota: %s", e)
+
+    def _persistir(self):
+        if not self.ruta:
+            return
+        try:
+            with open(self.ruta, "w", encoding="utf-8") as f:
+                json.dump(self._estado, f)
+        except OSError as e:
+            logger.error("No se pudo guardar el estado de la cuota: %s", e)
+
+    def _renovar_dia(self):
+        hoy = date.today().isoformat()
+        if self._estado["fecha"] != hoy:
+            self._estado = {"fecha": hoy, "fondo": 0, "interactivas": 0}
+
+    def _evento_libre(self):
+        # El evento se crea dentro del event loop la primera vez que se usa
+        if self._libre is None:
+            self._libre = asyncio.Event()
+            if self._interactivas == 0:
+                self._libre.set()
+        return self._libre
+
+    @contextmanager
+    def interactivo(self):
+        """Marca una operación interactiva en curso (pausa los trabajos en segundo plano)"""
+        with self._lock:
+            self._interactivas += 1
+            if self._libre is not None:
+                self._libre.clear()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._interactivas -= 1
+                if self._interactivas == 0 and self._libre is not None:
+                    self._libre.set()
+
+    def registrar_llamada(self, fondo=False):
+        """Contabiliza una llamada a la IA en el día actual"""
+        with self._lock:
+            self._renovar_dia()
+            self._estado["fondo" if fondo else "interactivas"] += 1
+            self._persistir()
+
+    def cuota_restante(self):
+        """Llamadas en segundo plano que quedan hoy"""
+        with self._lock:
+            self._renovar_dia()
+            return max(0, self.cuota_diaria - self._estado["fondo"])
+
+    async def esperar_turno_fondo(self):
+        """
+        Espera a que no haya operaciones interactivas.
+        Devuelve False si no queda cuota diaria para trabajos en segundo plano.
+        """
+        while True:
+            if self.cuota_restante() <= 0:
+                return False
+            await self._evento_libre().wait()
+            # Dejar pasar a las operaciones interactivas que lleguen en este instante
+            await asyncio.sleep(0)
+            if self._interactivas == 0:
+                return True
+
+    @property
+    def interactivas_en_curso(self):
+        return self._interactivas
+
+    def estadisticas(self):
+        with self._lock:
+            self._renovar_dia()
+            return dict(self._estado, cuota_diaria=self.cuota_diaria)
+
+
+planificador_cuota = PlanificadorCuota()
@@ -0,0 +1,157 @@
+# recorder.py
+"""
+Grabación opcional del tráfico de producción para reproducirlo sin conexión
+(ver tools/replay.py).
+
+Con RECORD_TRAFFIC=1 se añade a un log rotativo (JSON por línea) cada Update
+recibido, con los datos personales filtrados, y la duración de las llamadas a
+AnkiConnect y a la IA que provocó.
+"""
+import os
+import json
+import time
+import hmac
+import hashlib
+import logging
+import secrets
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+RECORD_TRAFFIC = os.getenv("RECORD_TRAFFIC", "0") == "1"
+RECORD_PATH = os.getenv("RECORD_PATH", "traffic.jsonl")
+RECORD_MAX_BYTES = int(os.getenv("RECORD_MAX_BYTES", str(10 * 1024 * 1024)))
+RECORD_BACKUPS = int(os.getenv("RECORD_BACKUPS", "5"))
+# Clave para seudonimizar los IDs de usuario y chat de forma estable. Si no se da,
+# se genera una aleatoria la primera vez y se guarda en RECORD_SALT_PATH
+RECORD_SALT = os.getenv("RECORD_SALT", "")
+RECORD_SALT_PATH = os.getenv("RECORD_SALT_PATH", "record_salt")
+
+# Campos personales que nunca se graban (se sustituyen por ANONIMO)
+ANONIMO = "anon"
+CAMPOS_PRIVADOS = {"first_name", "last_name", "username", "language_code", "title", "phone_number"}
+# Campos cuyo valor es un ID de usuario o de chat
+CAMPOS_ID = {"id", "user_id", "chat_id"}
+
+_update_actual = contextvars.ContextVar("update_actual", default=None)
+
+_log = logging.getLogger("recorder")
+_log.propagate = False
+
+
+
+def _cargar_sal(ruta=RECORD_SALT_PATH):
+    """
+    Clave secreta de la seudonimización. Sin ella, el HMAC de un ID de Telegram
+    (un entero pequeño) se invertiría probando todos los valores.
+    """
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            sal = f.read().strip()
+        if sal:
+            return sal
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        raise RuntimeError(f"RECORD_TRAFFIC=1 sin RECORD_SALT y no se pudo leer {ruta}: {e}") from e
+    sal = secrets.token_hex(32)
+    try:
+        descriptor = os.open(ruta, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, "w", encoding="utf-8") as f:
+            f.write(sal)
+    except OSError as e:
+        raise RuntimeError(f"RECORD_TRAFFIC=1 sin RECORD_SALT y no se pudo guardar {ruta}: {e}") from e
+    return sal
+
+
+if RECORD_TRAFFIC:
+    if not RECORD_SALT:
+        RECORD_SALT = _cargar_sal()
+    _manejador = RotatingFileHandler(
+        RECORD_PATH, maxBytes=RECORD_MAX_BYTES, backupCount=RECORD_BACKUPS, encoding="utf-8"
+    )
+    _manejador.setFormatter(logging.Formatter("%(message)s"))
+    _log.addHandler(_manejador)
+    _log.setLevel(logging.INFO)
+
+
+def seudonimo(valor):
+    """Convierte un ID en un entero positivo estable que no revela el original"""
+    digest = hmac.new(RECORD_SALT.encode("utf-8"), str(valor).encode("utf-8"), hashlib.sha256).digest()
+    return int.from_bytes(digest[:4], "big") or 1
+
+
+def filtrar_privacidad(datos, padre=None):
+    """Elimina nombres y seudonimiza IDs de usuarios y chats en un Update serializado"""
+    if isinstance(datos, dict):
+        filtrado = {}
+        for clave, valor in datos.items():
+            if clave in CAMPOS_PRIVADOS:
+                filtrado[clave] = ANONIMO
+                continue
+            if clave in CAMPOS_ID and isinstance(valor, int) and padre in ("from", "chat", "user", "sender_chat"):
+                filtrado[clave] = seudonimo(valor)
+            else:
+                filtrado[clave] = filtrar_privacidad(valor, clave)
+        return filtrado
+    if isinstance(datos, list):
+        return [filtrar_privacidad(valor, padre) for valor in datos]
+    return datos
+
+
+def _escribir(registro):
+    _log.info(json.dumps(registro, ensure_ascii=False, separators=(",", ":")))
+
+
+async def registrar_update(update, context):
+    """Manejador (grupo -1) que graba cada Update antes de procesarlo"""
+    _update_actual.set(update.update_id)
+    if RECORD_TRAFFIC:
+        _escribir({
+            "tipo": "update",
+            "t": time.time(),
+            "update": filtrar_privacidad(update.to_dict())
+        })
+
+
+def registrar_accion(callback_data, accion):
+    """Graba a qué acción correspondía un token de botón, para poder reproducirlo"""
+    if RECORD_TRAFFIC and callback_data != accion.nombre:
+        _escribir({
+            "tipo": "accion",
+            "t": time.time(),
+            "update_id": _update_actual.get(),
+            "callback_data": callback_data,
+            "nombre": accion.nombre,
+            "argumento": accion.argumento
+        })
+
+
+def update_actual():
+    """ID del Update que se está procesando en este contexto"""
+    return _update_actual.get()
+
+
+@contextmanager
+def cronometrar(servicio, accion):
+    """Mide una llamada externa ('anki' o 'ia') y la graba asociada al Update en curso"""
+    if not RECORD_TRAFFIC:
+        yield
+        return
+    inicio = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _escribir({
+            "tipo": "llamada",
+            "t": time.time(),
+            "update_id": _update_actual.get(),
+            "servicio": servicio,
+            "accion": accion,
+            "duracion": round(time.perf_counter() - inicio, 4),
+            "error": error
+        })
@@ -0,0 +1,249 @@
+# reenrich.py
+"""
+Re-enriquecimiento masivo y reanudable de decks existentes.
+
+Recorre un deck por páginas (findNotes + notesInfo), regenera con la IA las notas
+que no tienen el formato actual (pronunciación en el Front y oración médica en el
+Back) y las reescribe por lotes con una sola llamada multi/updateNoteFields por página.
+El progreso se guarda en disco tras cada página para poder pausar, reanudar o
+continuar después de una caída. Las generaciones pasan por el planificador de
+cuota, así que nunca compiten con los usuarios interactivos.
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+
+from anki_functions import (
+    obtener_info_completa_ia,
+    buscar_notas_por_query,
+    consulta_deck,
+    obtener_info_notas,
+    construir_campos_nota,
+    actualizar_notas_lote,
+    ErrorAnkiConnect
+)
+from deck_index import palabra_desde_front
+from word_cache import cache_palabras
+from note_sidecar import almacen_notas
+from quota_scheduler import planificador_cuota
+from pronunciation_audio import audio_pronunciacion
+
+logger = logging.getLogger(__name__)
+
+REENRICH_DIR = os.getenv("REENRICH_DIR", "reenrich_checkpoints")
+REENRICH_PAGE_SIZE = int(os.getenv("REENRICH_PAGE_SIZE", "50"))
+REENRICH_CONCURRENCY = int(os.getenv("REENRICH_CONCURRENCY", "2"))
+# Segundos mínimos entre generaciones (limitación de ritmo)
+REENRICH_MIN_INTERVAL = float(os.getenv("REENRICH_MIN_INTERVAL", "1"))
+
+EN_CURSO, PAUSADO, COMPLETADO = "en_curso", "pausado", "completado"
+
+
+def necesita_reenriquecimiento(nota):
+    """True si la nota no tiene el formato actual del bot"""
+    campos = nota.get('fields', {})
+    if 'Front' not in campos or 'Back' not in campos:
+        return False
+    if almacen_notas.obtener(nota['noteId']) is not None:
+        return False
+    front = campos['Front']['value']
+    back = campos['Back']['value']
+    return '(' not in front or '🏥' not in back
+
+
+class TrabajoReenriquecimiento:
+    """Estado persistente del re-enriquecimiento de un deck"""
+
+    def __init__(self, deck):
+        self.deck = deck
+        self.note_ids = None
+        self.posicion = 0
+        self.estado = PAUSADO
+        self.procesadas = 0
+        self.actualizadas = 0
+        self.errores = 0
+        self.ruta = os.path.join(
+            REENRICH_DIR, hashlib.sha1(deck.encode("utf-8")).hexdigest()[:12] + ".json"
+        )
+        self._cargar()
+
+    def _cargar(self):
+        if not os.path.exists(self.ruta):
+            return
+        try:
+            with open(self.ruta, "r", encoding="utf-8") as f:
+                datos = json.load(f)
+            for clave in ("note_ids", "posicion", "estado", "procesadas", "actualizadas", "errores"):
+                setattr(self, clave, datos[clave])
+        except (OSError, ValueError, KeyError) as e:
+            logger.error("No se pudo leer el checkpoint de %s: %s", self.deck, e)
+
+    def guardar(self):
+        """Escribe el checkpoint de forma atómica"""
+        os.makedirs(REENRICH_DIR, exist_ok=True)
+        temporal = f"{self.ruta}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump({
+                "deck": self.deck,
+                "note_ids": self.note_ids,
+                "posicion": self.posicion,
+                "estado": self.estado,
+                "procesadas": self.procesadas,
+                "actualizadas": self.actualizadas,
+                "errores": self.errores
+            }, f)
+        os.replace(temporal, self.ruta)
+
+    def resumen(self):
+        total = len(self.note_ids) if self.note_ids is not None else "?"
+        estado = self.estado
+        if estado == EN_CURSO and planificador_cuota.cuota_restante() <= 0:
+            estado += (" (esperando cuota: BACKGROUND_DAILY_QUOTA es 0)" if planificador_cuota.cuota_diaria <= 0
+                       else " (esperando la cuota de mañana)")
+        return (f"📚 {self.deck}: {estado}, {self.posicion}/{total} notas revisadas, "
+                f"{self.actualizadas} actualizadas, {self.errores} errores")
+
+
+class GestorReenriquecimiento:
+    """Arranca, pausa y reanuda trabajos de re-enriquecimiento"""
+
+    def __init__(self):
+        self.trabajos = {}
+        self.tareas = {}
+        self._limite = asyncio.Semaphore(REENRICH_CONCURRENCY)
+        self._ultima_generacion = 0.0
+
+    def trabajo(self, deck):
+        if deck not in self.trabajos:
+            self.trabajos[deck] = TrabajoReenriquecimiento(deck)
+        return self.trabajos[deck]
+
+    def iniciar(self, deck):
+        """Inicia o reanuda el trabajo de un deck en segundo plano"""
+        tarea = self.tareas.get(deck)
+        trabajo = self.trabajo(deck)
+        if tarea is not None and not tarea.done():
+            # Pausado pero aún terminando su página (o esperando cuota): la tarea vuelve
+            # a mirar el estado antes de la página siguiente, así que basta con reactivarlo
+            if trabajo.estado != EN_CURSO:
+                trabajo.estado = EN_CURSO
+                trabajo.guardar()
+            return trabajo
+        trabajo.estado = EN_CURSO
+        trabajo.guardar()
+        self.tareas[deck] = asyncio.create_task(self._ejecutar(trabajo))
+        return trabajo
+
+    def pausar(self, deck):
+        """Pide la pausa; el trabajo se detiene al terminar la página actual"""
+        trabajo = self.trabajo(deck)
+        if trabajo.estado == EN_CURSO:
+            trabajo.estado = PAUSADO
+            # Si el bot se reinicia antes de terminar la página, el trabajo no se reanuda
+            trabajo.guardar()
+        return trabajo
+
+    def reanudar_pendientes(self):
+        """Reanuda los trabajos que estaban en curso al detenerse el bot"""
+        if not os.path.isdir(REENRICH_DIR):
+            return
+        for nombre in os.listdir(REENRICH_DIR):
+            if not nombre.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(REENRICH_DIR, nombre), "r", encoding="utf-8") as f:
+                    datos = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if datos.get("estado") == EN_CURSO:
+                logger.info("Reanudando re-enriquecimiento de %s", datos["deck"])
+                self.iniciar(datos["deck"])
+
+    async def _generar(self, palabra):
+        datos = cache_palabras.obtener(palabra, completa=True)
+        if datos is not None:
+            return dict(datos)
+        async with self._limite:
+            if not await planificador_cuota.esperar_turno_fondo():
+                return None
+            espera = self._ultima_generacion + REENRICH_MIN_INTERVAL - time.monotonic()
+            self._ultima_generacion = time.monotonic() + max(0.0, espera)
+            if espera > 0:
+                await asyncio.sleep(espera)
+            planificador_cuota.registrar_llamada(fondo=True)
+            datos = await asyncio.to_thread(obtener_info_completa_ia, palabra)
+        if datos is not None:
+            cache_palabras.guardar(palabra, datos)
+        return datos
+
+    async def _ejecutar(self, trabajo):
+        try:
+            if trabajo.note_ids is None:
+                note_ids = await asyncio.to_thread(buscar_notas_por_query, consulta_deck(trabajo.deck), lanzar=True)
+                trabajo.note_ids = sorted(note_ids)
+                trabajo.guardar()
+
+            while trabajo.estado == EN_CURSO and trabajo.posicion < len(trabajo.note_ids):
+                if planificador_cuota.cuota_restante() <= 0:
+                    # Sin cuota: esperar al día siguiente sin perder el progreso
+                    await asyncio.sleep(3600)
+                    continue
+
+                pagina = trabajo.note_ids[trabajo.posicion:trabajo.posicion + REENRICH_PAGE_SIZE]
+                # Si Anki no responde se lanza ErrorAnkiConnect y la página no se da por revisada
+                notas = await asyncio.to_thread(obtener_info_notas, pagina, lanzar=True)
+                pendientes = [nota for nota in notas if nota and necesita_reenriquecimiento(nota)]
+
+                palabras = [palabra_desde_front(nota['fields']['Front']['value']) for nota in pendientes]
+                generados = await asyncio.gather(*(self._generar(p) for p in palabras))
+                # Audio de toda la página: una sola subida con los archivos que Anki aún no tiene
+                generados = await audio_pronunciacion.con_audio_async(generados)
+
+                # Si la cuota se agotó a mitad de página, la página se repite más tarde;
+                # las notas ya reescritas se saltan porque tienen sidecar
+                sin_cuota = None in generados and planificador_cuota.cuota_restante() <= 0
+
+                actualizaciones, datos_por_nota = {}, {}
+                for nota, datos in zip(pendientes, generados):
+                    if datos is None:
+                        if not sin_cuota:
+                            trabajo.errores += 1
+                        continue
+                    actualizaciones[nota['noteId']] = construir_campos_nota(datos)
+                    datos_por_nota[nota['noteId']] = datos
+
+                errores = await asyncio.to_thread(actualizar_notas_lote, actualizaciones, lanzar=True)
+                for note_id, datos in datos_por_nota.items():
+                    if note_id in errores:
+                        trabajo.errores += 1
+                    else:
+                        almacen_notas.guardar(note_id, datos)
+                        trabajo.actualizadas += 1
+
+                if not sin_cuota:
+                    trabajo.procesadas += len(pendientes)
+                    trabajo.posicion += len(pagina)
+                trabajo.guardar()
+
+            if trabajo.posicion >= len(trabajo.note_ids):
+                trabajo.estado = COMPLETADO
+                logger.info("Re-enriquecimiento completado: %s", trabajo.resumen())
+            trabajo.guardar()
+        except asyncio.CancelledError:
+            trabajo.guardar()
+            raise
+        except ErrorAnkiConnect as e:
+            # Sin Anki no se sabe qué notas hay: se pausa en la misma posición para reanudar luego
+            logger.warning("Re-enriquecimiento de %s pausado: AnkiConnect no responde (%s)", trabajo.deck, e)
+            trabajo.estado = PAUSADO
+            trabajo.guardar()
+        except Exception:
+            logger.exception("Error en el re-enriquecimiento de %s", trabajo.deck)
+            trabajo.estado = PAUSADO
+            trabajo.guardar()
+
+
+gestor_reenriquecimiento = GestorReenriquecimiento()
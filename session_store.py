@@ -0,0 +1,227 @@
+# session_store.py
+import os
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Segundos de inactividad tras los que se descarta una sesión
+SESSION_IDLE_TTL = int(os.getenv("SESSION_IDLE_TTL", str(2 * 3600)))
+# Memoria máxima estimada para todas las sesiones (bytes)
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(32 * 1024 * 1024)))
+# Intervalo mínimo entre barridos de sesiones inactivas (segundos)
+INTERVALO_BARRIDO = 30
+
+
+@dataclass(slots=True)
+class BorradorTarjeta:
+    """Borrador compacto de una tarjeta. Los atributos usan los nombres del JSON de la IA."""
+    Palabra: str = ""
+    Significado: tuple = ()
+    Pronunciacion: str = ""
+    Gramatica: str = ""
+    Etimologia: str = ""
+    Oracion_Comun: str = ""
+    Oracion_medica: str = ""
+    # Nombre del archivo de audio en la colección (no lo genera la IA)
+    Audio: str = ""
+
+    @classmethod
+    def desde_dict(cls, datos_json):
+        """Crea un borrador a partir del JSON de la IA o de una nota convertida"""
+        borrador = cls()
+        for campo in CAMPOS_BORRADOR:
+            borrador.asignar(campo, datos_json.get(campo, ""))
+        return borrador
+
+    def asignar(self, campo, valor):
+        """Asigna un campo normalizando Significado a tupla y el resto a texto"""
+        if campo == 'Significado':
+            if not valor:
+                valor = ()
+            elif isinstance(valor, (list, tuple)):
+                valor = tuple(str(v) for v in valor)
+            else:
+                valor = (str(valor),)
+        else:
+            valor = "" if valor is None else str(valor)
+        setattr(self, campo, valor)
+
+    def a_dict(self):
+        """Devuelve el borrador con el formato de datos_anki que usan las funciones de Anki"""
+        datos = {campo: getattr(self, campo) for campo in CAMPOS_BORRADOR}
+        datos['Significado'] = list(self.Significado)
+        return datos
+
+    def tamano(self):
+        """Tamaño aproximado en bytes"""
+        total = sys.getsizeof(self)
+        for campo in CAMPOS_BORRADOR:
+            valor = getattr(self, campo)
+            total += sys.getsizeof(valor)
+            if isinstance(valor, tuple):
+                total += sum(sys.getsizeof(v) for v in valor)
+        return total
+
+
+CAMPOS_BORRADOR = tuple(f.name for f in fields(BorradorTarjeta))
+
+
+@dataclass(slots=True)
+class Sesion:
+    """Estado de la conversación de un usuario"""
+    estado: Optional[int] = None
+    borrador: Optional[BorradorTarjeta] = None
+    campo_editando: Optional[str] = None
+    nota_existente_id: Optional[int] = None
+    tipo_tarjeta: Optional[str] = None
+    deck_elegido: Optional[str] = None
+    campos_originales: Optional[dict] = None
+    campos_sucios: frozenset = frozenset()
+    candidatas: tuple = ()
+    botones_candidatas: tuple = ()
+    # Pares (deck, token) de los botones de deck de un teclado que se redibuja
+    botones_decks: tuple = ()
+    # Notas que ya existen para la palabra buscada (se muestran por páginas)
+    palabra_encontrada: Optional[str] = None
+    notas_encontradas: tuple = ()
+    # Pares (noteId, token) de los botones ✏️ Editar de las páginas ya vistas
+    botones_notas: tuple = ()
+    # Token de 🆕 Crear nueva, reutilizado en cada página
+    boton_crear_nota: Optional[str] = None
+    seleccion: frozenset = frozenset()
+    # El borrador aún no tiene los extras de la segunda fase
+    extras_pendientes: bool = False
+    ultimo_acceso: float = 0.0
+
+    def tamano(self):
+        """Tamaño aproximado en bytes"""
+        total = sys.getsizeof(self)
+        if self.borrador is not None:
+            total += self.borrador.tamano()
+        for valor in (self.campo_editando, self.tipo_tarjeta, self.deck_elegido, self.palabra_encontrada,
+                      self.boton_crear_nota):
+            if valor is not None:
+                total += sys.getsizeof(valor)
+        if self.campos_originales:
+            total += sys.getsizeof(self.campos_originales)
+            total += sum(sys.getsizeof(v) for v in self.campos_originales.values())
+        for valores in (self.candidatas, self.botones_candidatas, self.botones_decks,
+                        self.notas_encontradas, self.botones_notas):
+            if valores:
+                total += sys.getsizeof(valores) + sum(sys.getsizeof(v) for v in valores)
+        if self.seleccion:
+            total += sys.getsizeof(self.seleccion)
+        return total
+
+
+class AlmacenSesiones:
+    """
+    Sesiones por usuario con desalojo por inactividad (TTL) y
+    un límite global de memoria (se desalojan primero las menos usadas).
+    """
+
+    def __init__(self, ttl=SESSION_IDLE_TTL, max_bytes=SESSION_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # Función(user_id) llamada al desalojar una sesión (p. ej. para cancelar su trabajo en curso)
+        self.al_desalojar = None
+        self._sesiones = OrderedDict()
+        self._lock = threading.Lock()
+        self._ultimo_barrido = time.monotonic()
+        self._bytes = 0
+        self.desalojadas_ttl = 0
+        self.desalojadas_memoria = 0
+
+    def obtener(self, user_id) -> Sesion:
+        """Devuelve la sesión del usuario, creándola si no existe"""
+        ahora = time.monotonic()
+        desalojados = ()
+        with self._lock:
+            sesion = self._sesiones.get(user_id)
+            if sesion is None:
+                sesion = Sesion()
+                self._sesiones[user_id] = sesion
+            else:
+                self._sesiones.move_to_end(user_id)
+            sesion.ultimo_acceso = ahora
+            if ahora - self._ultimo_barrido >= INTERVALO_BARRIDO:
+                desalojados = self._barrer(ahora)
+        self._avisar(desalojados)
+        return sesion
+
+    def estado(self, user_id):
+        """Estado de conversación del usuario sin crear ni renovar su sesión"""
+        sesion = self._sesiones.get(user_id)
+        return sesion.estado if sesion is not None else None
+
+    def limpiar(self, user_id):
+        """Descarta la sesión del usuario (equivalente a user_data.clear())"""
+        with self._lock:
+            self._sesiones.pop(user_id, None)
+
+    def barrer(self):
+        """Fuerza un barrido de sesiones inactivas y del límite de memoria"""
+        with self._lock:
+            desalojados = self._barrer(time.monotonic())
+        self._avisar(desalojados)
+
+    def _avisar(self, desalojados):
+        if self.al_desalojar is None:
+            return
+        for user_id in desalojados:
+            try:
+                self.al_desalojar(user_id)
+            except Exception as e:
+                logger.error("Error al desalojar la sesión de %s: %s", user_id, e)
+
+    def _barrer(self, ahora):
+        """Desaloja sesiones inactivas y por memoria; devuelve los usuarios desalojados"""
+        self._ultimo_barrido = ahora
+        desalojados = []
+
+        # Inactivas: el OrderedDict está ordenado por último acceso
+        while self._sesiones:
+            user_id, sesion = next(iter(self._sesiones.items()))
+            if ahora - sesion.ultimo_acceso < self.ttl:
+                break
+            del self._sesiones[user_id]
+            desalojados.append(user_id)
+            self.desalojadas_ttl += 1
+
+        # Límite global de memoria
+        tamanos = {user_id: sesion.tamano() for user_id, sesion in self._sesiones.items()}
+        self._bytes = sum(tamanos.values())
+        while self._sesiones and self._bytes > self.max_bytes:
+            user_id, _ = self._sesiones.popitem(last=False)
+            self._bytes -= tamanos[user_id]
+            desalojados.append(user_id)
+            self.desalojadas_memoria += 1
+
+        if self.desalojadas_ttl or self.desalojadas_memoria:
+            logger.debug(
+                "Sesiones: %d activas, %d bytes, %d expiradas, %d por memoria",
+                len(self._sesiones), self._bytes, self.desalojadas_ttl, self.desalojadas_memoria
+            )
+        return desalojados
+
+    def estadisticas(self):
+        """Número de sesiones activas, bytes estimados y desalojos"""
+        self.barrer()
+        return {
+            'sesiones': len(self._sesiones),
+            'bytes': self._bytes,
+            'desalojadas_ttl': self.desalojadas_ttl,
+            'desalojadas_memoria': self.desalojadas_memoria
+        }
+
+    def __len__(self):
+        return len(self._sesiones)
+
+
+sesiones = AlmacenSesiones()
@@ -0,0 +1,160 @@
+# task_manager.py
+"""
+Trabajo en curso por usuario, cancelable y con plazo máximo.
+
+Cada Update de un usuario se ejecuta como una tarea registrada a su nombre. Cancelar
+(botón ❌, una palabra nueva o la expiración de la sesión) aborta la tarea al momento:
+el Update deja de esperar y libera su plaza en el planificador, y su resultado nunca
+llega a escribirse en la sesión.
+
+Las llamadas bloqueantes que ya corren en un hilo no se pueden interrumpir desde
+fuera, así que la cancelación es cooperativa: cada tarea lleva un evento en un
+ContextVar (asyncio.to_thread lo hereda) y las funciones que hablan con la IA o con
+AnkiConnect llaman a comprobar_cancelacion() antes de cada petición o trozo de
+respuesta. Así una generación o búsqueda cancelada no llega a gastar cuota.
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Segundos máximos que puede durar el trabajo de un Update de un usuario
+USER_TASK_DEADLINE = float(os.getenv("USER_TASK_DEADLINE", "180"))
+
+_evento_cancelacion = contextvars.ContextVar("evento_cancelacion", default=None)
+
+
+class OperacionCancelada(BaseException):
+    """
+    La tarea del usuario se canceló; la operación no debe continuar.
+    Como asyncio.CancelledError, no hereda de Exception para atravesar los `except Exception`.
+    La recoge GestorTareas.ejecutar: nunca llega a los manejadores de errores de PTB.
+    """
+
+
+def comprobar_cancelacion():
+    """Lanza OperacionCancelada si la tarea actual (de cualquier hilo) fue cancelada"""
+    evento = _evento_cancelacion.get()
+    if evento is not None and evento.is_set():
+        gestor_tareas.contar_evitada()
+        raise OperacionCancelada()
+
+
+def esperar_cancelable(segundos):
+    """time.sleep que termina antes (con OperacionCancelada) si la tarea se cancela"""
+    evento = _evento_cancelacion.get()
+    if evento is None:
+        time.sleep(segundos)
+    elif evento.wait(segundos):
+        comprobar_cancelacion()
+
+
+class _Tarea:
+    __slots__ = ("tarea", "evento", "inicio", "motivo")
+
+    def __init__(self, tarea, evento):
+        self.tarea = tarea
+        self.evento = evento
+        self.inicio = time.monotonic()
+        self.motivo = None
+
+
+class GestorTareas:
+    """Tareas en curso por usuario con cancelación y métricas del trabajo recuperado"""
+
+    def __init__(self, plazo=USER_TASK_DEADLINE):
+        self.plazo = plazo
+        self._tareas = {}
+        self._lock = threading.Lock()
+        # Corrutina(user_id) para avisar al usuario cuando su tarea supera el plazo
+        self.al_vencer = None
+        self.completadas = 0
+        self.vencidas = 0
+        self.canceladas = Counter()
+        # Segundos que llevaban en marcha las tareas canceladas o vencidas
+        self.segundos_abortados = 0.0
+        # Peticiones a la IA o a AnkiConnect que no se llegaron a enviar
+        self.llamadas_evitadas = 0
+
+    async def ejecutar(self, user_id, coroutine, plazo=None):
+        """
+        Ejecuta la corrutina como tarea cancelable del usuario.
+        Devuelve su resultado, o None si se canceló o superó el plazo.
+        """
+        evento = threading.Event()
+        contexto = contextvars.copy_context()
+        contexto.run(_evento_cancelacion.set, evento)
+        entrada = _Tarea(asyncio.create_task(coroutine, context=contexto), evento)
+        with self._lock:
+            self._tareas.setdefault(user_id, set()).add(entrada)
+        try:
+            return await asyncio.wait_for(entrada.tarea, plazo or self.plazo)
+        except TimeoutError:
+            evento.set()
+            self.vencidas += 1
+            self.segundos_abortados += time.monotonic() - entrada.inicio
+            logger.warning("Tarea del usuario %s cancelada por superar el plazo de %.0fs",
+                           user_id, plazo or self.plazo)
+            if self.al_vencer is not None:
+                try:
+                    await self.al_vencer(user_id)
+                except Exception as e:
+                    logger.error("No se pudo avisar del plazo vencido a %s: %s", user_id, e)
+            return None
+        except asyncio.CancelledError:
+            if entrada.motivo is None:
+                # Cancelación externa (apagado): se propaga
+                evento.set()
+                raise
+            return None
+        except OperacionCancelada:
+            # Lanzada desde un hilo que vio el evento antes de que se cancelara la tarea
+            return None
+        finally:
+            with self._lock:
+                tareas = self._tareas.get(user_id)
+                if tareas is not None:
+                    tareas.discard(entrada)
+                    if not tareas:
+                        self._tareas.pop(user_id, None)
+            if entrada.motivo is None and not entrada.tarea.cancelled():
+                self.completadas += 1
+
+    def cancelar(self, user_id, motivo="cancelada"):
+        """Cancela todas las tareas en curso del usuario (seguro desde cualquier hilo)"""
+        with self._lock:
+            tareas = [entrada for entrada in self._tareas.get(user_id, ())
+                      if entrada.motivo is None and not entrada.tarea.done()]
+        for entrada in tareas:
+            entrada.motivo = motivo
+            entrada.evento.set()
+            self.canceladas[motivo] += 1
+            self.segundos_abortados += time.monotonic() - entrada.inicio
+            entrada.tarea.get_loop().call_soon_threadsafe(entrada.tarea.cancel)
+        if tareas:
+            logger.info("Canceladas %d tareas del usuario %s (%s)", len(tareas), user_id, motivo)
+        return len(tareas)
+
+    def contar_evitada(self):
+        with self._lock:
+            self.llamadas_evitadas += 1
+
+    def estadisticas(self):
+        with self._lock:
+            en_curso = sum(len(tareas) for tareas in self._tareas.values())
+        return {
+            "en_curso": en_curso,
+            "completadas": self.completadas,
+            "canceladas": dict(self.canceladas),
+            "vencidas": self.vencidas,
+            "segundos_abortados": self.segundos_abortados,
+            "llamadas_evitadas": self.llamadas_evitadas,
+        }
+
+
+gestor_tareas = GestorTareas()
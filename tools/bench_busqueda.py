@@ -0,0 +1,90 @@
+# tools/bench_busqueda.py
+"""
+Benchmark de la búsqueda de palabras en un deck: consulta antigua de texto completo
+(deck:"X" "palabra") frente a la consulta acotada al campo Front.
+
+Levanta tools/fake_ankiconnect.py con una colección sintética grande y mide, para una
+muestra de palabras, la latencia de findNotes + notesInfo (lo que hace el bot) y la
+tasa de falsos positivos (notas devueltas cuyo Front no es la palabra buscada).
+Incluye palabras con comillas y comodines, que la consulta antigua no escapa.
+
+La latencia del sustituto refleja su evaluación en Python nota a nota, no el índice
+SQL de Anki; lo comparable entre ambas consultas son las notas devueltas y su coste.
+
+Uso: python tools/bench_busqueda.py [--notas 50000] [--muestra 300]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+
+DIRECTORIO_RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORIO_RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_ankiconnect import ColeccionFalsa, iniciar_servidor
+
+DECK = "0 USA::STEP 1"
+PALABRAS_ESPECIALES = ['o"clock', "t_cell", "a*b", "x:ray", "back\\slash"]
+
+
+def consulta_antigua(deck_name, palabra):
+    return f'deck:"{deck_name}" "{palabra}"'
+
+
+def medir(nombre, construir, muestra, esperadas, buscar, obtener_info):
+    latencias, devueltas, falsos, fallidas = [], 0, 0, 0
+    for palabra in muestra:
+        # Como en process_word: findNotes y después notesInfo de lo encontrado
+        inicio = time.perf_counter()
+        note_ids = buscar(construir(DECK, palabra))
+        if note_ids:
+            obtener_info(note_ids)
+        latencias.append(time.perf_counter() - inicio)
+        devueltas += len(note_ids)
+        falsos += len(set(note_ids) - esperadas[palabra])
+        if not esperadas[palabra] <= set(note_ids):
+            fallidas += 1
+    latencias.sort()
+    print(f"{nombre:>10} {statistics.mean(latencias) * 1000:>9.1f} {latencias[int(len(latencias) * 0.95)] * 1000:>9.1f} "
+          f"{devueltas:>9} {falsos / max(devueltas, 1):>10.1%} {fallidas:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de consultas de búsqueda de Anki")
+    parser.add_argument("--notas", type=int, default=50_000)
+    parser.add_argument("--muestra", type=int, default=300)
+    args = parser.parse_args()
+
+    coleccion = ColeccionFalsa()
+    coleccion.poblar_sintetica(args.notas)
+    for palabra in PALABRAS_ESPECIALES:
+        coleccion.agregar(DECK, "Basic", {"Front": f"{palabra} (/x/)", "Back": "• especial"})
+    servidor, url = iniciar_servidor(coleccion)
+    os.environ["ANKICONNECT_URL"] = url
+    os.environ.setdefault("GOOGLE_API_KEY", "bench")
+
+    from anki_functions import buscar_notas_por_query, obtener_info_notas, consulta_palabra_en_deck
+    from deck_index import palabra_desde_front
+
+    # Verdad de referencia: notas del deck (o subdecks) cuyo Front es la palabra
+    esperadas = {}
+    for note_id, nota in coleccion.notas.items():
+        if nota["deck"] == DECK or nota["deck"].startswith(DECK + "::"):
+            palabra = palabra_desde_front(nota["fields"]["Front"])
+            esperadas.setdefault(palabra, set()).add(note_id)
+    aleatorio = random.Random(1)
+    muestra = aleatorio.sample(sorted(esperadas), min(args.muestra, len(esperadas)))
+    muestra += [p for p in PALABRAS_ESPECIALES if p not in muestra]
+
+    print(f"📚 {len(coleccion.notas)} notas, {len(muestra)} palabras buscadas en '{DECK}'")
+    print(f"{'consulta':>10} {'media ms':>9} {'p95 ms':>9} {'devueltas':>9} {'falsos +':>10} {'perdidas':>9}")
+    medir("antigua", consulta_antigua, muestra, esperadas, buscar_notas_por_query, obtener_info_notas)
+    medir("campo", consulta_palabra_en_deck, muestra, esperadas, buscar_notas_por_query, obtener_info_notas)
+    servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
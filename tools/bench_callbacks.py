@@ -0,0 +1,41 @@
+# tools/bench_callbacks.py
+"""
+Benchmark del registro de callbacks y del despacho por tabla.
+Muestra que el coste por botón se mantiene constante al crecer
+el número de acciones registradas y de manejadores.
+
+Uso: python tools/bench_callbacks.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from callback_registry import RegistroCallbacks, AccionBoton
+
+REPETICIONES = 200_000
+
+
+def medir(num_acciones, num_manejadores):
+    registro = RegistroCallbacks(capacidad=num_acciones, ttl=3600)
+    tokens = [registro.registrar(AccionBoton(f"accion_{i % num_manejadores}", f"palabra {i}"))
+              for i in range(num_acciones)]
+    tabla = {f"accion_{i}": (lambda accion: accion) for i in range(num_manejadores)}
+
+    inicio = time.perf_counter()
+    for i in range(REPETICIONES):
+        accion = registro.resolver(tokens[i % num_acciones])
+        tabla[accion.nombre](accion)
+    return (time.perf_counter() - inicio) / REPETICIONES * 1e9
+
+
+def main():
+    print(f"{'acciones':>10} {'manejadores':>12} {'ns/botón':>10}")
+    for num_acciones in (10, 1_000, 100_000):
+        for num_manejadores in (5, 50, 500):
+            print(f"{num_acciones:>10} {num_manejadores:>12} {medir(num_acciones, num_manejadores):>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
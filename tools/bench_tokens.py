@@ -0,0 +1,98 @@
+# tools/bench_tokens.py
+"""
+Mide los tokens por tarjeta del prompt anterior (siete campos sin límites) frente
+al prompt construido desde card_schema.py, y los de regenerar un solo campo
+(Oracion_medica) desde el menú de edición.
+
+Con un backend real (LLM_BACKEND=gemini u openai) genera cada palabra con ambos
+prompts y muestra los tokens de entrada/salida que informa la API y la latencia.
+Con --sin-ia no llama a ninguna API: estima los tokens (~4 caracteres por token)
+de los prompts y, para la salida, de las respuestas guardadas en la cache local
+tal como son y recortadas al esquema.
+
+Uso: python tools/bench_tokens.py [--palabras 10] [--sin-ia]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PALABRAS_POR_DEFECTO = ["heart", "bleeding", "achieve", "swelling", "approach",
+                        "fever", "available", "kidney", "consider", "wound"]
+
+
+def prompt_anterior(palabra_en_ingles):
+    """Prompt que se usaba antes del esquema de tarjeta"""
+    return f""". Estoy aprendiendo ingles. Proporciona información completa y detallada sobre la palabra en inglés "{palabra_en_ingles}". Responde únicamente con el objeto JSON y no incluyas texto adicional.
+
+    JSON {{
+        "Palabra": "{palabra_en_ingles}",
+        "Significado": "[Lista con los significados en español]. Solo palabra clave o frase corta sin oraciones completas",
+        "Pronunciacion": "La pronunciación fonética simplificada en español. No la pronunciación oficial, sino en español, por ejemplo Hello = /jelou/ o Help=/jelp/",
+        "Gramatica": "Incluye el infinitivo, los tiempos verbales y las conjugaciones más comunes (si aplica)",
+        "Etimologia": "Explica el origen y la historia de la palabra, algo para ayudar a memorizarla",
+        "Oracion_Comun": "Una oracion en ingles, de ejemplo en contexto general",
+        "Oracion_medica": "Una oracion en ingles, de ejemplo en contexto médico",
+    }}"""
+
+
+def medir_con_ia(backend, construir, palabras):
+    entrada, salida, inicio = backend.tokens_entrada, backend.tokens_salida, time.perf_counter()
+    for palabra in palabras:
+        backend.generar(construir(palabra))
+    n = len(palabras)
+    return ((backend.tokens_entrada - entrada) / n, (backend.tokens_salida - salida) / n,
+            (time.perf_counter() - inicio) / n)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokens por tarjeta antes y después del esquema")
+    parser.add_argument("--palabras", type=int, default=len(PALABRAS_POR_DEFECTO))
+    parser.add_argument("--sin-ia", action="store_true", help="solo estimaciones, sin llamar a la API")
+    args = parser.parse_args()
+    if args.sin_ia:
+        os.environ["LLM_BACKEND"] = "falso"
+
+    from anki_functions import backend_ia, construir_prompt_palabra, construir_prompt_campo
+    from card_schema import recortar
+    from llm_backends import estimar_tokens, BackendFalso
+
+    def prompt_campo(palabra):
+        return construir_prompt_campo("Oracion_medica", BackendFalso.datos_palabra(palabra))
+
+    palabras = (PALABRAS_POR_DEFECTO * (args.palabras // len(PALABRAS_POR_DEFECTO) + 1))[:args.palabras]
+    print(f"{'prompt':>10} {'entrada':>9} {'salida':>9} {'s/tarjeta':>10}")
+
+    if not args.sin_ia:
+        for nombre, construir in (("anterior", prompt_anterior), ("esquema", construir_prompt_palabra),
+                                  ("campo", prompt_campo)):
+            entrada, salida, latencia = medir_con_ia(backend_ia, construir, palabras)
+            print(f"{nombre:>10} {entrada:>9.0f} {salida:>9.0f} {latencia:>10.2f}")
+        if backend_ia.nombre == "falso":
+            print("ℹ️ El backend falso responde igual a los dos prompts de tarjeta completa: la salida solo es comparable con una IA real")
+        return
+
+    from word_cache import cache_palabras
+    respuestas = [datos for _, datos in cache_palabras.elementos()]
+    for nombre, construir, recortar_salida in (("anterior", prompt_anterior, False),
+                                               ("esquema", construir_prompt_palabra, True)):
+        entrada = sum(estimar_tokens(construir(p)) for p in palabras) / len(palabras)
+        if respuestas:
+            salida = sum(
+                estimar_tokens(json.dumps(recortar(dict(d)) if recortar_salida else d, ensure_ascii=False))
+                for d in respuestas
+            ) / len(respuestas)
+            print(f"{nombre:>10} {entrada:>9.0f} {salida:>9.0f} {'-':>10}")
+        else:
+            print(f"{nombre:>10} {entrada:>9.0f} {'-':>9} {'-':>10}")
+    entrada = sum(estimar_tokens(prompt_campo(p)) for p in palabras) / len(palabras)
+    print(f"{'campo':>10} {entrada:>9.0f} {'-':>9} {'-':>10}")
+    if respuestas:
+        print(f"ℹ️ Salida estimada sobre {len(respuestas)} respuestas de la cache; con el esquema es una cota superior")
+
+
+if __name__ == "__main__":
+    main()
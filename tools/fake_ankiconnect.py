@@ -0,0 +1,300 @@
+# tools/fake_ankiconnect.py
+"""
+Sustituto local de AnkiConnect para pruebas de carga, benchmarks y reproducción.
+
+Mantiene una colección en memoria y atiende las acciones que usa el bot.
+Entiende un subconjunto de la sintaxis de búsqueda de Anki: deck:, campo:valor,
+términos sueltos, comillas, comodines (* y _), escapes con \\, OR, paréntesis y '-'.
+
+Uso: python tools/fake_ankiconnect.py [--puerto 8765] [--notas 10000] [--latencia 0.0]
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MODELOS = {
+    "Basic": ["Front", "Back"],
+    "Basic (and reversed card)": ["Front", "Back"],
+}
+DECKS = ["Default", "0 USA::STEP 1", "0 USA::Self-Learning"]
+
+
+# --- Búsqueda -------------------------------------------------------------
+
+def _tokenizar(query):
+    tokens, i = [], 0
+    while i < len(query):
+        c = query[i]
+        if c.isspace():
+            i += 1
+        elif c in "()":
+            tokens.append(c)
+            i += 1
+        else:
+            # Un término puede mezclar partes entre comillas y sin comillas (deck:"X")
+            termino, en_comillas = "", False
+            while i < len(query):
+                c = query[i]
+                if c == "\\" and i + 1 < len(query):
+                    termino += query[i:i + 2]
+                    i += 2
+                    continue
+                if c == '"':
+                    en_comillas = not en_comillas
+                    i += 1
+                    continue
+                if not en_comillas and (c.isspace() or c in "()"):
+                    break
+                termino += c
+                i += 1
+            tokens.append(("termino", termino))
+    return tokens
+
+
+def _patron(valor, completo):
+    """Convierte un valor de búsqueda de Anki en una expresión regular"""
+    patron, i = "", 0
+    while i < len(valor):
+        c = valor[i]
+        if c == "\\" and i + 1 < len(valor):
+            patron += re.escape(valor[i + 1])
+            i += 2
+            continue
+        patron += ".*" if c == "*" else "." if c == "_" else re.escape(c)
+        i += 1
+    if completo:
+        patron = f"^{patron}$"
+    return re.compile(patron, re.IGNORECASE | re.DOTALL)
+
+
+def _separar_campo(termino):
+    """Separa 'campo:valor' respetando los ':' escapados"""
+    i = 0
+    while i < len(termino):
+        if termino[i] == "\\":
+            i += 2
+            continue
+        if termino[i] == ":":
+            return termino[:i], termino[i + 1:]
+        i += 1
+    return None, termino
+
+
+def _predicado(termino):
+    negado = termino.startswith("-")
+    if negado:
+        termino = termino[1:]
+    campo, valor = _separar_campo(termino)
+    if campo is not None and campo.lower() == "deck":
+        patron = _patron(valor, completo=True)
+        patron_hijos = _patron(valor + "::*", completo=True)
+        def pred(nota):
+            return bool(patron.match(nota["deck"]) or patron_hijos.match(nota["deck"]))
+    elif campo is not None and campo.lower() == "tag":
+        patron = _patron(valor, completo=True)
+        def pred(nota):
+            return any(patron.match(tag) for tag in nota["tags"])
+    elif campo is not None:
+        patron = _patron(valor, completo=True)
+        campo = campo.lower()
+        def pred(nota):
+            for nombre, contenido in nota["fields"].items():
+                if nombre.lower() == campo:
+                    return bool(patron.match(contenido))
+            return False
+    else:
+        patron = _patron(valor, completo=False)
+        def pred(nota):
+            return any(patron.search(contenido) for contenido in nota["fields"].values())
+    return (lambda nota: not pred(nota)) if negado else pred
+
+
+def compilar_busqueda(query):
+    """Compila una búsqueda de Anki en una función nota -> bool"""
+    tokens = _tokenizar(query)
+    posicion = 0
+
+    def expresion():
+        nonlocal posicion
+        alternativas = [conjuncion()]
+        while posicion < len(tokens) and tokens[posicion] == ("termino", "OR"):
+            posicion += 1
+            alternativas.append(conjuncion())
+        return lambda nota: any(p(nota) for p in alternativas)
+
+    def conjuncion():
+        nonlocal posicion
+        partes = []
+        while posicion < len(tokens) and tokens[posicion] != ")" and tokens[posicion] != ("termino", "OR"):
+            token = tokens[posicion]
+            posicion += 1
+            if token == "(":
+                partes.append(expresion())
+                posicion += 1  # ")"
+            elif token[1] != "AND":
+                partes.append(_predicado(token[1]))
+        return lambda nota: all(p(nota) for p in partes)
+
+    return expresion()
+
+
+# --- Colección ------------------------------------------------------------
+
+class ColeccionFalsa:
+    """Colección de Anki en memoria"""
+
+    def __init__(self, latencia=0.0):
+        self.latencia = latencia
+        self.notas = {}
+        self.media = {}
+        self.decks = list(DECKS)
+        self.llamadas = {}
+        self._fronts = set()
+        self._siguiente_id = 1_600_000_000_000
+        self._lock = threading.Lock()
+
+    def agregar(self, deck, modelo, campos, tags=()):
+        with self._lock:
+            clave = (deck, campos.get("Front"))
+            if clave in self._fronts:
+                return None
+            self._fronts.add(clave)
+            self._siguiente_id += 1
+            self.notas[self._siguiente_id] = {
+                "noteId": self._siguiente_id,
+                "deck": deck,
+                "modelName": modelo,
+                "fields": dict(campos),
+                "tags": list(tags),
+                "mod": int(time.time()),
+            }
+            if deck not in self.decks:
+                self.decks.append(deck)
+            return self._siguiente_id
+
+    def poblar_sintetica(self, cantidad, semilla=0):
+        """Genera notas sintéticas con el formato del bot (Front: palabra (pron))"""
+        aleatorio = random.Random(semilla)
+        letras = "abcdefghijklmnopqrstuvwxyz"
+        for i in range(cantidad):
+            palabra = "".join(aleatorio.choice(letras) for _ in range(aleatorio.randint(3, 9)))
+            otra = "".join(aleatorio.choice(letras) for _ in range(aleatorio.randint(3, 9)))
+            self.agregar(
+                aleatorio.choice(DECKS[1:]),
+                "Basic",
+                {
+                    "Front": f"{palabra} (/{palabra[:3]}/)",
+                    "Back": f"• significado {i}<br><br>💬 <i>The {otra} was near the {palabra}.</i>"
+                            f"<br>🏥 <i>The patient had {otra}.</i>",
+                },
+                ["synthetic"],
+            )
+
+    def _info(self, note_id):
+        nota = self.notas.get(note_id)
+        if nota is None:
+            return {}
+        campos = {nombre: {"value": valor, "order": orden}
+                  for orden, (nombre, valor) in enumerate(nota["fields"].items())}
+        return {"noteId": note_id, "modelName": nota["modelName"], "tags": nota["tags"],
+                "fields": campos, "mod": nota["mod"], "cards": [note_id]}
+
+    def ejecutar(self, accion, params):
+        """Ejecuta una acción de AnkiConnect y devuelve (resultado, error)"""
+        self.llamadas[accion] = self.llamadas.get(accion, 0) + 1
+        if self.latencia:
+            time.sleep(self.latencia)
+
+        if accion == "version":
+            return 6, None
+        if accion == "multi":
+            return [
+                dict(zip(("result", "error"), self.ejecutar(a["action"], a.get("params", {}))))
+                for a in params["actions"]
+            ], None
+        if accion == "findNotes":
+            predicado = compilar_busqueda(params["query"])
+            return [note_id for note_id, nota in list(self.notas.items()) if predicado(nota)], None
+        if accion == "notesInfo":
+            return [self._info(note_id) for note_id in params["notes"]], None
+        if accion == "addNote":
+            nota = params["note"]
+            note_id = self.agregar(nota["deckName"], nota["modelName"], nota["fields"], nota.get("tags", []))
+            if note_id is None:
+                return None, "cannot create note because it is a duplicate"
+            return note_id, None
+        if accion == "addNotes":
+            return [self.agregar(n["deckName"], n["modelName"], n["fields"], n.get("tags", []))
+                    for n in params["notes"]], None
+        if accion == "updateNoteFields":
+            nota = self.notas.get(params["note"]["id"])
+            if nota is None:
+                return None, "Note was not found"
+            nota["fields"].update(params["note"]["fields"])
+            nota["mod"] = int(time.time())
+            return None, None
+        if accion == "deckNames":
+            return list(self.decks), None
+        if accion == "modelNames":
+            return list(MODELOS), None
+        if accion == "modelFieldNames":
+            return MODELOS.get(params["modelName"]), None
+        if accion == "storeMediaFile":
+            self.media[params["filename"]] = params.get("data", "")
+            return params["filename"], None
+        if accion == "getMediaFilesNames":
+            patron = _patron(params.get("pattern", "*"), completo=True)
+            return [nombre for nombre in self.media if patron.match(nombre)], None
+        return None, f"unsupported action: {accion}"
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    coleccion = None
+
+    def do_POST(self):
+        cuerpo = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        peticion = json.loads(cuerpo)
+        resultado, error = self.coleccion.ejecutar(peticion["action"], peticion.get("params", {}))
+        respuesta = json.dumps({"result": resultado, "error": error}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(respuesta)))
+        self.end_headers()
+        self.wfile.write(respuesta)
+
+    def log_message(self, *args):
+        pass
+
+
+def iniciar_servidor(coleccion, puerto=0):
+    """Arranca el servidor en un hilo y devuelve (servidor, url)"""
+    manejador = type("Manejador", (_Manejador,), {"coleccion": coleccion})
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AnkiConnect falso en memoria")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--notas", type=int, default=0, help="notas sintéticas a generar")
+    parser.add_argument("--latencia", type=float, default=0.0, help="segundos por llamada")
+    args = parser.parse_args()
+
+    coleccion = ColeccionFalsa(latencia=args.latencia)
+    coleccion.poblar_sintetica(args.notas)
+    servidor, url = iniciar_servidor(coleccion, args.puerto)
+    print(f"🧪 AnkiConnect falso en {url} con {len(coleccion.notas)} notas")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+# tools/fake_telegram.py
+"""
+Sustituto local de la Bot API de Telegram.
+
+ApiTelegramFalsa guarda el estado (mensajes enviados, botones, updates pendientes)
+y responde a los métodos que usa el bot. SolicitudLocal la conecta directamente a
+python-telegram-bot como `request`, sin red; iniciar_servidor la sirve por HTTP
+(con long polling en getUpdates) para usarla como `base_url` de la aplicación real.
+"""
+import json
+import time
+import email
+import threading
+from collections import deque
+from urllib.parse import parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram.request import BaseRequest
+
+BOT_ID = 1
+BOT_USERNAME = "anki_test_bot"
+
+
+class ApiTelegramFalsa:
+    """Estado en memoria de la Bot API"""
+
+    def __init__(self, max_mensajes=None):
+        self.mensajes = {}
+        # Con max_mensajes se olvidan los mensajes más antiguos (pruebas largas)
+        self.max_mensajes = max_mensajes
+        # Contenido de los documentos enviados, por (chat_id, message_id)
+        self.documentos = {}
+        self.llamadas = {}
+        self.updates_pendientes = deque()
+        self.observadores = []
+        self._siguiente_mensaje = 1
+        self._siguiente_update = 1
+        self._lock = threading.Lock()
+        self._hay_updates = threading.Condition(self._lock)
+
+    # --- Updates entrantes -------------------------------------------------
+
+    def encolar_update(self, datos):
+        """Encola un Update (dict) para getUpdates y devuelve su update_id"""
+        with self._lock:
+            datos = dict(datos, update_id=self._siguiente_update)
+            self._siguiente_update += 1
+            self.updates_pendientes.append(datos)
+            self._hay_updates.notify_all()
+            return datos["update_id"]
+
+    def esperar_updates(self, offset, timeout):
+        """Long polling: espera hasta que haya algún Update con id >= offset o pasen `timeout` segundos"""
+        with self._hay_updates:
+            self._hay_updates.wait_for(
+                lambda: self.updates_pendientes and self.updates_pendientes[-1]["update_id"] >= offset,
+                timeout
+            )
+
+    def _usuario(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+    def update_texto(self, user_id, texto):
+        """Construye un Update de mensaje de texto (los comandos llevan su entidad)"""
+        with self._lock:
+            message_id = self._siguiente_mensaje
+            self._siguiente_mensaje += 1
+        mensaje = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._usuario(user_id),
+            "text": texto,
+        }
+        if texto.startswith("/"):
+            mensaje["entities"] = [{"type": "bot_command", "offset": 0, "length": len(texto.split()[0])}]
+        return {"message": mensaje}
+
+    def update_boton(self, user_id, mensaje, callback_data):
+        """Construye un Update de pulsación de botón sobre un mensaje enviado por el bot"""
+        return {
+            "callback_query": {
+                "id": str(time.monotonic_ns()),
+                "from": self._usuario(user_id),
+                "chat_instance": str(user_id),
+                "message": mensaje,
+                "data": callback_data,
+            }
+        }
+
+    # --- Métodos de la API ---------------------------------------------------
+
+    def _nuevo_mensaje(self, params):
+        with self._lock:
+            message_id = self._siguiente_mensaje
+            self._siguiente_mensaje += 1
+        chat_id = int(params["chat_id"])
+        mensaje = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "Bot", "username": BOT_USERNAME},
+            "text": params.get("text", ""),
+        }
+        if params.get("reply_markup"):
+            mensaje["reply_markup"] = params["reply_markup"]
+        if "documento" in params:
+            nombre, contenido = params["documento"]
+            mensaje["document"] = {"file_id": f"doc{message_id}", "file_unique_id": f"doc{message_id}",
+                                   "file_name": nombre}
+            mensaje["caption"] = params.get("caption", "")
+            self.documentos[(chat_id, message_id)] = contenido
+        with self._lock:
+            self.mensajes[(chat_id, message_id)] = mensaje
+            if self.max_mensajes and len(self.mensajes) > self.max_mensajes:
+                self.mensajes.pop(next(iter(self.mensajes)))
+        return mensaje
+
+    def responder(self, metodo, params):
+        """Devuelve el `result` de un método de la Bot API"""
+        self.llamadas[metodo] = self.llamadas.get(metodo, 0) + 1
+
+        if metodo == "getMe":
+            resultado = {"id": BOT_ID, "is_bot": True, "first_name": "Bot", "username": BOT_USERNAME,
+                         "can_join_groups": False, "can_read_all_group_messages": False,
+                         "supports_inline_queries": True}
+        elif metodo == "getUpdates":
+            offset = int(params.get("offset") or 0)
+            with self._lock:
+                while self.updates_pendientes and self.updates_pendientes[0]["update_id"] < offset:
+                    self.updates_pendientes.popleft()
+                resultado = list(self.updates_pendientes)[:int(params.get("limit") or 100)]
+        elif metodo in ("sendMessage", "sendDocument"):
+            resultado = self._nuevo_mensaje(params)
+        elif metodo in ("editMessageText", "editMessageReplyMarkup"):
+            clave = (int(params["chat_id"]), int(params["message_id"])) if "chat_id" in params else None
+            mensaje = self.mensajes.get(clave) if clave else None
+            if mensaje is None:
+                resultado = True
+            else:
+                if metodo == "editMessageText":
+                    mensaje["text"] = params.get("text", "")
+                if params.get("reply_markup"):
+                    mensaje["reply_markup"] = params["reply_markup"]
+                else:
+                    mensaje.pop("reply_markup", None)
+                resultado = mensaje
+        else:
+            # answerCallbackQuery, answerInlineQuery, deleteWebhook, ...
+            resultado = True
+
+        for observador in self.observadores:
+            observador(metodo, params, resultado)
+        return resultado
+
+
+class SolicitudLocal(BaseRequest):
+    """`request` de python-telegram-bot que responde desde ApiTelegramFalsa sin red"""
+
+    def __init__(self, api=None):
+        self.api = api or ApiTelegramFalsa()
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        metodo = url.rsplit("/", 1)[-1]
+        params = {}
+        if request_data is not None:
+            params = {clave: valor for clave, valor in request_data.parameters.items()
+                      if isinstance(valor, (str, int, float, bool, list, dict, type(None)))}
+            if params.get("reply_markup") and isinstance(params["reply_markup"], str):
+                params["reply_markup"] = json.loads(params["reply_markup"])
+            if request_data.contains_files:
+                # sendDocument: se guarda el primer archivo (nombre, bytes)
+                nombre, contenido, _ = next(iter(request_data.multipart_data.values()))
+                params["documento"] = (nombre, contenido)
+        resultado = self.api.responder(metodo, params)
+        return 200, json.dumps({"ok": True, "result": resultado}).encode("utf-8")
+
+
+def _leer_parametros(tipo, cuerpo):
+    """Parámetros de una petición de python-telegram-bot (formulario, multipart o JSON)"""
+    if tipo.startswith("application/json"):
+        params = json.loads(cuerpo or b"{}")
+    elif tipo.startswith("multipart/form-data"):
+        params = {}
+        partes = email.message_from_bytes(f"Content-Type: {tipo}\r\n\r\n".encode() + cuerpo)
+        for parte in partes.get_payload():
+            contenido = parte.get_payload(decode=True)
+            if parte.get_filename():
+                params["documento"] = (parte.get_filename(), contenido)
+            else:
+                params[parte.get_param("name", header="content-disposition")] = contenido.decode("utf-8")
+    else:
+        params = dict(parse_qsl(cuerpo.decode("utf-8")))
+    if params.get("reply_markup") and isinstance(params["reply_markup"], str):
+        params["reply_markup"] = json.loads(params["reply_markup"])
+    return params
+
+
+class _ManejadorHttp(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    api = None
+
+    def do_POST(self):
+        metodo = self.path.rsplit("/", 1)[-1]
+        cuerpo = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        params = _leer_parametros(self.headers.get("Content-Type", ""), cuerpo)
+        if metodo == "getUpdates" and params.get("timeout"):
+            self.api.esperar_updates(int(params.get("offset") or 0), float(params["timeout"]))
+        resultado = self.api.responder(metodo, params)
+        respuesta = json.dumps({"ok": True, "result": resultado}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(respuesta)))
+        self.end_headers()
+        self.wfile.write(respuesta)
+
+    def log_message(self, *args):
+        pass
+
+
+def iniciar_servidor(api=None, puerto=0):
+    """
+    Sirve la API falsa por HTTP en un hilo y devuelve (servidor, base_url).
+    base_url va en construir_aplicacion(..., base_url=base_url).
+    """
+    manejador = type("ManejadorHttp", (_ManejadorHttp,), {"api": api or ApiTelegramFalsa()})
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}/bot"
@@ -0,0 +1,179 @@
+# tools/replay.py
+"""
+Reproduce sin conexión el tráfico grabado con RECORD_TRAFFIC=1.
+
+Cada Update grabado se vuelve a pasar por la aplicación real de bot.py
+(handle_text_message, handle_button, ...) contra sustitutos locales:
+- Telegram: tools/fake_telegram.py (sin red)
+- AnkiConnect: tools/fake_ankiconnect.py con la latencia media grabada
+- IA: llm_backends.BackendFalso, que tarda lo mismo que la llamada grabada para ese Update
+
+Uso: python tools/replay.py traffic.jsonl [traffic.jsonl.1 ...] [--velocidad 10] [--notas 5000]
+     --velocidad 1 reproduce a tiempo real, 10 diez veces más rápido y 0 sin esperas.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+DIRECTORIO_RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORIO_RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_ankiconnect import ColeccionFalsa, iniciar_servidor
+from fake_telegram import SolicitudLocal
+
+DURACION_IA_POR_DEFECTO = 2.0
+
+
+def leer_grabaciones(rutas):
+    """Devuelve (updates, llamadas, acciones) ordenados por tiempo"""
+    updates, llamadas, acciones = [], [], []
+    for ruta in rutas:
+        with open(ruta, "r", encoding="utf-8") as f:
+            for linea in f:
+                if not linea.strip():
+                    continue
+                registro = json.loads(linea)
+                {"update": updates, "llamada": llamadas, "accion": acciones}[registro["tipo"]].append(registro)
+    updates.sort(key=lambda r: r["t"])
+    return updates, llamadas, acciones
+
+
+def usuarios_de(updates):
+    ids = set()
+    for registro in updates:
+        for clave in ("message", "callback_query", "inline_query"):
+            contenido = registro["update"].get(clave)
+            if contenido and "from" in contenido:
+                ids.add(contenido["from"]["id"])
+    return ids
+
+
+def latencia_grabada(duraciones):
+    """Latencia para BackendFalso: la duración grabada de la llamada a la IA del Update en curso"""
+    from recorder import update_actual
+
+    def latencia():
+        pendientes = duraciones.get(update_actual()) or [DURACION_IA_POR_DEFECTO]
+        return pendientes.pop(0) if len(pendientes) > 1 else pendientes[0]
+    return latencia
+
+
+async def reproducir(args):
+    updates, llamadas, acciones = leer_grabaciones(args.grabaciones)
+    if not updates:
+        print("No hay updates grabados")
+        return
+
+    duraciones_ia = {}
+    duraciones_anki = []
+    for llamada in llamadas:
+        if llamada["servicio"] == "ia":
+            duraciones_ia.setdefault(llamada["update_id"], []).append(llamada["duracion"])
+        else:
+            duraciones_anki.append(llamada["duracion"])
+
+    # Sustitutos locales y estado aislado en un directorio temporal
+    coleccion = ColeccionFalsa(latencia=statistics.mean(duraciones_anki) if duraciones_anki else 0.0)
+    coleccion.poblar_sintetica(args.notas)
+    servidor, url = iniciar_servidor(coleccion)
+    temporal = tempfile.mkdtemp(prefix="replay_")
+    os.environ.update({
+        "ANKICONNECT_URL": url,
+        "GOOGLE_API_KEY": os.getenv("GOOGLE_API_KEY", "replay"),
+        "RECORD_TRAFFIC": "0",
+        "WORD_CACHE_PATH": os.path.join(temporal, "word_cache.json"),
+        "WORD_CACHE_PACK": "",
+        "NOTE_SIDECAR_PATH": os.path.join(temporal, "note_sidecar.db"),
+        "QUOTA_STATE_PATH": os.path.join(temporal, "quota_state.json"),
+        "LLM_BACKEND": "falso",
+    })
+
+    import anki_functions
+    import bot
+    from llm_backends import BackendFalso
+    from callback_registry import registro_callbacks, AccionBoton
+    from telegram import Update
+
+    anki_functions.backend_ia = BackendFalso(latencia=latencia_grabada(duraciones_ia))
+    bot.ALLOWED_USER_IDS[:] = sorted(usuarios_de(updates))
+    for accion in acciones:
+        registro_callbacks.restaurar(accion["callback_data"], AccionBoton(accion["nombre"], accion["argumento"]))
+
+    solicitud = SolicitudLocal()
+    errores = []
+    solicitud.api.observadores.append(
+        lambda metodo, params, resultado: errores.append(params)
+        if "error inesperado" in str(params.get("text", "")) else None
+    )
+
+    aplicacion = bot.construir_aplicacion("1:replay", request=solicitud, post_init_callback=None)
+    latencias = []
+
+    # La latencia se mide alrededor del procesador de Updates y no con handlers de
+    # primer y último grupo: un Update cancelado (OperacionCancelada, CancelledError),
+    # con plazo vencido o descartado por contrapresión nunca llega al último grupo
+    procesador = aplicacion.update_processor
+    procesar = procesador.do_process_update
+
+    async def procesar_midiendo(update, coroutine):
+        inicio = time.perf_counter()
+        try:
+            await procesar(update, coroutine)
+        finally:
+            latencias.append(time.perf_counter() - inicio)
+
+    procesador.do_process_update = procesar_midiendo
+
+    await aplicacion.initialize()
+    await aplicacion.start()
+
+    t0_grabacion, t0 = updates[0]["t"], time.perf_counter()
+    for registro in updates:
+        if args.velocidad > 0:
+            espera = (registro["t"] - t0_grabacion) / args.velocidad - (time.perf_counter() - t0)
+            if espera > 0:
+                await asyncio.sleep(espera)
+        await aplicacion.update_queue.put(Update.de_json(registro["update"], aplicacion.bot))
+
+    # Esperar a que terminen todos, con un plazo por si alguno se queda colgado
+    limite = time.perf_counter() + args.plazo
+    while len(latencias) < len(updates) and time.perf_counter() < limite:
+        await asyncio.sleep(0.05)
+    duracion = time.perf_counter() - t0
+    sin_terminar = len(updates) - len(latencias)
+
+    await aplicacion.stop()
+    await aplicacion.shutdown()
+    servidor.shutdown()
+
+    latencias.sort()
+    print(f"▶️ {len(updates)} updates reproducidos en {duracion:.1f}s (velocidad x{args.velocidad or '∞'})")
+    if latencias:
+        print(f"⏱️ Latencia por update: p50={latencias[len(latencias) // 2] * 1000:.0f} ms, "
+              f"p95={latencias[int(len(latencias) * 0.95)] * 1000:.0f} ms, "
+              f"máx={latencias[-1] * 1000:.0f} ms")
+    if sin_terminar:
+        print(f"⌛ {sin_terminar} updates sin terminar tras {args.plazo:.0f}s de espera")
+    print(f"❌ Errores: {len(errores)}")
+    print(f"📡 Llamadas a Telegram: {solicitud.api.llamadas}")
+    print(f"📚 Llamadas a AnkiConnect: {coleccion.llamadas}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reproduce tráfico grabado del bot")
+    parser.add_argument("grabaciones", nargs="+", help="archivos traffic.jsonl(.N)")
+    parser.add_argument("--velocidad", type=float, default=1.0)
+    parser.add_argument("--notas", type=int, default=0, help="notas sintéticas en el AnkiConnect falso")
+    parser.add_argument("--plazo", type=float, default=300,
+                        help="segundos máximos de espera a los updates pendientes al terminar de enviarlos")
+    asyncio.run(reproducir(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,659 @@
+# tools/soak.py
+"""
+Prueba de resistencia (soak) del bot con cientos de usuarios simulados durante horas.
+
+La aplicación real de bot.py hace long polling (getUpdates) por HTTP contra sustitutos locales:
+- Telegram: tools/fake_telegram.py servido por HTTP en este proceso
+- AnkiConnect: tools/fake_ankiconnect.py en un proceso aparte, para que las notas
+  que se van creando no cuenten en la memoria del bot
+- IA: llm_backends.BackendFalso con latencia y tasa de error configurables
+
+Cada usuario simulado repite sesiones realistas pulsando los botones que le envía el bot:
+crear una tarjeta (a veces pidiendo ➕ Más), editar un campo a mano, regenerarlo con IA,
+cancelar, interrumpir una búsqueda, abandonar el borrador, editar una nota existente,
+minar un párrafo y consultar /stats.
+
+Cada --intervalo segundos se muestrea la memoria del proceso (RSS), las sesiones (número y
+bytes), user_data/chat_data de la aplicación, los tokens de botones, la cache de palabras,
+el retraso del bucle de eventos, el tiempo de respuesta y los errores. La serie se guarda en
+CSV y al final se calcula la tendencia por hora de cada métrica: una memoria que crece sin
+parar es una fuga y un tiempo de respuesta que sube, una degradación.
+
+Uso: python tools/soak.py [--usuarios 300] [--duracion 4h] [--csv soak.csv]
+Sale con código 1 si detecta crecimiento de memoria, degradación o errores inesperados.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import random
+import socket
+import asyncio
+import logging
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+from datetime import datetime
+
+DIRECTORIO_RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIRECTORIO_TOOLS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, DIRECTORIO_RAIZ)
+sys.path.insert(0, DIRECTORIO_TOOLS)
+
+from fake_ankiconnect import ColeccionFalsa
+from fake_telegram import ApiTelegramFalsa, iniciar_servidor
+
+# Primer user_id de los usuarios simulados
+PRIMER_USUARIO = 100_000
+# Segundos que un usuario espera la respuesta del bot antes de darla por perdida
+PLAZO_RESPUESTA = 60
+# Mensajes que recuerda la API falsa (el resto se olvida para no inflar la memoria)
+MAX_MENSAJES_API = 2_000
+# Intervalo del latido que mide el retraso del bucle de eventos (segundos)
+INTERVALO_LATIDO = 0.1
+# Segundos estables (tras el calentamiento) necesarios para juzgar el crecimiento de memoria
+VENTANA_MINIMA_MEMORIA = 15 * 60
+
+# Sesiones que repiten los usuarios y su peso relativo
+ESCENARIOS = {
+    "crear": 30,
+    "editar": 12,
+    "regenerar": 10,
+    "cancelar": 12,
+    "interrumpir": 10,
+    "abandonar": 8,
+    "existente": 8,
+    "minar": 6,
+    "stats": 4,
+}
+
+SILABAS = ["ka", "lo", "mir", "zen", "tra", "vol", "pex", "dru", "sil", "qua", "nor", "bel", "fis", "gor"]
+
+
+def leer_duracion(texto):
+    """'90', '90s', '30m' o '4h' -> segundos"""
+    unidades = {"s": 1, "m": 60, "h": 3600}
+    if texto[-1] in unidades:
+        return float(texto[:-1]) * unidades[texto[-1]]
+    return float(texto)
+
+
+def memoria_rss_mb():
+    """Memoria residente actual del proceso en MB (None si no se puede medir)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Sin /proc solo se conoce el máximo (KB en Linux, bytes en macOS)
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maximo / 2**20 if sys.platform == "darwin" else maximo / 1024
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+def pendiente_por_hora(puntos):
+    """Pendiente (por hora) de la recta de mínimos cuadrados de [(segundos, valor)]"""
+    if len(puntos) < 2:
+        return 0.0
+    media_t = sum(t for t, _ in puntos) / len(puntos)
+    media_v = sum(v for _, v in puntos) / len(puntos)
+    varianza = sum((t - media_t) ** 2 for t, _ in puntos)
+    if varianza == 0:
+        return 0.0
+    return 3600 * sum((t - media_t) * (v - media_v) for t, v in puntos) / varianza
+
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def iniciar_ankiconnect(notas, latencia):
+    """Arranca tools/fake_ankiconnect.py en otro proceso y espera a que responda"""
+    puerto = puerto_libre()
+    proceso = subprocess.Popen(
+        [sys.executable, os.path.join(DIRECTORIO_TOOLS, "fake_ankiconnect.py"),
+         "--puerto", str(puerto), "--notas", str(notas), "--latencia", str(latencia)],
+        stdout=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{puerto}"
+    peticion = json.dumps({"action": "version", "version": 6}).encode("utf-8")
+    for _ in range(300):
+        try:
+            urllib.request.urlopen(url, peticion, timeout=1).read()
+            return proceso, url
+        except OSError:
+            if proceso.poll() is not None:
+                raise RuntimeError("El AnkiConnect falso no pudo arrancar")
+            time.sleep(0.1)
+    proceso.kill()
+    raise RuntimeError("El AnkiConnect falso no responde")
+
+
+def palabras_existentes(notas):
+    """Palabras de las notas sintéticas (poblar_sintetica es determinista)"""
+    coleccion = ColeccionFalsa()
+    coleccion.poblar_sintetica(notas)
+    return [nota["fields"]["Front"].split(" (")[0] for nota in coleccion.notas.values()]
+
+
+def botones(mensaje):
+    return [boton for fila in (mensaje.get("reply_markup") or {}).get("inline_keyboard", []) for boton in fila]
+
+
+class Metricas:
+    """Contadores de la prueba; se leen y reinician por ventana en cada muestra"""
+
+    def __init__(self):
+        self.acciones = 0
+        self.sesiones_ok = 0
+        self.sesiones_fallidas = 0
+        self.sin_respuesta = 0
+        self.errores_bot = 0
+        self.errores_log = 0
+        self.por_escenario = {nombre: [0, 0] for nombre in ESCENARIOS}
+        self.respuestas = []
+        self.retrasos = []
+
+    def ventana(self):
+        """Devuelve y vacía las listas de la ventana actual"""
+        respuestas, retrasos = self.respuestas, self.retrasos
+        self.respuestas, self.retrasos = [], []
+        return respuestas, retrasos
+
+
+class ContadorErrores(logging.Handler):
+    """Cuenta los registros de log de nivel ERROR o superior"""
+
+    def __init__(self, metricas):
+        super().__init__(logging.ERROR)
+        self.metricas = metricas
+
+    def emit(self, record):
+        self.metricas.errores_log += 1
+
+
+class SinRespuesta(Exception):
+    """El bot no contestó a tiempo lo que el usuario esperaba"""
+
+
+class SesionFallida(Exception):
+    """El bot contestó con un error (p. ej. uno inyectado en la IA falsa) o sin el botón esperado"""
+
+
+class UsuarioSimulado:
+    """Un usuario de Telegram que repite sesiones leyendo los mensajes y botones del bot"""
+
+    def __init__(self, user_id, api, metricas, aleatorio, args, existentes, general):
+        self.user_id = user_id
+        self.api = api
+        self.metricas = metricas
+        self.aleatorio = aleatorio
+        self.args = args
+        self.existentes = existentes
+        self.general = general
+        self.bandeja = asyncio.Queue()
+        self.inventadas = 0
+
+    # --- Interacción -------------------------------------------------------
+
+    async def pensar(self, factor=1.0):
+        await asyncio.sleep(self.aleatorio.expovariate(1 / (self.args.pausa * factor)))
+
+    def enviar(self, texto):
+        self.vaciar()
+        self.metricas.acciones += 1
+        self._enviado = time.perf_counter()
+        self.api.encolar_update(self.api.update_texto(self.user_id, texto))
+
+    def pulsar(self, mensaje, etiqueta, al_azar=False):
+        """
+        Pulsa el primer botón del mensaje cuya etiqueta empieza por `etiqueta`
+        (o uno cualquiera de ellos con al_azar, p. ej. un deck)
+        """
+        candidatos = [b for b in botones(mensaje) if b["text"].startswith(etiqueta)]
+        if not candidatos:
+            raise SesionFallida()
+        boton = self.aleatorio.choice(candidatos) if al_azar else candidatos[0]
+        self.vaciar()
+        self.metricas.acciones += 1
+        self._enviado = time.perf_counter()
+        self.api.encolar_update(self.api.update_boton(self.user_id, mensaje, boton["callback_data"]))
+
+    def vaciar(self):
+        while not self.bandeja.empty():
+            self.bandeja.get_nowait()
+
+    async def esperar(self, condicion):
+        """
+        Espera un mensaje del bot (nuevo o editado) que cumpla `condicion`.
+        Lanza SinRespuesta si no llega en PLAZO_RESPUESTA segundos y SesionFallida
+        si antes llega un mensaje de error (cualquiera que empiece por ❌ y no sea el
+        esperado, p. ej. "❌ No se pudo regenerar…" por los errores inyectados en la IA).
+        """
+        limite = time.monotonic() + PLAZO_RESPUESTA
+        while True:
+            try:
+                mensaje = await asyncio.wait_for(self.bandeja.get(), limite - time.monotonic())
+            except (TimeoutError, ValueError):
+                raise SinRespuesta() from None
+            if condicion(mensaje):
+                self.metricas.respuestas.append(time.perf_counter() - self._enviado)
+                return mensaje
+            if mensaje.get("text", "").startswith("❌"):
+                raise SesionFallida()
+
+    async def esperar_boton(self, *etiquetas):
+        return await self.esperar(
+            lambda m: any(b["text"].startswith(etiquetas) for b in botones(m))
+        )
+
+    async def esperar_texto(self, *fragmentos):
+        return await self.esperar(lambda m: any(f in m.get("text", "") for f in fragmentos))
+
+    # --- Palabras ----------------------------------------------------------
+
+    def palabra_inventada(self):
+        """Palabra que nadie ha buscado aún: el número (usuario, contador) escrito en sílabas"""
+        self.inventadas += 1
+        numero = self.user_id * 100_000 + self.inventadas
+        silabas = []
+        while numero:
+            numero, resto = divmod(numero, len(SILABAS))
+            silabas.append(SILABAS[resto])
+        return "".join(silabas)
+
+    def palabra_buscada(self):
+        """Palabra de las listas de frecuencia (a menudo ya en cache) o inventada (nunca en cache)"""
+        if self.aleatorio.random() < self.args.nuevas:
+            return self.palabra_inventada()
+        return self.aleatorio.choice(self.general)
+
+    def parrafo(self):
+        inventadas = [self.palabra_inventada() + "ation" for _ in range(2)]
+        return (f"The {inventadas[0]} of the patient was reviewed, and the team "
+                f"discussed the {inventadas[1]} before the next visit.")
+
+    # --- Sesiones ----------------------------------------------------------
+
+    async def buscar(self, palabra):
+        """Envía una palabra y devuelve su borrador"""
+        self.enviar(palabra)
+        mensaje = await self.esperar_boton("✅ Crear tarjeta", "✏️ Editar #")
+        if any(b["text"].startswith("✏️ Editar #") for b in botones(mensaje)):
+            # Ya la creó otro usuario: cancelar y buscar una palabra que seguro es nueva
+            await self.pensar()
+            self.pulsar(mensaje, "❌ Cancelar")
+            await self.esperar_texto("cancelada")
+            self.enviar(self.palabra_inventada())
+            mensaje = await self.esperar_boton("✅ Crear tarjeta")
+        return mensaje
+
+    async def hasta_vista_previa(self, borrador):
+        if self.aleatorio.random() < 0.3 and any(b["text"].startswith("➕ Más") for b in botones(borrador)):
+            await self.pensar()
+            self.pulsar(borrador, "➕ Más")
+            borrador = await self.esperar_boton("✅ Crear tarjeta")
+        await self.pensar()
+        self.pulsar(borrador, "✅ Crear tarjeta")
+        mensaje = await self.esperar_boton("📝 Básica")
+        await self.pensar(0.5)
+        self.pulsar(mensaje, self.aleatorio.choice(["📝 Básica", "🔄 Reversible"]))
+        mensaje = await self.esperar_boton("📚 ")
+        await self.pensar(0.5)
+        self.pulsar(mensaje, "📚 ", al_azar=True)
+        return await self.esperar_boton("✏️ Editar")
+
+    async def crear(self, vista_previa):
+        await self.pensar()
+        self.pulsar(vista_previa, "✅ Crear tarjeta")
+        mensaje = await self.esperar(lambda m: not m.get("text", "").startswith("⏳"))
+        return not mensaje.get("text", "").startswith("❌")
+
+    async def editar_y_crear(self, menu, regenerar):
+        """En el menú de edición cambia un campo (a mano o con IA), finaliza y guarda"""
+        await self.pensar()
+        if regenerar:
+            filas = [fila for fila in menu["reply_markup"]["inline_keyboard"] if len(fila) > 1
+                     and fila[1]["text"].startswith("🔄")]
+            boton = self.aleatorio.choice(filas)[1]
+            self.vaciar()
+            self.metricas.acciones += 1
+            self._enviado = time.perf_counter()
+            self.api.encolar_update(self.api.update_boton(self.user_id, menu, boton["callback_data"]))
+        else:
+            self.pulsar(menu, "💬 Oración común")
+            await self.esperar_texto("Envía el nuevo valor")
+            await self.pensar(2)
+            self.enviar(f"The nurse checked the chart at {self.aleatorio.randint(1, 12)} o'clock.")
+        menu = await self.esperar_boton("✅ Finalizar edición")
+        await self.pensar()
+        self.pulsar(menu, "✅ Finalizar edición")
+        return await self.crear(await self.esperar_boton("✅ Crear tarjeta"))
+
+    async def sesion(self, escenario):
+        """Ejecuta una sesión; devuelve True si terminó como se esperaba"""
+        if escenario == "stats":
+            self.enviar("/stats")
+            await self.esperar_texto("Estadísticas")
+            return True
+
+        if escenario == "minar":
+            self.enviar(self.parrafo())
+            mensaje = await self.esperar(
+                lambda m: m.get("text", "").startswith("✅ No encontré")
+                or any(b["text"].startswith("☑️ Todas") for b in botones(m))
+            )
+            if not botones(mensaje):
+                return True
+            await self.pensar()
+            self.pulsar(mensaje, "☑️ Todas")
+            mensaje = await self.esperar_boton("📚 ")
+            await self.pensar(0.5)
+            self.pulsar(mensaje, "📚 ", al_azar=True)
+            mensaje = await self.esperar(lambda m: not m.get("text", "").startswith("⏳"))
+            return not mensaje.get("text", "").startswith("❌")
+
+        if escenario == "interrumpir":
+            self.enviar(self.palabra_buscada())
+            buscando = await self.esperar_boton("❌ Cancelar")
+            if self.aleatorio.random() < 0.5:
+                self.pulsar(buscando, "❌ Cancelar")
+                await self.esperar_texto("interrumpida", "cancelada")
+                return True
+            # Otra palabra antes de que termine la primera
+            self.vaciar()
+            return await self.sesion("cancelar")
+
+        if escenario == "existente":
+            self.enviar(self.aleatorio.choice(self.existentes))
+            mensaje = await self.esperar_boton("✏️ Editar #")
+            await self.pensar()
+            self.pulsar(mensaje, "✏️ Editar #", al_azar=True)
+            return await self.editar_y_crear(await self.esperar_boton("✅ Finalizar edición"), regenerar=False)
+
+        # Solo se crean palabras inventadas: dos usuarios creando la misma nota chocarían como duplicada
+        palabra = self.palabra_buscada() if escenario in ("cancelar", "abandonar") else self.palabra_inventada()
+        borrador = await self.buscar(palabra)
+        if escenario == "cancelar":
+            await self.pensar()
+            self.pulsar(borrador, "❌ Cancelar")
+            await self.esperar_texto("cancelada")
+            return True
+        if escenario == "abandonar":
+            # El borrador se queda en la sesión hasta que la desaloje el TTL
+            return True
+
+        vista_previa = await self.hasta_vista_previa(borrador)
+        if escenario == "crear":
+            return await self.crear(vista_previa)
+        await self.pensar()
+        self.pulsar(vista_previa, "✏️ Editar")
+        menu = await self.esperar_boton("✅ Finalizar edición")
+        return await self.editar_y_crear(menu, regenerar=escenario == "regenerar")
+
+    async def ejecutar(self, fin):
+        nombres, pesos = list(ESCENARIOS), list(ESCENARIOS.values())
+        # Arranque escalonado para no empezar todos a la vez
+        await asyncio.sleep(self.aleatorio.uniform(0, self.args.pausa * 3))
+        while time.monotonic() < fin:
+            escenario = self.aleatorio.choices(nombres, pesos)[0]
+            try:
+                ok = await self.sesion(escenario)
+            except SinRespuesta:
+                self.metricas.sin_respuesta += 1
+                ok = False
+            except SesionFallida:
+                ok = False
+            if ok:
+                self.metricas.sesiones_ok += 1
+            else:
+                self.metricas.sesiones_fallidas += 1
+            self.metricas.por_escenario[escenario][0 if ok else 1] += 1
+            await self.pensar(3)
+
+
+async def medir_latido(metricas):
+    while True:
+        esperado = time.perf_counter() + INTERVALO_LATIDO
+        await asyncio.sleep(INTERVALO_LATIDO)
+        metricas.retrasos.append(max(0.0, time.perf_counter() - esperado))
+
+
+def muestra(inicio, metricas, aplicacion, api):
+    """Una fila de la serie temporal"""
+    from session_store import sesiones
+    from callback_registry import registro_callbacks
+    from word_cache import cache_palabras
+    from task_manager import gestor_tareas
+
+    respuestas, retrasos = metricas.ventana()
+    stats_sesiones = sesiones.estadisticas()
+    rss = memoria_rss_mb()
+    return {
+        "segundos": round(time.monotonic() - inicio),
+        "rss_mb": round(rss, 1) if rss is not None else "",
+        "sesiones": stats_sesiones["sesiones"],
+        "sesiones_kb": round(stats_sesiones["bytes"] / 1024, 1),
+        "desalojadas": stats_sesiones["desalojadas_ttl"] + stats_sesiones["desalojadas_memoria"],
+        "user_data": len(aplicacion.user_data),
+        "chat_data": len(aplicacion.chat_data),
+        "tokens_botones": len(registro_callbacks),
+        "cache_palabras": len(cache_palabras),
+        "tareas_en_curso": gestor_tareas.estadisticas()["en_curso"],
+        "updates_en_cola": len(api.updates_pendientes),
+        "lag_p50_ms": round(1000 * percentil(retrasos, 0.5), 1),
+        "lag_p99_ms": round(1000 * percentil(retrasos, 0.99), 1),
+        "lag_max_ms": round(1000 * percentil(retrasos, 1.0), 1),
+        "respuesta_p50_ms": round(1000 * percentil(respuestas, 0.5)),
+        "respuesta_p95_ms": round(1000 * percentil(respuestas, 0.95)),
+        "acciones": metricas.acciones,
+        "sesiones_ok": metricas.sesiones_ok,
+        "sesiones_fallidas": metricas.sesiones_fallidas,
+        "sin_respuesta": metricas.sin_respuesta,
+        "errores_bot": metricas.errores_bot,
+        "errores_log": metricas.errores_log,
+    }
+
+
+def resumir(filas, metricas, args):
+    """Imprime tendencias y veredicto; devuelve los problemas encontrados"""
+    # Se descarta el calentamiento (sesiones y caches llenándose)
+    estables = filas[int(len(filas) * args.calentamiento):]
+    problemas = []
+
+    print("\n📈 Tendencia por hora (tras el calentamiento):")
+    for columna, unidad in (("rss_mb", "MB"), ("sesiones_kb", "KB"), ("user_data", ""),
+                            ("tokens_botones", ""), ("cache_palabras", ""), ("lag_p99_ms", "ms"),
+                            ("respuesta_p95_ms", "ms")):
+        puntos = [(f["segundos"], f[columna]) for f in estables if f[columna] != ""]
+        if puntos:
+            print(f"   {columna:<18} {puntos[-1][1]:>10} {unidad:<3} {pendiente_por_hora(puntos):>+10.1f}/h")
+
+    puntos_rss = [(f["segundos"], f["rss_mb"]) for f in estables if f["rss_mb"] != ""]
+    crecimiento = pendiente_por_hora(puntos_rss)
+    if len(puntos_rss) < 3 or puntos_rss[-1][0] - puntos_rss[0][0] < VENTANA_MINIMA_MEMORIA:
+        print(f"   (menos de {VENTANA_MINIMA_MEMORIA // 60} min estables: no se juzga el crecimiento de memoria)")
+    elif crecimiento > args.max_crecimiento:
+        problemas.append(f"la memoria crece {crecimiento:+.1f} MB/h (máximo {args.max_crecimiento:g})")
+
+    cuarto = max(1, len(estables) // 4)
+    if len(estables) >= 8:
+        antes = percentil([f["respuesta_p95_ms"] for f in estables[:cuarto]], 0.5)
+        despues = percentil([f["respuesta_p95_ms"] for f in estables[-cuarto:]], 0.5)
+        if antes and despues > 2 * antes:
+            problemas.append(f"el p95 de respuesta pasó de {antes:.0f} ms a {despues:.0f} ms")
+
+    total = metricas.sesiones_ok + metricas.sesiones_fallidas
+    print(f"\n🧪 {total} sesiones, {metricas.acciones} acciones de {args.usuarios} usuarios")
+    for nombre, (ok, fallidas) in metricas.por_escenario.items():
+        print(f"   {nombre:<12} {ok:>7} ok {fallidas:>6} fallidas")
+    print(f"⌛ Sin respuesta: {metricas.sin_respuesta}  ❌ Errores inesperados: {metricas.errores_bot}  "
+          f"📋 Errores en el log: {metricas.errores_log}")
+
+    if metricas.errores_bot:
+        problemas.append(f"{metricas.errores_bot} errores inesperados mostrados a usuarios")
+    if total and metricas.sin_respuesta / total > args.max_sin_respuesta:
+        problemas.append(f"{100 * metricas.sin_respuesta / total:.1f}% de sesiones sin respuesta")
+    return problemas
+
+
+async def probar(args):
+    aleatorio = random.Random(args.semilla)
+    metricas = Metricas()
+
+    # Sustitutos locales y estado aislado en un directorio temporal
+    proceso_anki, url_anki = iniciar_ankiconnect(args.notas, args.latencia_anki)
+    api = ApiTelegramFalsa(max_mensajes=MAX_MENSAJES_API)
+    servidor, base_url = iniciar_servidor(api)
+    temporal = tempfile.mkdtemp(prefix="soak_")
+    os.environ.update({
+        "ANKICONNECT_URL": url_anki,
+        "GOOGLE_API_KEY": os.getenv("GOOGLE_API_KEY", "soak"),
+        "RECORD_TRAFFIC": "0",
+        "WORD_CACHE_PATH": os.path.join(temporal, "word_cache.json"),
+        "WORD_CACHE_PACK": "",
+        "NOTE_SIDECAR_PATH": os.path.join(temporal, "note_sidecar.db"),
+        "QUOTA_STATE_PATH": os.path.join(temporal, "quota_state.json"),
+        "BACKGROUND_DAILY_QUOTA": "0",
+        "LLM_BACKEND": "falso",
+        "TTS_ENGINE": "falso",
+        "TTS_CACHE_DIR": os.path.join(temporal, "audio_cache"),
+        "ANKI_SCOPES_PATH": os.path.join(temporal, "search_scopes.json"),
+    })
+
+    import anki_functions
+    import bot
+    from llm_backends import BackendFalso
+    from warmup import cargar_listas_frecuencia
+
+    # El log va a un archivo para no mezclarse con las muestras; se cuentan los errores
+    ruta_log = os.path.join(temporal, "soak.log")
+    logging.basicConfig(filename=ruta_log, level=logging.WARNING,
+                        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    logging.getLogger().addHandler(ContadorErrores(metricas))
+    anki_functions.backend_ia = BackendFalso(latencia=args.latencia_ia, tasa_error=args.error_ia)
+
+    ids = list(range(PRIMER_USUARIO, PRIMER_USUARIO + args.usuarios))
+    bot.ALLOWED_USER_IDS[:] = ids
+    existentes = palabras_existentes(args.notas) or ["achieve"]
+    general = cargar_listas_frecuencia()
+    usuarios = {
+        user_id: UsuarioSimulado(user_id, api, metricas, random.Random(aleatorio.random()),
+                                 args, existentes, general)
+        for user_id in ids
+    }
+
+    # Los mensajes enviados o editados por el bot llegan a la bandeja de su chat
+    bucle = asyncio.get_running_loop()
+
+    def repartir(mensaje):
+        if "error inesperado" in mensaje.get("text", ""):
+            metricas.errores_bot += 1
+        usuario = usuarios.get(mensaje["chat"]["id"])
+        if usuario is not None:
+            usuario.bandeja.put_nowait(mensaje)
+
+    def observar(metodo, params, resultado):
+        if isinstance(resultado, dict) and "chat" in resultado:
+            bucle.call_soon_threadsafe(repartir, dict(resultado))
+
+    api.observadores.append(observar)
+
+    aplicacion = bot.construir_aplicacion("1:soak", base_url=base_url, post_init_callback=None)
+    await aplicacion.initialize()
+    await bot.post_init(aplicacion)
+    await aplicacion.updater.start_polling(poll_interval=0.0, timeout=10)
+    await aplicacion.start()
+
+    inicio = time.monotonic()
+    fin = inicio + args.duracion
+    latido = asyncio.create_task(medir_latido(metricas))
+    tareas = [asyncio.create_task(usuario.ejecutar(fin)) for usuario in usuarios.values()]
+    print(f"🏋️ Soak de {args.duracion / 3600:.2f} h con {args.usuarios} usuarios "
+          f"(IA {args.latencia_ia:g}s/{100 * args.error_ia:g}% errores, {args.notas} notas), log en {ruta_log}")
+
+    filas = []
+    archivo = open(args.csv, "w", newline="", encoding="utf-8") if args.csv else None
+    escritor = None
+    try:
+        while time.monotonic() < fin:
+            await asyncio.sleep(min(args.intervalo, max(0.0, fin - time.monotonic())))
+            fila = muestra(inicio, metricas, aplicacion, api)
+            filas.append(fila)
+            if archivo is not None:
+                if escritor is None:
+                    escritor = csv.DictWriter(archivo, fieldnames=list(fila))
+                    escritor.writeheader()
+                escritor.writerow(fila)
+                archivo.flush()
+            print(f"[{datetime.now():%H:%M:%S}] {fila['segundos']:>6}s  RSS {fila['rss_mb']} MB  "
+                  f"sesiones {fila['sesiones']} ({fila['sesiones_kb']} KB)  tokens {fila['tokens_botones']}  "
+                  f"lag p99 {fila['lag_p99_ms']} ms  resp p95 {fila['respuesta_p95_ms']} ms  "
+                  f"ok {fila['sesiones_ok']}  fallos {fila['sesiones_fallidas']}  "
+                  f"errores {fila['errores_bot']}/{fila['errores_log']}", flush=True)
+        # Terminar las sesiones en curso
+        await asyncio.wait(tareas, timeout=PLAZO_RESPUESTA)
+        caidas = [t.exception() for t in tareas if t.done() and not t.cancelled() and t.exception()]
+        if caidas:
+            print(f"💥 {len(caidas)} usuarios simulados terminaron con una excepción: {caidas[0]!r}")
+    finally:
+        for tarea in tareas + [latido]:
+            tarea.cancel()
+        if archivo is not None:
+            archivo.close()
+        await aplicacion.updater.stop()
+        await aplicacion.stop()
+        await aplicacion.shutdown()
+        servidor.shutdown()
+        proceso_anki.terminate()
+
+    problemas = resumir(filas, metricas, args)
+    if args.csv:
+        print(f"💾 Serie temporal en {args.csv}")
+    if problemas:
+        print("\n⚠️ Problemas detectados:")
+        for problema in problemas:
+            print(f"   - {problema}")
+        return 1
+    print("\n✅ Sin fugas, degradación ni errores inesperados")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de resistencia del bot con usuarios simulados")
+    parser.add_argument("--usuarios", type=int, default=200)
+    parser.add_argument("--duracion", type=leer_duracion, default="10m", help="p. ej. 600, 30m, 4h")
+    parser.add_argument("--intervalo", type=float, default=30.0, help="segundos entre muestras")
+    parser.add_argument("--pausa", type=float, default=3.0, help="segundos medios que piensa un usuario")
+    parser.add_argument("--nuevas", type=float, default=0.3,
+                        help="fracción de búsquedas sin tarjeta de palabras inventadas (nunca en cache)")
+    parser.add_argument("--latencia-ia", type=float, default=0.5, help="segundos por llamada a la IA falsa")
+    parser.add_argument("--error-ia", type=float, default=0.02, help="fracción de llamadas a la IA que fallan")
+    parser.add_argument("--latencia-anki", type=float, default=0.01, help="segundos por llamada a AnkiConnect")
+    parser.add_argument("--notas", type=int, default=2000, help="notas sintéticas en el AnkiConnect falso")
+    parser.add_argument("--csv", help="archivo CSV para la serie temporal")
+    parser.add_argument("--calentamiento", type=float, default=0.25,
+                        help="fracción inicial de muestras que no cuenta para las tendencias")
+    parser.add_argument("--max-crecimiento", type=float, default=20.0, help="MB/h de RSS tolerados")
+    parser.add_argument("--max-sin-respuesta", type=float, default=0.01,
+                        help="fracción de sesiones sin respuesta tolerada")
+    parser.add_argument("--semilla", type=int, default=0)
+    sys.exit(asyncio.run(probar(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# update_scheduler.py
+"""
+Planificador de Updates: en paralelo entre usuarios y en orden dentro de cada usuario.
+
+Cada usuario tiene su propio candado FIFO, así que sus Updates (mensajes, botones)
+se procesan de uno en uno y en el orden de llegada, sin carreras sobre su sesión.
+Los Updates de usuarios distintos avanzan a la vez, con un límite global de Updates
+en ejecución. Si un usuario acumula demasiados Updates pendientes, los nuevos se
+descartan (contrapresión) en lugar de crecer sin límite en memoria.
+
+El trabajo de cada Update se registra en task_manager como tarea cancelable del
+usuario, con plazo máximo. Los Updates que interrumpen (según la función
+`interrumpe`, p. ej. el botón Cancelar o una palabra nueva) cancelan el trabajo en
+curso del usuario antes de ponerse en su cola, así no esperan a que termine.
+"""
+import os
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from task_manager import gestor_tareas
+from profiler import perfilador
+
+logger = logging.getLogger(__name__)
+
+# Updates ejecutándose a la vez entre todos los usuarios
+UPDATE_MAX_IN_FLIGHT = int(os.getenv("UPDATE_MAX_IN_FLIGHT", "16"))
+# Updates pendientes por usuario antes de descartar los nuevos
+UPDATE_USER_QUEUE = int(os.getenv("UPDATE_USER_QUEUE", "20"))
+
+# El semáforo de BaseUpdateProcessor se toma antes de conocer al usuario; se deja
+# prácticamente ilimitado y el límite real se aplica tras el candado del usuario,
+# para que un usuario en espera no ocupe plazas globales.
+_SIN_LIMITE = 1_000_000
+
+
+class _ColaUsuario:
+    __slots__ = ("candado", "pendientes")
+
+    def __init__(self):
+        self.candado = asyncio.Lock()
+        self.pendientes = 0
+
+
+class PlanificadorUpdates(BaseUpdateProcessor):
+    """BaseUpdateProcessor que serializa por usuario y limita el trabajo total"""
+
+    def __init__(self, max_en_curso=UPDATE_MAX_IN_FLIGHT, max_por_usuario=UPDATE_USER_QUEUE, interrumpe=None):
+        super().__init__(max_concurrent_updates=_SIN_LIMITE)
+        self.max_en_curso = max_en_curso
+        self.max_por_usuario = max_por_usuario
+        # Función(update) -> motivo (str) si el Update debe cancelar el trabajo en curso de su usuario, o None
+        self.interrumpe = interrumpe
+        self._colas = {}
+        self._limite = None
+        self.en_curso = 0
+        self.descartados = 0
+
+    async def initialize(self):
+        self._limite = asyncio.Semaphore(self.max_en_curso)
+
+    async def shutdown(self):
+        pass
+
+    @staticmethod
+    def clave_usuario(update):
+        """Usuario por el que se serializa el Update (None: no necesita orden)"""
+        if not isinstance(update, Update):
+            return None
+        # Las consultas inline solo leen la cache y no tocan la sesión
+        if update.inline_query is not None:
+            return None
+        usuario = update.effective_user or update.effective_chat
+        return usuario.id if usuario is not None else None
+
+    async def _ejecutar(self, coroutine, clave=None):
+        async with self._limite:
+            self.en_curso += 1
+            perfilando = perfilador.activo
+            try:
+                if clave is None:
+                    await coroutine
+                else:
+                    await gestor_tareas.ejecutar(clave, coroutine)
+            finally:
+                self.en_curso -= 1
+                if perfilando and perfilador.activo:
+                    perfilador.contar_update()
+
+    async def do_process_update(self, update, coroutine):
+        clave = self.clave_usuario(update)
+        if clave is None:
+            await self._ejecutar(coroutine)
+            return
+
+        cola = self._colas.get(clave)
+        if cola is None:
+            cola = self._colas[clave] = _ColaUsuario()
+        if cola.pendientes >= self.max_por_usuario:
+            self.descartados += 1
+            logger.warning("Update %s descartado: el usuario tiene %d pendientes",
+                           getattr(update, "update_id", "?"), cola.pendientes)
+            coroutine.close()
+            return
+
+        motivo = self.interrumpe(update) if self.interrumpe is not None else None
+        if motivo:
+            gestor_tareas.cancelar(clave, motivo)
+
+        cola.pendientes += 1
+        try:
+            async with cola.candado:
+                await self._ejecutar(coroutine, clave)
+        finally:
+            cola.pendientes -= 1
+            if cola.pendientes == 0:
+                self._colas.pop(clave, None)
+
+    def estadisticas(self):
+        return {
+            "en_curso": self.en_curso,
+            "usuarios_con_cola": len(self._colas),
+            "pendientes": sum(cola.pendientes for cola in self._colas.values()),
+            "descartados": self.descartados,
+        }
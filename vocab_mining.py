@@ -0,0 +1,160 @@
+# vocab_mining.py
+"""
+Extracción de vocabulario de textos pegados por el usuario.
+
+Divide el texto en palabras, las reduce a su forma base con un lematizador de
+reglas, descarta las palabras vacías y las que ya están en los decks (índice
+local, sin llamadas a AnkiConnect) y ordena las candidatas: primero el
+vocabulario médico, después las más repetidas en el texto y las más largas.
+"""
+import os
+import re
+import logging
+from collections import Counter
+
+from deck_index import indice_decks
+from word_cache import cache_palabras
+from warmup import DIRECTORIO_DATOS
+
+logger = logging.getLogger(__name__)
+
+# Palabras con contenido (sin contar las vacías) a partir de las cuales un mensaje
+# se trata como texto y no como palabra o expresión
+MINING_MIN_WORDS = int(os.getenv("MINING_MIN_WORDS", "6"))
+# Candidatas máximas que se ofrecen en el teclado
+MINING_MAX_CANDIDATES = int(os.getenv("MINING_MAX_CANDIDATES", "30"))
+# Palabras por llamada a la IA en la generación por lotes
+MINING_BATCH_SIZE = int(os.getenv("MINING_BATCH_SIZE", "10"))
+
+_PALABRA = re.compile(r"[a-z]+(?:['’-][a-z]+)*")
+
+PALABRAS_VACIAS = frozenset("""
+a about above after again against all almost also although always am among an and another any anyone
+anything are around as at away back be because been before being below between both but by can
+cannot could did do does doing done down during each either else enough even ever every few for
+from further get gets getting give given go goes going gone got had has have having he her here
+hers herself him himself his how however i if in into is it its itself just keep know last least
+less let like made make many may me might more most much must my myself near need neither never
+new next no nor not now of off often on once one only or other others our ours ourselves out over
+own per perhaps put quite rather really same say says see seem seen she should since so some
+someone something sometimes still such take than that the their theirs them themselves then there
+these they thing things this those though through thus to too toward towards under until up upon
+us use used using very via was way we well were what whatever when where whether which while who
+whom whose why will with within without would yes yet you your yours yourself yourselves
+""".split())
+
+# Formas irregulares frecuentes -> forma base
+IRREGULARES = {
+    "is": "be", "are": "be", "was": "be", "were": "be", "been": "be", "being": "be", "am": "be",
+    "has": "have", "had": "have", "having": "have", "does": "do", "did": "do", "done": "do",
+    "went": "go", "gone": "go", "took": "take", "taken": "take", "gave": "give", "given": "give",
+    "saw": "see", "seen": "see", "knew": "know", "known": "know", "thought": "think",
+    "brought": "bring", "bought": "buy", "caught": "catch", "taught": "teach", "found": "find",
+    "felt": "feel", "kept": "keep", "held": "hold", "began": "begin", "begun": "begin",
+    "wrote": "write", "written": "write", "ran": "run", "spoke": "speak", "spoken": "speak",
+    "chose": "choose", "chosen": "choose", "fell": "fall", "fallen": "fall", "grew": "grow",
+    "grown": "grow", "lay": "lie", "lain": "lie", "bled": "bleed", "fed": "feed", "slept": "sleep",
+    "children": "child", "men": "man", "women": "woman", "feet": "foot", "teeth": "tooth",
+    "mice": "mouse", "people": "person", "lives": "life", "wives": "wife", "knives": "knife",
+    "data": "data", "criteria": "criterion", "phenomena": "phenomenon", "bacteria": "bacterium",
+    "diagnoses": "diagnosis", "analyses": "analysis", "crises": "crisis",
+}
+
+_VOCALES = "aeiou"
+
+
+def _cargar_lista(nombre):
+    try:
+        with open(os.path.join(DIRECTORIO_DATOS, nombre), "r", encoding="utf-8") as f:
+            return frozenset(
+                linea.strip().lower() for linea in f if linea.strip() and not linea.startswith("#")
+            )
+    except OSError as e:
+        logger.error("No se pudo leer %s: %s", nombre, e)
+        return frozenset()
+
+
+VOCABULARIO_MEDICO = _cargar_lista("frecuencia_medica.txt")
+VOCABULARIO_GENERAL = _cargar_lista("frecuencia_general.txt")
+
+
+def tokenizar(texto):
+    """Palabras del texto en minúsculas (sin números ni signos de puntuación)"""
+    return _PALABRA.findall(texto.lower().replace("’", "'"))
+
+
+def es_texto(texto):
+    """
+    True si el mensaje parece un párrafo y no una palabra o expresión corta.
+    Las palabras vacías no cuentan: "to be on the safe side" sigue siendo una expresión.
+    """
+    return sum(1 for palabra in tokenizar(texto) if palabra not in PALABRAS_VACIAS) >= MINING_MIN_WORDS
+
+
+def _conocida(palabra, conocidas):
+    return (palabra in conocidas or palabra in VOCABULARIO_GENERAL or palabra in VOCABULARIO_MEDICO
+            or palabra in cache_palabras or indice_decks.contiene(palabra))
+
+
+def _lleva_e(raiz):
+    """True si la forma base probablemente termina en 'e' (mak-ing, relat-ed, us-ed)"""
+    if len(raiz) <= 3:
+        return raiz[-1] not in _VOCALES and raiz[-2] in _VOCALES
+    if raiz.endswith("at"):
+        # relat-ed, radiat-ing -> +e; treat-ed, float-ing -> no
+        return raiz[-3] not in "eo" or raiz.endswith("creat")
+    return raiz.endswith(("bl", "iz", "yz", "aus", "v", "c", "dg", "ur"))
+
+
+def lematizar(palabra, conocidas=frozenset()):
+    """
+    Reduce una palabra a su forma base con reglas de sufijos.
+    `conocidas` (p. ej. las demás palabras del texto) ayuda a elegir entre
+    varias formas posibles: "treated" -> "treat" si "treat" aparece.
+    """
+    if palabra in IRREGULARES:
+        return IRREGULARES[palabra]
+    if "'" in palabra:
+        palabra = palabra.split("'", 1)[0]
+
+    opciones = []
+    if palabra.endswith("ies") and len(palabra) > 4:
+        opciones = [palabra[:-3] + "y"]
+    elif palabra.endswith(("sses", "shes", "ches", "xes", "zes")):
+        opciones = [palabra[:-2]]
+    elif palabra.endswith("s") and not palabra.endswith(("ss", "us", "is")) and len(palabra) > 3:
+        opciones = [palabra[:-1]]
+    elif palabra.endswith("ied") and len(palabra) > 4:
+        opciones = [palabra[:-3] + "y"]
+    elif palabra.endswith(("ing", "ed")) and len(palabra) > 4:
+        raiz = palabra[:-3] if palabra.endswith("ing") else palabra[:-2]
+        opciones = [raiz, raiz + "e"]
+        if len(raiz) > 2 and raiz[-1] == raiz[-2] and raiz[-1] not in _VOCALES + "ls":
+            opciones.insert(0, raiz[:-1])
+        elif _lleva_e(raiz):
+            opciones.reverse()
+    if not opciones:
+        return palabra
+
+    for opcion in opciones:
+        if _conocida(opcion, conocidas):
+            return opcion
+    return opciones[0]
+
+
+def extraer_candidatas(texto, limite=MINING_MAX_CANDIDATES):
+    """
+    Devuelve las palabras del texto que merece la pena aprender, ordenadas.
+    Descarta palabras vacías, palabras de menos de 3 letras y las que ya están en los decks.
+    """
+    tokens = [t for t in tokenizar(texto) if len(t) >= 3 and t not in PALABRAS_VACIAS]
+    conocidas = frozenset(tokens)
+    lemas = Counter()
+    for token in tokens:
+        lema = lematizar(token, conocidas)
+        if len(lema) >= 3 and lema not in PALABRAS_VACIAS:
+            lemas[lema] += 1
+
+    candidatas = [lema for lema in lemas if not indice_decks.contiene(lema)]
+    candidatas.sort(key=lambda lema: (lema not in VOCABULARIO_MEDICO, -lemas[lema], -len(lema), lema))
+    return candidatas[:limite]
@@ -0,0 +1,92 @@
+# warmup.py
+import os
+import asyncio
+import logging
+
+from anki_functions import obtener_info_completa_ia
+from word_cache import cache_palabras
+from deck_index import indice_decks
+from quota_scheduler import planificador_cuota
+
+logger = logging.getLogger(__name__)
+
+DIRECTORIO_DATOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# Listas de frecuencia separadas por comas (inglés general + vocabulario médico por defecto)
+WARMUP_WORDLISTS = os.getenv(
+    "WARMUP_WORDLISTS",
+    ",".join([
+        os.path.join(DIRECTORIO_DATOS, "frecuencia_general.txt"),
+        os.path.join(DIRECTORIO_DATOS, "frecuencia_medica.txt")
+    ])
+)
+# Segundos entre generaciones consecutivas en segundo plano
+WARMUP_INTERVAL = float(os.getenv("WARMUP_INTERVAL", "5"))
+# Espera máxima a que termine de construirse el índice de decks
+ESPERA_INDICE = 120
+
+
+def cargar_listas_frecuencia(rutas=WARMUP_WORDLISTS):
+    """
+    Lee las listas de frecuencia (una palabra por línea, '#' para comentarios)
+    y las intercala para alternar vocabulario general y médico.
+    """
+    listas = []
+    for ruta in [r.strip() for r in rutas.split(",") if r.strip()]:
+        try:
+            with open(ruta, "r", encoding="utf-8") as f:
+                listas.append([
+                    linea.strip() for linea in f
+                    if linea.strip() and not linea.startswith("#")
+                ])
+        except OSError as e:
+            logger.error("No se pudo leer la lista de frecuencia %s: %s", ruta, e)
+
+    palabras, vistas = [], set()
+    for posicion in range(max((len(lista) for lista in listas), default=0)):
+        for lista in listas:
+            if posicion < len(lista) and lista[posicion].lower() not in vistas:
+                vistas.add(lista[posicion].lower())
+                palabras.append(lista[posicion])
+    return palabras
+
+
+def palabras_pendientes(palabras):
+    """Palabras que no están en la cache ni en los decks"""
+    return [p for p in palabras if p not in cache_palabras and not indice_decks.contiene(p)]
+
+
+async def calentar_cache():
+    """
+    Trabajo en segundo plano: pregenera las palabras de las listas de frecuencia
+    dentro de la cuota diaria y solo cuando no hay usuarios esperando.
+    """
+    if planificador_cuota.cuota_diaria <= 0:
+        return
+
+    # Esperar al índice de decks para no generar palabras que ya tienen tarjeta
+    for _ in range(ESPERA_INDICE):
+        if indice_decks.construido:
+            break
+        await asyncio.sleep(1)
+
+    pendientes = palabras_pendientes(cargar_listas_frecuencia())
+    logger.info("Precalentamiento: %d palabras pendientes", len(pendientes))
+
+    for palabra in pendientes:
+        while not await planificador_cuota.esperar_turno_fondo():
+            # Sin cuota: esperar al día siguiente
+            await asyncio.sleep(3600)
+
+        if palabra in cache_palabras or indice_decks.contiene(palabra):
+            continue
+
+        planificador_cuota.registrar_llamada(fondo=True)
+        datos = await asyncio.to_thread(obtener_info_completa_ia, palabra)
+        if datos is not None:
+            cache_palabras.guardar(palabra, datos)
+            logger.debug("Precalentada: %s", palabra)
+
+        await asyncio.sleep(WARMUP_INTERVAL)
+
+    logger.info("Precalentamiento completado")
@@ -0,0 +1,193 @@
+# word_cache.py
+import os
+import json
+import logging
+import threading
+
+from cache_pack import PaqueteCache
+from card_schema import campos_pendientes
+
+logger = logging.getLogger(__name__)
+
+WORD_CACHE_PATH = os.getenv("WORD_CACHE_PATH", "word_cache.json")
+# Líneas mínimas del diario antes de compactarlo en el JSON
+WORD_CACHE_COMPACT = int(os.getenv("WORD_CACHE_COMPACT", "500"))
+# Paquete de solo lectura con palabras pregeneradas (ver cache_pack.py)
+WORD_CACHE_PACK = os.getenv("WORD_CACHE_PACK", "word_cache.akwc")
+
+
+def normalizar_palabra(palabra):
+    """
+    Normaliza una palabra para usarla como clave (minúsculas y espacios simples).
+    """
+    return " ".join(str(palabra).strip().lower().split())
+
+
+class CachePalabras:
+    """
+    Cache local de la información generada por la IA, indexada por palabra.
+    Las palabras generadas en esta instancia se mantienen en memoria y se
+    persisten en un archivo JSON; las importadas se leen bajo demanda desde
+    un paquete mapeado en memoria.
+
+    Cada palabra nueva solo añade una línea a un diario (.jsonl). Cuando el diario
+    tiene más líneas que entradas la cache, un hilo lo compacta en el JSON.
+    """
+
+    def __init__(self, ruta=WORD_CACHE_PATH, ruta_paquete=WORD_CACHE_PACK, compactar=WORD_CACHE_COMPACT):
+        self.ruta = ruta
+        self.ruta_diario = f"{os.path.splitext(ruta)[0]}.jsonl" if ruta else None
+        self.compactar = compactar
+        self._datos = {}
+        self._lineas_diario = 0
+        self._compactando = None
+        self._lock = threading.Lock()
+        self.paquete = None
+        self._cargar()
+        self._abrir_paquete(ruta_paquete)
+
+    def _abrir_paquete(self, ruta_paquete):
+        if not ruta_paquete or not os.path.exists(ruta_paquete):
+            return
+        try:
+            self.paquete = PaqueteCache(ruta_paquete)
+            logger.info("Paquete de cache abierto: %d entradas", len(self.paquete))
+        except (OSError, ValueError) as e:
+            logger.error("No se pudo abrir el paquete de cache: %s", e)
+
+    def _cargar(self):
+        if not self.ruta:
+            return
+        if os.path.exists(self.ruta):
+            try:
+                with open(self.ruta, "r", encoding="utf-8") as f:
+                    self._datos = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error("No se pudo cargar la cache de palabras: %s", e)
+                self._datos = {}
+        # Un diario ".compactando" quedó de una compactación interrumpida: va antes que el actual
+        for ruta in (f"{self.ruta_diario}.compactando", self.ruta_diario):
+            self._lineas_diario += self._leer_diario(ruta)
+        if self._datos:
+            logger.info("Cache de palabras cargada: %d entradas", len(self._datos))
+
+    def _leer_diario(self, ruta):
+        if not os.path.exists(ruta):
+            return 0
+        lineas = 0
+        try:
+            with open(ruta, "r", encoding="utf-8") as f:
+                for linea in f:
+                    try:
+                        clave, datos = json.loads(linea)
+                    except ValueError:
+                        continue  # línea a medio escribir tras una caída
+                    self._datos[clave] = datos
+                    lineas += 1
+        except OSError as e:
+            logger.error("No se pudo leer el diario de la cache de palabras: %s", e)
+        return lineas
+
+    def _anotar(self, clave, datos_json):
+        """Añade la entrada al diario (con el lock tomado)"""
+        if not self.ruta_diario:
+            return
+        try:
+            with open(self.ruta_diario, "a", encoding="utf-8") as f:
+                f.write(json.dumps([clave, datos_json], ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.error("No se pudo guardar la cache de palabras: %s", e)
+            return
+        self._lineas_diario += 1
+        if self._compactando is None and self._lineas_diario > max(self.compactar, len(self._datos)):
+            # El diario se aparta y se sigue escribiendo en uno nuevo mientras un hilo
+            # escribe el JSON con una copia de los datos. Si ya hay uno apartado (una
+            # compactación que falló) no se pisa: la copia también lo incluye.
+            apartado = f"{self.ruta_diario}.compactando"
+            try:
+                if not os.path.exists(apartado):
+                    os.replace(self.ruta_diario, apartado)
+            except OSError as e:
+                logger.error("No se pudo compactar la cache de palabras: %s", e)
+                return
+            self._lineas_diario = 0
+            self._compactando = threading.Thread(
+                target=self._compactar, args=(dict(self._datos),), name="compactar-cache", daemon=True
+            )
+            self._compactando.start()
+
+    def _compactar(self, datos):
+        temporal = f"{self.ruta}.tmp"
+        try:
+            with open(temporal, "w", encoding="utf-8") as f:
+                json.dump(datos, f, ensure_ascii=False)
+            os.replace(temporal, self.ruta)
+            os.remove(f"{self.ruta_diario}.compactando")
+        except OSError as e:
+            logger.error("No se pudo compactar la cache de palabras: %s", e)
+        finally:
+            with self._lock:
+                self._compactando = None
+
+    def obtener(self, palabra, completa=False):
+        """
+        Devuelve los datos cacheados de una palabra o None.
+        Con completa=True, las entradas a las que aún les faltan los extras cuentan como ausentes.
+        """
+        clave = normalizar_palabra(palabra)
+        datos = self._datos.get(clave)
+        if datos is None and self.paquete is not None:
+            datos = self.paquete.obtener(clave)
+        if completa and datos is not None and campos_pendientes(datos):
+            return None
+        return datos
+
+    def guardar(self, palabra, datos_json):
+        """Guarda los datos de una palabra y la añade al diario"""
+        if not datos_json:
+            return
+        clave = normalizar_palabra(palabra)
+        with self._lock:
+            self._datos[clave] = datos_json
+            self._anotar(clave, datos_json)
+
+    def buscar_prefijo(self, prefijo, limite=5):
+        """Devuelve hasta `limite` entradas cuyas claves empiezan por el prefijo"""
+        prefijo = normalizar_palabra(prefijo)
+        if not prefijo:
+            return []
+        resultados = []
+        for clave, datos in self._datos.items():
+            if clave.startswith(prefijo):
+                resultados.append(datos)
+                if len(resultados) >= limite:
+                    return resultados
+        if self.paquete is not None:
+            # Las claves locales con el prefijo (ya incluidas) se saltan: se piden tantas de más
+            for clave, datos in self.paquete.buscar_prefijo(prefijo, limite + len(resultados)):
+                if clave not in self._datos:
+                    resultados.append(datos)
+                    if len(resultados) >= limite:
+                        break
+        return resultados
+
+    def elementos(self):
+        """Itera todas las entradas (clave, datos); las locales tienen prioridad sobre el paquete"""
+        if self.paquete is not None:
+            for clave, datos in self.paquete.elementos():
+                if clave not in self._datos:
+                    yield clave, datos
+        yield from list(self._datos.items())
+
+    def __contains__(self, palabra):
+        return self.obtener(palabra) is not None
+
+    def __len__(self):
+        """Palabras distintas: las locales más las del paquete que no se regeneraron localmente"""
+        if self.paquete is None:
+            return len(self._datos)
+        repetidas = sum(1 for clave in list(self._datos) if clave in self.paquete)
+        return len(self._datos) + len(self.paquete) - repetidas
+
+
+cache_palabras = CachePalabras()